@@ -4,7 +4,9 @@ Copyright (c) 2012-2017, Agora Games, LLC All rights reserved.
 https://github.com/agoragames/kairos/blob/master/LICENSE.txt
 '''
 from __future__ import absolute_import
-__version__ = "0.10.1"
+__version__ = "0.11.0"
 
-from .timeseries import Timeseries
+from .timeseries import Timeseries, Sample
+from .buffered import BufferedTimeseries, AsyncTimeseries
+from .sharded import ShardedTimeseries
 from .exceptions import *
@@ -0,0 +1,348 @@
+'''
+Copyright (c) 2012-2017, Agora Games, LLC All rights reserved.
+
+https://github.com/agoragames/kairos/blob/master/LICENSE.txt
+'''
+from .exceptions import *
+from .timeseries import Count
+
+from collections import deque
+import sys
+import threading
+import time
+
+if sys.version_info[:2] > (2, 6):
+    from collections import OrderedDict
+else:
+    from ordereddict import OrderedDict
+
+OVERFLOW_POLICIES = set(['evict', 'raise'])
+FULL_POLICIES = set(['block', 'drop_oldest', 'drop_newest'])
+
+class TimeseriesWrapper(object):
+  '''
+  Base class for wrappers which intercept inserts into a timeseries. All
+  other methods are passed through to the wrapped timeseries.
+  '''
+
+  def __init__(self, timeseries):
+    self._series = timeseries
+    # The timeseries at the bottom of a stack of wrappers
+    self._root = getattr(timeseries, '_root', timeseries)
+
+  def __getattr__(self, attr):
+    return getattr(self._series, attr)
+
+  def insert(self, name, value=None, timestamp=None, intervals=0, **kwargs):
+    '''
+    Insert a value for the timeseries "name". Arguments are the same as
+    Timeseries.insert, and as with Count.insert, value defaults to 1 for
+    counters.
+    '''
+    if value is None and isinstance(self._root, Count):
+      value = 1
+    if not isinstance(value, (list,tuple,set)):
+      value = [value]
+    self.bulk_insert( {timestamp : {name:value}}, intervals, **kwargs )
+
+  def bulk_insert(self, inserts, intervals=0, **kwargs):
+    '''
+    Perform a bulk insert, in the same format as Timeseries.bulk_insert.
+    '''
+    write_func = self._series._write_func
+    converted = OrderedDict()
+    for timestamp,names in inserts.iteritems():
+      timestamp = timestamp or time.time()
+      converted[timestamp] = names = dict(names)
+      if write_func:
+        for name,values in names.items():
+          names[name] = [ write_func(v) for v in values ]
+    self._batch_insert( converted, intervals, **kwargs )
+
+  def _batch_insert(self, inserts, intervals, **kwargs):
+    '''
+    Hand already converted inserts to the wrapper as a list of
+    ( name, values, timestamp, intervals ) tuples, so that wrappers can be
+    stacked on top of each other. Inserts with keyword arguments for the
+    backend, such as a pipeline, are written through to the wrapped
+    timeseries.
+    '''
+    if kwargs.pop('aggregated', False):
+      inserts = OrderedDict( (timestamp, dict( (name, self._root._expand(data))
+        for name,data in names.iteritems() ))
+        for timestamp,names in inserts.iteritems() )
+    if kwargs:
+      return self._series._batch_insert(inserts, intervals, **kwargs)
+
+    self._enqueue( [ (name, values, timestamp, intervals)
+      for timestamp,names in inserts.iteritems()
+      for name,values in names.iteritems() ] )
+
+  def _enqueue(self, items):
+    raise NotImplementedError()
+
+class BufferedTimeseries(TimeseriesWrapper):
+  '''
+  Write-behind wrapper around a timeseries. Inserts are collected in memory,
+  merged with other values which fall into the same buckets, and written to
+  the backend in batches. All other methods are passed through to the wrapped
+  timeseries, so reads will not see data which has not yet been flushed.
+  '''
+
+  def __init__(self, timeseries, **kwargs):
+    '''
+    Wrap a timeseries with an insert buffer. The supported keyword arguments
+    are:
+
+    flush_size
+      Optional, the number of buffered buckets at which the buffer will be
+      flushed. Defaults to 1000.
+
+    flush_interval
+      Optional, the number of seconds since the last flush after which an
+      insert will flush the buffer. Defaults to 10. If None, the buffer is
+      only flushed when it reaches flush_size or flush() is called.
+
+    max_size
+      Optional, the maximum number of buckets to hold in the buffer when it
+      can't be flushed, i.e. because the backend is unavailable. Defaults to
+      10 times flush_size. If None, the buffer is unbounded.
+
+    overflow
+      Optional, what to do when a new bucket would exceed max_size. Either
+      "evict" to drop the oldest bucket in the buffer, or "raise" to raise
+      BufferFull. Defaults to "evict".
+    '''
+    super(BufferedTimeseries,self).__init__(timeseries)
+    self._flush_size = kwargs.get('flush_size', 1000)
+    self._flush_interval = kwargs.get('flush_interval', 10)
+    self._max_size = kwargs.get('max_size', 10*self._flush_size)
+    self._overflow = kwargs.get('overflow', 'evict')
+    if self._overflow not in OVERFLOW_POLICIES:
+      raise ValueError("overflow must be one of %s"%(sorted(OVERFLOW_POLICIES)))
+
+    # { (name, intervals, buckets) : [ timestamp, data ] }
+    self._buffer = OrderedDict()
+    self._last_flush = time.time()
+    self._retry_at = 0
+    self.evicted = 0
+
+  def __len__(self):
+    return len(self._buffer)
+
+  def flush(self):
+    '''
+    Write all of the buffered data to the backend. If a write fails, the
+    data which was not written is kept in the buffer to be retried on the
+    next flush and the error is raised. Backends which partially applied the
+    failed write may then see some of that data twice.
+    '''
+    batches = OrderedDict()
+    for key,entry in self._buffer.iteritems():
+      batches.setdefault(key[1], OrderedDict())[key] = entry
+
+    self._buffer = OrderedDict()
+    self._last_flush = time.time()
+    while batches:
+      intervals,batch = batches.popitem(last=False)
+      inserts = OrderedDict()
+      for (name,_,_),(timestamp,data) in batch.iteritems():
+        inserts.setdefault(timestamp, {})[ name ] = data
+
+      try:
+        self._series._batch_insert(inserts, intervals, aggregated=True)
+      except Exception:
+        self._buffer = batch
+        for batch in batches.itervalues():
+          self._buffer.update( batch )
+        self._retry_at = time.time() + (self._flush_interval or 0)
+        raise
+
+  def _enqueue(self, items):
+    for name,values,timestamp,intervals in items:
+      self._buffer_values(name, values, timestamp, intervals)
+    self._check_flush()
+
+  def _buffer_values(self, name, values, timestamp, intervals):
+    '''
+    Merge values into the buffer for the buckets of "timestamp" in every
+    interval, so that the merged data can be written at any timestamp which
+    shares those buckets.
+    '''
+    buckets = tuple(
+      (config['i_calc'].to_bucket(timestamp), config['r_calc'].to_bucket(timestamp))
+      for config in self._series._intervals.itervalues() )
+    key = (name, intervals, buckets)
+
+    entry = self._buffer.get(key)
+    if entry is None:
+      if self._max_size is not None and len(self._buffer)>=self._max_size:
+        if self._overflow=='raise':
+          raise BufferFull(self._max_size)
+        self._buffer.popitem(last=False)
+        self.evicted += 1
+      self._buffer[key] = [timestamp, self._series._aggregate(values)]
+    else:
+      entry[1] = self._series._aggregate(values, entry[1])
+
+  def _check_flush(self):
+    '''
+    Flush the buffer if it has reached the size or time limit. Automatic
+    flushes are suspended until the flush interval has passed after a failure.
+    '''
+    now = time.time()
+    if now < self._retry_at:
+      return
+    if len(self._buffer)>=self._flush_size or \
+        (self._flush_interval is not None and now-self._last_flush>=self._flush_interval):
+      self.flush()
+
+class AsyncTimeseries(TimeseriesWrapper):
+  '''
+  Wrapper around a timeseries which decouples inserts from the backend.
+  Inserts are put on a bounded queue and written by a background thread in
+  batches. All other methods are passed through to the wrapped timeseries,
+  so reads will not see data which is still queued.
+  '''
+
+  def __init__(self, timeseries, **kwargs):
+    '''
+    Wrap a timeseries with an insert queue and start the writer thread. The
+    supported keyword arguments are:
+
+    max_size
+      Optional, the maximum number of inserts to queue, where each insert is
+      the values for one name and timestamp. Defaults to 10000.
+
+    batch_size
+      Optional, the maximum number of inserts to write in a single bulk
+      insert. Defaults to 1000.
+
+    full
+      Optional, what to do when an insert is made into a full queue. One of
+      "block" to wait for the writer, "drop_oldest" to discard the insert at
+      the head of the queue, or "drop_newest" to discard the new insert.
+      Defaults to "block".
+    '''
+    super(AsyncTimeseries,self).__init__(timeseries)
+    self._max_size = kwargs.get('max_size', 10000)
+    self._batch_size = kwargs.get('batch_size', 1000)
+    self._full = kwargs.get('full', 'block')
+    if self._full not in FULL_POLICIES:
+      raise ValueError("full must be one of %s"%(sorted(FULL_POLICIES)))
+
+    self._queue = deque()
+    self._cond = threading.Condition()
+    self._writing = False
+    self._closed = False
+
+    # Counters, all updated by the writer except for dropped
+    self.dropped = 0
+    self.errors = 0
+    self.last_error = None
+    self.flushes = 0
+    self.flush_latency = 0.0
+    self.flush_time = 0.0
+
+    self._writer = threading.Thread(target=self._run, name='kairos-writer')
+    self._writer.daemon = True
+    self._writer.start()
+
+  @property
+  def queue_depth(self):
+    '''
+    The number of inserts waiting to be written.
+    '''
+    return len(self._queue)
+
+  def flush(self):
+    '''
+    Wait until everything which has been queued has been written.
+    '''
+    with self._cond:
+      while self._queue or self._writing:
+        self._cond.wait()
+
+  def close(self):
+    '''
+    Write everything which has been queued and stop the writer thread. Any
+    further inserts will raise ValueError.
+    '''
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    self._writer.join()
+
+  def _enqueue(self, items):
+    with self._cond:
+      if self._closed:
+        raise ValueError('insert into closed timeseries')
+
+      for item in items:
+        while len(self._queue)>=self._max_size:
+          if self._full=='block':
+            self._cond.notify_all()
+            self._cond.wait()
+            # The writer may have exited while this was waiting
+            if self._closed:
+              raise ValueError('insert into closed timeseries')
+          elif self._full=='drop_oldest':
+            self.dropped += len(self._queue.popleft()[1])
+          else:
+            self.dropped += len(item[1])
+            item = None
+            break
+        if item is not None:
+          self._queue.append( item )
+      self._cond.notify_all()
+
+  def _run(self):
+    '''
+    Writer thread, which takes batches off of the queue until it is closed
+    and empty.
+    '''
+    while True:
+      with self._cond:
+        while not self._queue and not self._closed:
+          self._cond.wait()
+        if not self._queue:
+          return
+        batch = [ self._queue.popleft()
+          for _ in xrange(min(self._batch_size, len(self._queue))) ]
+        self._writing = True
+        self._cond.notify_all()
+
+      try:
+        self._write( batch )
+      except Exception as e:
+        # Keep the writer running so that flush() and close() can't wait
+        # on a dead thread
+        self.errors += 1
+        self.last_error = e
+      finally:
+        with self._cond:
+          self._writing = False
+          self._cond.notify_all()
+
+  def _write(self, batch):
+    '''
+    Write a batch of inserts with a bulk insert for each value of
+    "intervals". Errors are counted rather than raised so that the writer
+    keeps running, and the data in a failed write is lost.
+    '''
+    batches = OrderedDict()
+    for name,values,timestamp,intervals in batch:
+      names = batches.setdefault(intervals, OrderedDict()).setdefault(timestamp, {})
+      names.setdefault(name, []).extend( values )
+
+    for intervals,inserts in batches.iteritems():
+      start = time.time()
+      try:
+        self._series._batch_insert(inserts, intervals)
+      except Exception as e:
+        self.errors += 1
+        self.last_error = e
+      else:
+        self.flushes += 1
+        self.flush_latency = time.time() - start
+        self.flush_time += self.flush_latency
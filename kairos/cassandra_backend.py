@@ -176,14 +176,30 @@ class CassandraBackend(Timeseries):
     '''
     Insert the new value.
     '''
-    if self._value_type in QUOTE_TYPES and not QUOTE_MATCH.match(value):
-      value = "'%s'"%(value)
+    value = self._quote(value)
 
     for interval,config in self._intervals.items():
       timestamps = self._normalize_timestamps(timestamp, intervals, config)
       for tstamp in timestamps:
         self._insert_data(name, value, tstamp, interval, config, **kwargs)
 
+  def _insert_groups(self, groups, **kwargs):
+    '''
+    Insert values which have been grouped by bucket.
+    '''
+    for (interval, name, i_bucket, r_bucket),(timestamp, values) in groups.iteritems():
+      config = self._intervals[interval]
+      for value in values:
+        self._insert_data(name, self._quote(value), timestamp, interval, config)
+
+  def _quote(self, value):
+    '''
+    Quote a value if the value type requires it.
+    '''
+    if self._value_type in QUOTE_TYPES and not QUOTE_MATCH.match(value):
+      value = "'%s'"%(value)
+    return value
+
   @scoped_connection
   def _insert_data(self, connection, name, value, timestamp, interval, config):
     '''Helper to insert data into cql.'''
@@ -9,3 +9,6 @@ class KairosException(Exception):
 
 class UnknownInterval(KairosException):
   '''The requested interval is not configured.'''
+
+class BufferFull(KairosException):
+  '''The insert buffer is full and cannot accept any more data.'''
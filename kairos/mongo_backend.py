@@ -5,16 +5,45 @@ https://github.com/agoragames/kairos/blob/master/LICENSE.txt
 '''
 from .exceptions import *
 from .timeseries import *
+from .sharded import _concurrently
 
+import functools
+import hashlib
 import operator
 import sys
 import time
 import re
 import pymongo
 from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from urlparse import *
 
+# The collection which catalogs the first and last bucket of each interval of
+# each name
+NAMES_COLLECTION = '_kairos_names'
+
+# The aggregation operators which convert a value as each of the numeric
+# read functions would
+STATS_CONVERSIONS = { int : '$toLong', long : '$toLong', float : '$toDouble' }
+
+def _hash_key(value):
+  '''
+  Hash a histogram value to a field name which needs no escaping. Values
+  which are equal in python, such as 1, 1L and 1.0, have the same field.
+  '''
+  if isinstance(value, float) and value.is_integer():
+    value = int(value)
+  if isinstance(value, (int,long)):
+    value = 'i%d'%(value)
+  elif isinstance(value, unicode):
+    value = 's'+value.encode('utf-8')
+  elif isinstance(value, str):
+    value = 's'+value
+  else:
+    value = 'r'+repr(value)
+  return hashlib.md5(value).hexdigest()[:16]
+
 class MongoBackend(Timeseries):
   '''
   Mongo implementation of timeseries support.
@@ -44,6 +73,18 @@ class MongoBackend(Timeseries):
       raise TypeError('Mongo handle must be MongoClient or database instance')
 
     self._escape_character = kwargs.get('escape_character', u"\U0000FFFF")
+    self._batch_size = kwargs.get('batch_size', 1000)
+    self._parallel = kwargs.get('parallel', False)
+    self._flush_func = kwargs.get('flush_func')
+    self._embedded = kwargs.get('embedded', False)
+    self._hashed_keys = kwargs.get('hashed_keys', False)
+    if self._hashed_keys and not isinstance(self, Histogram):
+      raise ValueError('hashed_keys is only supported for histograms')
+    self._catalog_cache = OrderedDict()
+    self._catalog_cache_size = kwargs.get('catalog_cache_size', 10000)
+    if self._embedded and any( c.get('max_cardinality')
+        for c in kwargs.get('intervals',{}).values() ):
+      raise ValueError('max_cardinality is not supported for embedded resolutions')
     super(MongoBackend,self).__init__(client, **kwargs)
 
     # Define the indices for lookups and TTLs
@@ -56,7 +97,7 @@ class MongoBackend(Timeseries):
       # to the index and spec the fields in get() and series() so that we
       # get covered indices. There are reasons why that might be a
       # configuration option (performance vs. memory tradeoff)
-      if config['coarse']:
+      if config['coarse'] or self._embedded:
         self._client[interval].ensure_index(
           [('interval',ASCENDING),('name',ASCENDING)], background=True )
       else:
@@ -87,6 +128,18 @@ class MongoBackend(Timeseries):
   def _single_value(self):
     return True
 
+  def _escape(self, value):
+    '''
+    Escape a value so that it can be used as a field name.
+    '''
+    # need to hide the period of any values. best option seems to be to pick
+    # a character that "no one" uses.
+    if isinstance(value, (str,unicode)):
+      return value.replace('.', self._escape_character)
+    elif isinstance(value, float):
+      return str(value).replace('.', self._escape_character)
+    return value
+
   def _unescape(self, value):
     '''
     Recursively unescape values. Though slower, this doesn't require the user to
@@ -101,23 +154,107 @@ class MongoBackend(Timeseries):
     return value
 
   def list(self):
-    rval = set()
+    '''
+    List the names in the catalog which have data in one of the intervals of
+    this timeseries. The catalog is shared by every timeseries in the
+    database and its entries are not expired with the data, so names whose
+    last bucket has expired in every interval are skipped.
+    '''
+    spec = []
     for interval,config in self._intervals.items():
-      rval.update( self._client.command({'distinct':interval, 'key':'name'})['values'] )
-    return list(rval)
+      if config['expire']:
+        min_bucket = config['i_calc'].to_bucket( time.time(), -config['steps'] )
+        spec.append( {'intervals.%s.last'%(interval):{'$gte':min_bucket}} )
+      else:
+        spec.append( {'intervals.%s'%(interval):{'$exists':True}} )
+    return [ record['_id'] for record in
+      self._client[NAMES_COLLECTION].find({'$or':spec}, {'_id':True}) ]
 
   def properties(self, name):
+    '''
+    Get the first and last interval of each interval which has data from the
+    catalog. If the first bucket in the catalog has expired, the first bucket
+    which has not is found in the data.
+    '''
+    record = self._client[NAMES_COLLECTION].find_one( {'_id':name} ) or {}
+    intervals = record.get('intervals',{})
+
     rval = {}
     for interval,config in self._intervals.items():
-      rval.setdefault(interval, {})
-      query = {'name':name}
-      res = self._client[interval].find_one(query, sort=[('interval',ASCENDING)])
-      rval[interval]['first'] = config['i_calc'].from_bucket(res['interval'])
-      res = self._client[interval].find_one(query, sort=[('interval',DESCENDING)])
-      rval[interval]['last'] = config['i_calc'].from_bucket(res['interval'])
-
+      if interval not in intervals:
+        continue
+      first, last = intervals[interval]['first'], intervals[interval]['last']
+      if config['expire']:
+        min_bucket = config['i_calc'].to_bucket( time.time(), -config['steps'] )
+        if last < min_bucket:
+          continue
+        if first < min_bucket:
+          res = self._client[interval].find_one(
+            {'name':name, 'interval':{'$gte':min_bucket}}, sort=[('interval',ASCENDING)] )
+          if not res:
+            continue
+          first = res['interval']
+
+      rval[interval] = {
+        'first' : config['i_calc'].from_bucket(first),
+        'last' : config['i_calc'].from_bucket(last),
+      }
     return rval
 
+  def reindex(self):
+    '''
+    Build the catalog of names and interval buckets from the data which is
+    stored, for data written by a version of kairos which did not maintain
+    the catalog.
+    '''
+    for interval,config in self._intervals.items():
+      pipeline = [ {'$group':{'_id':'$name',
+        'first':{'$min':'$interval'}, 'last':{'$max':'$interval'}}} ]
+      for row in self._client[interval].aggregate(pipeline, cursor={}):
+        self._client[NAMES_COLLECTION].update( {'_id':row['_id']},
+          { '$min':{'intervals.%s.first'%(interval):row['first']},
+            '$max':{'intervals.%s.last'%(interval):row['last']} }, upsert=True )
+    self._catalog_cache.clear()
+
+  def _catalog(self, buckets):
+    '''
+    Add ( name, interval, interval bucket ) to the catalog of the first and
+    last buckets of each name, unless this process knows that they are
+    already within the range in the catalog. Writes once for each name.
+    '''
+    updates = OrderedDict()
+    for name, interval, i_bucket in buckets:
+      entry = (name, interval)
+      first, last = self._catalog_cache.pop(entry, (None, None))
+      if first is not None and first<=i_bucket<=last:
+        self._catalog_cache[entry] = (first, last)
+        continue
+
+      first = i_bucket if first is None else min(first, i_bucket)
+      last = i_bucket if last is None else max(last, i_bucket)
+      self._catalog_cache[entry] = (first, last)
+      if len(self._catalog_cache)>self._catalog_cache_size:
+        self._catalog_cache.popitem(last=False)
+
+      update = updates.setdefault(name, {'$min':{}, '$max':{}})
+      update['$min']['intervals.%s.first'%(interval)] = first
+      update['$max']['intervals.%s.last'%(interval)] = last
+
+    # If the write fails, forget the cached ranges because they may not have
+    # been applied
+    try:
+      if len(updates)==1:
+        name, update = updates.items()[0]
+        self._client[NAMES_COLLECTION].update( {'_id':name}, update, upsert=True )
+      elif updates:
+        bulk = self._client[NAMES_COLLECTION].initialize_unordered_bulk_op()
+        for name, update in updates.iteritems():
+          bulk.find( {'_id':name} ).upsert().update_one( update )
+        bulk.execute()
+    except Exception:
+      self._catalog_cache.clear()
+      raise
+
   def _batch_key(self, query):
     '''
     Get a unique id from a query.
@@ -126,8 +263,13 @@ class MongoBackend(Timeseries):
 
   def _batch_insert(self, inserts, intervals, **kwargs):
     '''
-    Batch insert implementation.
+    Batch insert implementation. Aggregated data is grouped by bucket and
+    written as for bulk_insert_arrays.
     '''
+    if kwargs.get('aggregated'):
+      return self._insert_groups( self._group_aggregates(inserts, intervals),
+        aggregated=True )
+
     updates = {}
     # TODO support flush interval
     for interval,config in self._intervals.items():
@@ -145,9 +287,87 @@ class MongoBackend(Timeseries):
               updates[batch_key]['insert'] = new_insert
 
     # now that we've collected a bunch of updates, flush them out
-    for spec in updates.values():
-      self._client[ spec['interval'] ].update(
-        spec['query'], spec['insert'], upsert=True, check_keys=False )
+    self._bulk_update( [ (spec['interval'], spec['query'], spec['insert'])
+      for spec in updates.values() ] )
+
+  def _insert_groups(self, groups, **kwargs):
+    '''
+    Specialized insert of grouped values, with a single update for each
+    record. If "aggregated" is True, the groups already hold the aggregated
+    data of each bucket.
+    '''
+    aggregated = kwargs.get('aggregated')
+    updates = []
+    for (interval, name, i_bucket, r_bucket),(timestamp, values) in groups.iteritems():
+      config = self._intervals[interval]
+      query, insert = self._bucket_spec(name, timestamp, config, i_bucket, r_bucket)
+      self._insert_type_aggregate( insert, values if aggregated else self._aggregate(values) )
+      updates.append( (interval, query, insert) )
+    self._bulk_update( updates )
+
+  def _bulk_update(self, updates):
+    '''
+    Upsert a list of ( interval, query, insert ) records with unordered bulk
+    operations of up to "batch_size" updates on each interval collection,
+    optionally running the collections in parallel threads.
+    '''
+    by_interval = {}
+    buckets = []
+    # The buckets are cataloged even if some of the writes fail, because the
+    # rest of them have been written
+    try:
+      for interval, query, insert in updates:
+        config = self._intervals[interval]
+        buckets.append( (query['name'], interval, query['interval']) )
+        # Capped updates have to read the record first
+        if config.get('max_cardinality'):
+          self._upsert( interval, config, query, insert )
+          continue
+
+        # Updates of resolutions embedded in the same document are merged, as
+        # they write to different paths
+        query, insert = self._embed( config, query, self._bound(insert, config) )
+        batch = by_interval.setdefault(interval, OrderedDict())
+        existing = batch.setdefault( self._batch_key(query), (query, {}) )[1]
+        for op,fields in insert.iteritems():
+          existing.setdefault(op, {}).update( fields )
+
+      calls = [ (self._bulk_update_interval, (interval, batch.values()))
+        for interval,batch in by_interval.items() ]
+      if self._parallel:
+        _concurrently( calls )
+      else:
+        for func, args in calls:
+          func( *args )
+    finally:
+      self._catalog( buckets )
+
+  def _bulk_update_interval(self, interval, updates):
+    '''
+    Write the updates to an interval collection in batches. Reports the
+    number of updates, the time taken and the number of write errors of
+    each batch to flush_func. The batches are unordered, so the rest of the
+    updates are written if any fail, and the first error is raised after all
+    of the batches have been sent.
+    '''
+    error = None
+    for i in xrange(0, len(updates), self._batch_size):
+      batch = updates[i:i+self._batch_size]
+      bulk = self._client[interval].initialize_unordered_bulk_op()
+      for query, insert in batch:
+        bulk.find( query ).upsert().update_one( insert )
+
+      start, errors = time.time(), 0
+      try:
+        bulk.execute()
+      except BulkWriteError as e:
+        errors = len(e.details.get('writeErrors',[])) or len(batch)
+        error = error or e
+      if self._flush_func:
+        self._flush_func(len(batch), time.time()-start, errors)
+
+    if error:
+      raise error
 
   def _insert(self, name, value, timestamp, intervals, **kwargs):
     '''
@@ -176,9 +396,24 @@ class MongoBackend(Timeseries):
     # For now, choosing to go with matching on the tuple until performance
     # testing can be done. Even then, there may be a variety of factors which
     # make the results situation-dependent.
-    insert = {'name':name, 'interval':config['i_calc'].to_bucket(timestamp)}
+    i_bucket = config['i_calc'].to_bucket(timestamp)
+    r_bucket = config['r_calc'].to_bucket(timestamp)
+    query, insert = self._bucket_spec(name, timestamp, config, i_bucket, r_bucket)
+
+    self._insert_type( insert, self._escape(value) )
+
+    # TODO: use write preference settings if we have them
+    if not kwargs.get('dry_run',False):
+      self._update( interval, config, query, insert )
+    return query, insert
+
+  def _bucket_spec(self, name, timestamp, config, i_bucket, r_bucket):
+    '''
+    Helper to generate the query and the initial update for a record.
+    '''
+    insert = {'name':name, 'interval':i_bucket}
     if not config['coarse']:
-      insert['resolution'] = config['r_calc'].to_bucket(timestamp)
+      insert['resolution'] = r_bucket
     # copy the query before expire_from as that is not indexed
     query = insert.copy()
 
@@ -186,21 +421,63 @@ class MongoBackend(Timeseries):
       insert['expire_from'] = datetime.utcfromtimestamp( timestamp )
 
     # switch to atomic updates
-    insert = {'$set':insert.copy()}
-
-    # need to hide the period of any values. best option seems to be to pick
-    # a character that "no one" uses.
-    if isinstance(value, (str,unicode)):
-      value = value.replace('.', self._escape_character)
-    elif isinstance(value, float):
-      value = str(value).replace('.', self._escape_character)
+    return query, {'$set':insert.copy()}
 
-    self._insert_type( insert, value )
+  def _update(self, interval, config, query, insert):
+    '''
+    Upsert a record and add its bucket to the catalog.
+    '''
+    self._upsert( interval, config, query, insert )
+    self._catalog( [(query['name'], interval, query['interval'])] )
 
+  def _upsert(self, interval, config, query, insert):
+    '''
+    Upsert a record.
+    '''
     # TODO: use write preference settings if we have them
-    if not kwargs.get('dry_run',False):
-      self._client[interval].update( query, insert, upsert=True, check_keys=False )
-    return query, insert
+    query, insert = self._embed( config, query, self._bound(insert, config) )
+    self._client[interval].update( query, insert, upsert=True, check_keys=False )
+
+  def _embed(self, config, query, insert):
+    '''
+    If the resolutions of an interval are embedded in a document per interval
+    bucket, move the resolution bucket from the query to the paths of the
+    values in the update.
+    '''
+    if not self._embedded or config['coarse']:
+      return query, insert
+
+    query = query.copy()
+    prefix = 'resolutions.%s.'%( query.pop('resolution') )
+    rval = {}
+    for op,fields in insert.iteritems():
+      rval[op] = {}
+      for key,value in fields.iteritems():
+        if key.split('.',1)[0] in ('value','total'):
+          rval[op][ prefix+key ] = value
+        elif key!='resolution':
+          rval[op][ key ] = value
+    return query, rval
+
+  def _resolution_records(self, cursor):
+    '''
+    Generate a record for each resolution bucket from records of interval
+    buckets in which the resolutions are embedded.
+    '''
+    for record in cursor:
+      if 'resolutions' not in record:
+        yield record
+        continue
+      for r_bucket,data in sorted( (int(r),data)
+          for r,data in record['resolutions'].iteritems() ):
+        yield dict(data, interval=record['interval'], resolution=r_bucket)
+
+  def _bound(self, insert, config):
+    '''
+    Limit an update to the number of values stored in a bucket, if the
+    interval is bounded.
+    '''
+    return insert
 
   def _get(self, name, interval, config, timestamp, **kws):
     '''
@@ -220,20 +497,23 @@ class MongoBackend(Timeseries):
 
       if record:
         data = process_row( self._unescape(record['value']) )
+        data = self._sample( data, record.get('total') )
         rval[ config['i_calc'].from_bucket(i_bucket) ] = data
       else:
         rval[ config['i_calc'].from_bucket(i_bucket) ] = self._type_no_value()
     else:
       sort = [('interval', ASCENDING), ('resolution', ASCENDING) ]
+      if self._embedded:
+        sort = sort[:1]
       if fetch:
         cursor = fetch( self._client[interval], spec=query, sort=sort, method='find' )
       else:
         cursor = self._client[interval].find( spec=query, sort=sort )
 
       idx = 0
-      for record in cursor:
+      for record in self._resolution_records(cursor):
         rval[ config['r_calc'].from_bucket(record['resolution']) ] = \
-          process_row(record['value'])
+          self._sample( process_row(self._unescape(record['value'])), record.get('total') )
 
     return rval
 
@@ -251,13 +531,15 @@ class MongoBackend(Timeseries):
 
     query = { 'name':name, 'interval':{'$gte':buckets[0], '$lte':buckets[-1]} }
     sort = [('interval', ASCENDING)]
-    if not config['coarse']:
+    if not config['coarse'] and not self._embedded:
       sort.append( ('resolution', ASCENDING) )
 
     if fetch:
       cursor = fetch( self._client[interval], spec=query, sort=sort, method='find' )
     else:
       cursor = self._client[interval].find( spec=query, sort=sort )
+    if not config['coarse']:
+      cursor = self._resolution_records( cursor )
     for record in cursor:
       while buckets and buckets[0] < record['interval']:
         rval[ config['i_calc'].from_bucket(buckets.pop(0)) ] = self._type_no_value()
@@ -265,7 +547,7 @@ class MongoBackend(Timeseries):
         buckets.pop(0)
 
       i_key = config['i_calc'].from_bucket(record['interval'])
-      data = process_row( record['value'] )
+      data = self._sample( process_row(self._unescape(record['value'])), record.get('total') )
       if config['coarse']:
         rval[ i_key ] = data
       else:
@@ -278,6 +560,133 @@ class MongoBackend(Timeseries):
 
     return rval
 
+  # Transforms which mongo can calculate for any values, those which it can
+  # calculate for numeric values, and the read functions which it can apply
+  _stats_transforms = frozenset()
+  _stats_value_transforms = frozenset()
+  _stats_read_funcs = NUMERIC_READ_FUNCS
+
+  def _get_kwargs(self, name, interval, kwargs):
+    return self._stats_kwargs(interval, kwargs,
+      kwargs.get('condensed', kwargs.get('condense')))
+
+  def _series_kwargs(self, name, interval, kwargs):
+    return self._stats_kwargs(interval, kwargs,
+      kwargs.get('condensed', kwargs.get('condense')) or kwargs.get('collapse'))
+
+  def _stats_kwargs(self, interval, kwargs, condense):
+    '''
+    If the transform can be calculated by an aggregation, return the keyword
+    arguments to fetch the BucketStats for each bucket rather than its data.
+    '''
+    config = self._intervals.get(interval)
+    transform = kwargs.get('transform')
+    if not config or not transform or kwargs.get('fetch') or kwargs.get('process_row'):
+      return kwargs
+    if kwargs.get('join_rows') or callable(condense) or callable(kwargs.get('collapse')):
+      return kwargs
+    if config.get('max_values'):
+      return kwargs
+    embedded = self._embedded and not config['coarse']
+    if embedded and not condense:
+      return kwargs
+
+    if isinstance(transform, (list,tuple,set)):
+      transforms = set(transform)
+    elif isinstance(transform, basestring):
+      transforms = set([transform])
+    else:
+      return kwargs
+
+    # The overflow of a bucket with a cap on its cardinality is only counted,
+    # so the stats of its values can't be calculated with the count
+    values = transforms - self._stats_transforms
+    if values and not (self._read_func in self._stats_read_funcs and
+        values <= self._stats_value_transforms and not config.get('max_cardinality')):
+      return kwargs
+
+    kwargs = dict(kwargs)
+    kwargs['fetch'] = functools.partial( self._stats_fetch,
+      by_interval=bool(condense) or config['coarse'], values=bool(values),
+      embedded=embedded )
+    kwargs['process_row'] = self._stats_row
+    return kwargs
+
+  def _stats_fetch(self, collection, spec, method, sort=None, by_interval=False,
+      values=False, embedded=False):
+    '''
+    Fetch the stats of each bucket matching the query with an aggregation, in
+    the form of records with a stats document as the value. If the buckets
+    are to be condensed, the resolutions of each interval are grouped too.
+    '''
+    group_id = {'interval':'$interval'}
+    if not by_interval:
+      group_id['resolution'] = '$resolution'
+    group = self._stats_group( values )
+    group.update( _id=group_id, resolution={'$min':'$resolution'} )
+
+    pipeline = [ {'$match':spec} ]
+    if embedded:
+      # Unwind the embedded resolutions into a document each, which can then
+      # only be grouped by interval because their buckets are field names
+      pipeline += [
+        {'$project':{'interval':1, 'resolutions':{'$objectToArray':'$resolutions'}}},
+        {'$unwind':'$resolutions'},
+        {'$project':{'interval':1, 'resolution':'$resolutions.k',
+          'value':'$resolutions.v.value'}},
+      ]
+    pipeline += self._stats_stages( values ) + \
+      [ {'$group':group}, {'$sort':{'_id.interval':1, 'resolution':1}} ]
+    records = ( {'interval':row['_id']['interval'],
+      'resolution':int(row['resolution']) if embedded else row['resolution'],
+      'value':row} for row in collection.aggregate(pipeline, cursor={}) )
+
+    if method=='find_one':
+      return next(records, None)
+    return records
+
+  def _stats_stages(self, values):
+    '''
+    Type-specific aggregation stages which prepare the values of a record to
+    be grouped.
+    '''
+    return []
+
+  def _stats_group(self, values):
+    '''
+    Type-specific accumulators of the stats of a group of records.
+    '''
+    raise NotImplementedError()
+
+  def _stats_value(self, field):
+    '''
+    Convert a field with the same read_func as a fetch, so that values which
+    were stored as strings are summed and compared as numbers.
+    '''
+    return { STATS_CONVERSIONS[self._read_func] : field }
+
+  def _stats_row(self, data):
+    '''
+    Convert the fetched stats for a bucket to BucketStats.
+    '''
+    return BucketStats( data['count'], data.get('total',0),
+      data.get('minimum'), data.get('maximum') )
+
+  def _transform(self, data, transform, step_size):
+    if isinstance(data, BucketStats):
+      return data.transform(transform, step_size)
+    return super(MongoBackend,self)._transform(data, transform, step_size)
+
+  def _condense(self, data):
+    if data and any( isinstance(row, BucketStats) for row in data.itervalues() ):
+      return BucketStats.merge( data.values() )
+    return super(MongoBackend,self)._condense(data)
+
+  def _join(self, rows):
+    if any( isinstance(row, BucketStats) for row in rows ):
+      return BucketStats.merge( rows )
+    return super(MongoBackend,self)._join(rows)
+
   def delete(self, name):
     '''
     Delete time series by name across all intervals. Returns the number of
@@ -289,6 +698,13 @@ class MongoBackend(Timeseries):
     for interval,config in self._intervals.items():
       # TODO: use write preference settings if we have them
       num_deleted += self._client[interval].remove( {'name':name} )['n']
+      self._catalog_cache.pop( (name, interval), None )
+
+    # Remove the intervals of this timeseries from the catalog, and the name
+    # if it has no others
+    self._client[NAMES_COLLECTION].update( {'_id':name}, {'$unset':
+      { 'intervals.%s'%(interval):True for interval in self._intervals } } )
+    self._client[NAMES_COLLECTION].remove( {'_id':name, 'intervals':{}} )
     return num_deleted
 
 class MongoSeries(MongoBackend, Series):
@@ -304,19 +720,167 @@ class MongoSeries(MongoBackend, Series):
   def _insert_type(self, spec, value):
     spec['$push'] = {'value':value}
 
+  def _insert_type_aggregate(self, spec, data):
+    spec['$push'] = {'value':{'$each':[ self._escape(v) for v in data ]}}
+
+  _stats_transforms = frozenset(['count', 'rate'])
+  _stats_value_transforms = frozenset(['sum', 'min', 'max', 'mean'])
+  # Floats, and strings with a period, are stored escaped and can't be
+  # converted by mongo
+  _stats_read_funcs = (int, long)
+
+  def _stats_stages(self, values):
+    if values:
+      return [ {'$unwind':'$value'} ]
+    return []
+
+  def _stats_group(self, values):
+    if values:
+      value = self._stats_value('$value')
+      return { 'count':{'$sum':1}, 'total':{'$sum':value},
+        'minimum':{'$min':value}, 'maximum':{'$max':value} }
+    return { 'count':{'$sum':{'$size':'$value'}} }
+
+  def _bound(self, insert, config):
+    '''
+    Keep the newest "max_values" values with $slice, and count the total
+    number of values inserted.
+    '''
+    max_values = config.get('max_values')
+    if max_values:
+      value = insert['$push']['value']
+      if not (isinstance(value, dict) and '$each' in value):
+        value = {'$each':[ value ]}
+      value['$slice'] = -max_values
+      insert['$push']['value'] = value
+      insert['$inc'] = {'total':len(value['$each'])}
+    return insert
+
 class MongoHistogram(MongoBackend, Histogram):
 
+  def _escape(self, value):
+    # Hashed keys store the values themselves
+    if self._hashed_keys:
+      return value
+    return super(MongoHistogram,self)._escape(value)
+
+  def _unescape(self, value):
+    if self._hashed_keys:
+      return value
+    return super(MongoHistogram,self)._unescape(value)
+
   def _batch(self, insert, existing):
     if not existing:
       return insert
 
     for value,incr in insert['$inc'].iteritems():
       existing['$inc'][value] = existing['$inc'].get(value,0)+incr
+    existing['$set'].update( (field,value)
+      for field,value in insert['$set'].iteritems() if field.startswith('value.') )
     return existing
 
   def _insert_type(self, spec, value):
+    if self._hashed_keys:
+      return self._insert_type_aggregate(spec, {value:1})
     spec['$inc'] = {'value.%s'%(value): 1}
 
+  def _insert_type_aggregate(self, spec, data):
+    if not self._hashed_keys:
+      spec['$inc'] = { 'value.%s'%(self._escape(v)): n for v,n in data.iteritems() }
+      return
+
+    # Each value is stored as { k : value, n : count } in a field named by
+    # its hash
+    spec['$inc'] = {}
+    for v,n in data.iteritems():
+      field = 'value.%s'%(_hash_key(v))
+      spec['$inc'][ field+'.n' ] = n
+      spec['$set'][ field+'.k' ] = v
+
+  def _process_row(self, data):
+    if self._hashed_keys:
+      data = { v['k']:v['n'] for v in data.itervalues() }
+    return super(MongoHistogram,self)._process_row(data)
+
+  # The values of a histogram are escaped field names, so only the counts
+  # can be summed by mongo unless the keys are hashed
+  _stats_transforms = frozenset(['count'])
+
+  @property
+  def _stats_value_transforms(self):
+    if self._hashed_keys:
+      return frozenset(['sum', 'min', 'max', 'mean'])
+    return frozenset()
+
+  def _stats_stages(self, values):
+    return [
+      {'$project':{'interval':1, 'resolution':1, 'value':{'$objectToArray':'$value'}}},
+      {'$unwind':'$value'},
+    ]
+
+  def _stats_group(self, values):
+    if not self._hashed_keys:
+      return { 'count':{'$sum':'$value.v'} }
+
+    group = { 'count':{'$sum':'$value.v.n'} }
+    if values:
+      value = self._stats_value('$value.v.k')
+      group.update( total={'$sum':{'$multiply':[value, '$value.v.n']}},
+        minimum={'$min':value}, maximum={'$max':value} )
+    return group
+
+  def _upsert(self, interval, config, query, insert):
+    '''
+    If the interval has a cap on its cardinality, read the record and then
+    update it only if no other values have been added since, counting the
+    values which do not fit as an overflow.
+    '''
+    limit = config.get('max_cardinality')
+    if not limit:
+      return super(MongoHistogram,self)._upsert(interval, config, query, insert)
+
+    if self._hashed_keys:
+      overflow_field = _hash_key(OVERFLOW_VALUE)
+      overflow_key = 'value.%s.n'%(overflow_field)
+    else:
+      overflow_field = OVERFLOW_VALUE
+      overflow_key = 'value.%s'%(OVERFLOW_VALUE)
+    while True:
+      record = self._client[interval].find_one( query )
+      existing = record['value'] if record else {}
+      size = len(existing) - (overflow_field in existing)
+
+      inc = {}
+      for key,count in insert['$inc'].iteritems():
+        if key[6:].split('.',1)[0] in existing:
+          inc[key] = count
+        elif size < limit:
+          inc[key] = count
+          size += 1
+        else:
+          inc[overflow_key] = inc.get(overflow_key,0) + count
+
+      # The number of values is tracked in "size" so that concurrent inserts
+      # of new values can be detected
+      spec = dict(query)
+      if record is not None and 'size' in record:
+        spec['size'] = record['size']
+      else:
+        spec['size'] = {'$exists':False}
+      # Only set the hashed keys of the values which were counted
+      fields = { field:value for field,value in insert['$set'].iteritems()
+        if not field.startswith('value.') or field[:-1]+'n' in inc }
+      if self._hashed_keys and overflow_key in inc:
+        fields[ 'value.%s.k'%(overflow_field) ] = OVERFLOW_VALUE
+      update = { '$set':dict(fields, size=size), '$inc':inc }
+      res = self._client[interval].update( spec, update,
+        upsert=(record is None), check_keys=False )
+      if res['n']:
+        break
+
+    if overflow_key in inc:
+      self._overflow(query['name'], interval, inc[overflow_key])
+
 class MongoCount(MongoBackend, Count):
 
   def _batch(self, insert, existing):
@@ -329,6 +893,9 @@ class MongoCount(MongoBackend, Count):
   def _insert_type(self, spec, value):
     spec['$inc'] = {'value':value}
 
+  def _insert_type_aggregate(self, spec, data):
+    spec['$inc'] = {'value':data}
+
 class MongoGauge(MongoBackend, Gauge):
 
   def _batch(self, insert, existing):
@@ -340,3 +907,6 @@ class MongoGauge(MongoBackend, Gauge):
 
   def _insert_type(self, spec, value):
     spec['$set']['value'] = value
+
+  def _insert_type_aggregate(self, spec, data):
+    spec['$set']['value'] = self._escape(data)
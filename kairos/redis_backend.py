@@ -8,11 +8,194 @@ from .timeseries import *
 
 import operator
 import sys
+
+if sys.version_info[:2] > (2, 6):
+    from collections import OrderedDict
+else:
+    from ordereddict import OrderedDict
 import time
 import re
+import binascii
+import itertools
+import os
+import struct
+import zlib
 from urlparse import *
 from redis import Redis
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# The maximum number of keys to UNLINK in a single command
+DELETE_BATCH = 1000
+
+# Insert a value into the buckets of every interval in a single call. ARGV is
+# the key prefix, the name, the value, then for each bucket the interval name,
+# interval bucket, resolution bucket ('' if coarse) and TTL (0 for none). The
+# type-specific write to "key" is substituted for WRITE.
+INSERT_SCRIPT = '''
+local prefix, name, value = ARGV[1], ARGV[2], ARGV[3]
+local base = prefix .. name
+redis.call('sadd', prefix .. '_names', name)
+for i = 4, #ARGV, 4 do
+  local interval, i_bucket = base .. ':' .. ARGV[i] .. ':', ARGV[i+1]
+  local i_key = interval .. i_bucket
+  local r_bucket, ttl = ARGV[i+2], tonumber(ARGV[i+3])
+  redis.call('zadd', interval .. 'buckets', i_bucket, i_bucket)
+  local key = i_key
+  if r_bucket ~= '' then
+    redis.call('sadd', i_key, r_bucket)
+    key = i_key .. ':' .. r_bucket
+  end
+  WRITE
+  if ttl > 0 then
+    redis.call('expire', i_key, ttl)
+    if key ~= i_key then
+      redis.call('expire', key, ttl)
+    end
+  end
+end
+'''
+
+# Summarize the histogram in KEYS[1] as its count, sum, min and max, so that
+# transforms can be calculated without fetching the whole hash. Numbers are
+# returned as strings because redis truncates Lua numbers to integers.
+HISTOGRAM_STATS_SCRIPT = '''
+local function str(n) return n and string.format('%.17g', n) end
+local count, total, minimum, maximum = 0, 0, false, false
+local data = redis.call('hgetall', KEYS[1])
+for i = 1, #data, 2 do
+  local value, n = tonumber(data[i]), tonumber(data[i+1])
+  count = count + n
+  if value then
+    total = total + value * n
+    if not minimum or value < minimum then minimum = value end
+    if not maximum or value > maximum then maximum = value end
+  end
+end
+return { str(count), str(total), str(minimum), str(maximum) }
+'''
+
+# Insert into a bucket of at most ARGV[1] distinct values. ARGV is the limit,
+# the name, the interval and the overflow value, then the values to insert.
+# Returns the name, interval and number of values which overflowed, if any
+# did.
+HISTOGRAM_CAPPED_SCRIPT = '''
+local key, limit, overflow = KEYS[1], tonumber(ARGV[1]), 0
+local size = redis.call('hlen', key) - redis.call('hexists', key, ARGV[4])
+for i = 5, #ARGV, 2 do
+  local value, count = ARGV[i], tonumber(ARGV[i+1])
+  if redis.call('hexists', key, value) == 1 then
+    redis.call('hincrby', key, value, count)
+  elseif size < limit then
+    redis.call('hincrby', key, value, count)
+    size = size + 1
+  else
+    overflow = overflow + count
+  end
+end
+if overflow > 0 then
+  redis.call('hincrby', key, ARGV[4], overflow)
+  return { ARGV[2], ARGV[3], overflow }
+end
+'''
+
+# As above for sets, which have no overflow value and only count the values
+# which overflow
+SET_CAPPED_SCRIPT = '''
+local key, limit, overflow = KEYS[1], tonumber(ARGV[1]), 0
+local size = redis.call('scard', key)
+for i = 4, #ARGV do
+  if redis.call('sismember', key, ARGV[i]) == 0 then
+    if size < limit then
+      redis.call('sadd', key, ARGV[i])
+      size = size + 1
+    else
+      overflow = overflow + 1
+    end
+  end
+end
+if overflow > 0 then
+  return { ARGV[2], ARGV[3], overflow }
+end
+'''
+
+def _number(value):
+  '''
+  Parse a number returned from redis.
+  '''
+  if value is None:
+    return None
+  if '.' in value or 'e' in value or 'n' in value:
+    return float(value)
+  return int(value)
+
+# BITFIELD integer types for packed counters
+PACKED_TYPE = re.compile('^([iu])(\d+)$')
+
+def _unpack(data, bftype):
+  '''
+  Decode a string of packed BITFIELD integers of type "bftype" into a list,
+  or a numpy array if numpy is installed and the type is a whole number of
+  bytes.
+  '''
+  if not data:
+    return []
+  signed, width = bftype[0]=='i', int(bftype[1:])
+  count = len(data)*8 // width
+
+  if width in (8,16,32,64):
+    if numpy is not None:
+      dtype = numpy.dtype( '>%s%d'%('i' if signed else 'u', width//8) )
+      return numpy.frombuffer( data, dtype, count )
+    code = {8:'b', 16:'h', 32:'i', 64:'q'}[width]
+    return struct.unpack( '>%d%s'%(count, code if signed else code.upper()),
+      data[:count*width//8] )
+
+  # Fields are big-endian and not aligned to bytes
+  bits = int( binascii.hexlify(data), 16 )
+  total, mask = len(data)*8, (1<<width)-1
+  rval = []
+  for slot in xrange(count):
+    value = (bits >> (total-(slot+1)*width)) & mask
+    if signed and value>>(width-1):
+      value -= 1<<width
+    rval.append( value )
+  return rval
+
+# struct types for packed series, which are stored little-endian
+PACKED_SERIES_TYPES = 'bBhHiIqQfd'
+
+def _unpack_values(data, code):
+  '''
+  Decode a string of packed little-endian values of the struct type "code"
+  into a list.
+  '''
+  if not data:
+    return []
+  if numpy is not None:
+    return numpy.frombuffer( data, numpy.dtype('<'+code) ).tolist()
+  return list( struct.unpack('<%d%s'%(len(data)//struct.calcsize(code), code), data) )
+
+# Members of ordered series are prefixed with a big-endian sequence number and
+# a random instance id, so that repeated values are unique and values with the
+# same score are read in the order they were written
+ORDERED_PREFIX = 12
+
+def _encode(value):
+  '''
+  Encode a value the same way that redis-py does.
+  '''
+  if isinstance(value, str):
+    return value
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
 class RedisBackend(Timeseries):
   '''
   Redis implementation of timeseries support.
@@ -40,6 +223,51 @@ class RedisBackend(Timeseries):
     if len(self._prefix) and not self._prefix.endswith(':'):
       self._prefix += ':'
 
+    # In cluster mode the name is a hash tag, so that all of the keys for a
+    # stat are stored in the same slot
+    self._cluster = kwargs.get('cluster',
+      client.__module__.split('.')[0]=='rediscluster')
+    if self._cluster and kwargs.get('lua_insert'):
+      raise ValueError('lua_insert is not supported in cluster mode')
+
+    # LRU cache of { key : (ttl, expiry time) } for the TTLs this process has
+    # applied, so that repeated EXPIREs of the same key can be skipped
+    self._expire_cache = OrderedDict()
+    self._expire_cache_size = kwargs.get('expire_cache_size', 10000)
+
+    # The set of all names, and an LRU cache of { (index key, interval bucket)
+    # : expiry time } for the buckets that this process has added to the
+    # index, sized the same as the expire cache
+    self._names_key = '%s_names'%(self._prefix)
+    self._index_cache = OrderedDict()
+    self._pipeline_size = kwargs.get('pipeline_size')
+    self._flush_func = kwargs.get('flush_func')
+
+    # Coarse buckets can be stored as fields in a number of hashes per
+    # bucket rather than in their own keys
+    self._hash_buckets = kwargs.get('hash_buckets')
+    self._hash_prefix = '%s_hash:'%(self._prefix)
+    if self._hash_buckets:
+      if not self._type_hash_insert:
+        raise ValueError('hash_buckets is only supported for counts and gauges')
+      if kwargs.get('lua_insert'):
+        raise ValueError('lua_insert is not supported with hash_buckets')
+
+    # Buckets with a cap on their cardinality are written with a script, which
+    # reports the values which overflowed in the reply of the pipeline
+    self._capped_script = None
+    if any( c.get('max_cardinality') for c in kwargs.get('intervals',{}).values() ):
+      if not self._type_capped_script:
+        raise ValueError('max_cardinality is only supported for histograms and sets')
+      if self._cluster or kwargs.get('lua_insert'):
+        raise ValueError('max_cardinality is not supported in cluster mode or with lua_insert')
+      self._capped_script = client.register_script( self._type_capped_script )
+
+    self._insert_script = None
+    if kwargs.get('lua_insert'):
+      self._insert_script = client.register_script(
+        INSERT_SCRIPT.replace('WRITE', self._type_insert_script) )
+
     super(RedisBackend,self).__init__( client, **kwargs )
 
   @classmethod
@@ -54,78 +282,208 @@ class RedisBackend(Timeseries):
     '''
     i_bucket = config['i_calc'].to_bucket( timestamp )
     r_bucket = config['r_calc'].to_bucket( timestamp )
+    i_key, r_key = self._bucket_keys(config, name, i_bucket, r_bucket)
+
+    return i_bucket, r_bucket, i_key, r_key
 
-    i_key = '%s%s:%s:%s'%(self._prefix, name, config['interval'], i_bucket)
+  def _bucket_keys(self, config, name, i_bucket, r_bucket):
+    '''
+    Calculate keys given a stat name and its interval and resolution buckets.
+    '''
+    i_key = '%s:%s:%s'%(self._name_key(name), config['interval'], i_bucket)
     r_key = '%s:%s'%(i_key, r_bucket)
 
-    return i_bucket, r_bucket, i_key, r_key
+    return i_key, r_key
+
+  def _index_key(self, name, interval):
+    '''
+    Calculate the key of the sorted set of interval buckets for a stat.
+    '''
+    return '%s:%s:buckets'%(self._name_key(name), interval)
+
+  def _hash_key(self, config, name, i_bucket):
+    '''
+    Calculate the key of the hash which stores the interval bucket of a stat
+    if the interval is hashed.
+    '''
+    if isinstance(name, unicode):
+      shard = zlib.crc32( name.encode('utf-8') )
+    else:
+      shard = zlib.crc32( name )
+    shard = (shard & 0xffffffff) % self._hash_buckets
+    return '%s%s:%s:%s'%(self._hash_prefix, config['interval'], i_bucket, shard)
+
+  def _hashed(self, config):
+    '''
+    Return True if the interval buckets are stored in hashes.
+    '''
+    return bool(self._hash_buckets) and config['coarse']
+
+  def _bounded(self, config):
+    '''
+    Return the maximum number of values stored in each bucket of an
+    interval, or None if it is unbounded.
+    '''
+    return None
+
+  def _total_key(self, key):
+    '''
+    Calculate the key of the total number of values inserted into a bounded
+    bucket.
+    '''
+    return '%s:total'%(key)
+
+  def _name_key(self, name):
+    '''
+    Calculate the part of the keys for a stat which is the prefixed name.
+    '''
+    if self._cluster:
+      return '%s{%s}'%(self._prefix, name)
+    return '%s%s'%(self._prefix, name)
 
   def list(self):
-    keys = self._client.keys()
-    rval = set()
-    for key in keys:
-      key = key[len(self._prefix):]
-      rval.add( key.split(':')[0] )
-    return list(rval)
+    '''
+    List the names which have data in any interval. Buckets which have
+    expired are removed from the index first, as for properties(), but names
+    are only removed from the set of names by delete().
+    '''
+    names = list(self._client.smembers(self._names_key))
+    intervals = self._intervals.values()
+    pipe = self._client.pipeline(transaction=False)
+    for name in names:
+      for config in intervals:
+        index_key = self._index_key(name, config['interval'])
+        if config['expire']:
+          min_bucket = config['i_calc'].to_bucket( time.time(), -config['steps'] )
+          pipe.zremrangebyscore(index_key, '-inf', '(%s'%(min_bucket))
+        pipe.zcard(index_key)
+    res = iter( pipe.execute() )
+
+    rval = []
+    for name in names:
+      live = False
+      for config in intervals:
+        if config['expire']:
+          next(res)
+        live = next(res)>0 or live
+      if live:
+        rval.append( name )
+    return rval
 
   def properties(self, name):
-    prefix = '%s%s:'%(self._prefix,name)
-    keys = self._client.keys('%s*'%(prefix))
+    '''
+    Get the first and last interval of each interval which has data. Buckets
+    which have expired are removed from the index first.
+    '''
+    intervals = self._intervals.values()
+    pipe = self._client.pipeline(transaction=False)
+    for config in intervals:
+      index_key = self._index_key(name, config['interval'])
+      if config['expire']:
+        min_bucket = config['i_calc'].to_bucket( time.time(), -config['steps'] )
+        pipe.zremrangebyscore(index_key, '-inf', '(%s'%(min_bucket))
+      pipe.zrange(index_key, 0, 0)
+      pipe.zrange(index_key, -1, -1)
+    res = [ r for r in pipe.execute() if isinstance(r, list) ]
+
     rval = {}
+    for idx,config in enumerate(intervals):
+      first, last = res[2*idx], res[2*idx+1]
+      if first:
+        rval[ config['interval'] ] = {
+          'first' : config['i_calc'].from_bucket( int(first[0]) ),
+          'last' : config['i_calc'].from_bucket( int(last[0]) ),
+        }
+    return rval
 
-    for key in keys:
-      key = key[len(prefix):].split(':')
-      rval.setdefault( key[0], {} )
-      if 'first' in rval[key[0]]:
-        rval[key[0]]['first'] = min(rval[key[0]]['first'], int(key[1]))
-      else:
-        rval[key[0]]['first'] = int(key[1])
-      if 'last' in rval[key[0]]:
-        rval[key[0]]['last'] = max(rval[key[0]]['last'], int(key[1]))
-      else:
-        rval[key[0]]['last'] = int(key[1])
-
-    for interval, properties in rval.items():
-      # It's possible that there is data stored for which an interval
-      # is not defined.
-      if interval in self._intervals:
-        config = self._intervals[interval]
-        properties['first'] = config['i_calc'].from_bucket( properties['first'] )
-        properties['last'] = config['i_calc'].from_bucket( properties['last'] )
-      else:
-        rval.pop(interval)
+  def reindex(self):
+    '''
+    Build the index of names and interval buckets from the keys which are
+    stored, for data written by a version of kairos which did not maintain
+    the index. Uses SCAN so as not to block redis.
+    '''
+    pipe = self._client.pipeline(transaction=False)
+    for key in self._client.scan_iter(match='%s*'%(self._prefix), count=1000):
+      parts = key[len(self._prefix):].split(':')
+      # Skip resolution buckets, the index itself and anything else
+      if len(parts)!=3 or not parts[2].lstrip('-').isdigit():
+        continue
 
-    return rval
+      name, interval, bucket = parts
+      if self._cluster:
+        name = name.strip('{}')
+      pipe.sadd(self._names_key, name)
+      pipe.zadd(self._index_key(name, interval), bucket, bucket)
+      if len(pipe)>=1000:
+        pipe.execute()
+    pipe.execute()
 
   def _batch_insert(self, inserts, intervals, **kwargs):
     '''
-    Specialized batch insert
+    Specialized batch insert. Values are aggregated by bucket before they are
+    written, so there is a single write for each key in the batch.
+    '''
+    if kwargs.get('aggregated'):
+      groups = self._group_aggregates(inserts, intervals)
+    else:
+      groups = self._group_inserts(inserts, intervals)
+    self._insert_groups( groups, **kwargs )
+
+  def _insert_groups(self, groups, **kwargs):
+    '''
+    Specialized insert of grouped values, with a single aggregated write for
+    each bucket. If "aggregated" is True, the groups already hold the
+    aggregated data of each bucket. If pipeline_size is configured, the
+    pipeline is executed whenever it holds that many commands, along with the
+    TTLs for the keys written since the last execution.
     '''
     if 'pipeline' in kwargs:
       pipe = kwargs.get('pipeline')
-      own_pipe = False
     else:
       pipe = self._client.pipeline(transaction=False)
-      kwargs['pipeline'] = pipe
-      own_pipe = True
+    flush = self._pipeline_size and 'pipeline' not in kwargs
 
+    aggregated = kwargs.get('aggregated')
     ttl_batch = set()
-    for timestamp,names in inserts.iteritems():
-      for name,values in names.iteritems():
-        for value in values:
-          # TODO: support config param to flush the pipe every X inserts
-          self._insert( name, value, timestamp, intervals, ttl_batch=ttl_batch, **kwargs )
+    for (interval, name, i_bucket, r_bucket),(timestamp, values) in groups.iteritems():
+      config = self._intervals[interval]
+      data = values if aggregated else self._aggregate(values)
+      self._insert_bucket(name, data, timestamp, config,
+        i_bucket, r_bucket, pipe, self._type_insert_aggregate, ttl_batch)
+      if flush and len(pipe)>=self._pipeline_size:
+        self._flush(pipe, ttl_batch)
 
+    if 'pipeline' in kwargs:
+      for ttl_args in ttl_batch:
+        self._expire(pipe, *ttl_args)
+    else:
+      self._flush(pipe, ttl_batch)
+
+  def _flush(self, pipe, ttl_batch):
+    '''
+    Set the batched TTLs and execute the pipeline, which can then be reused.
+    Reports the number of commands and the time taken to flush_func.
+    '''
     for ttl_args in ttl_batch:
-      pipe.expire(*ttl_args)
+      self._expire(pipe, *ttl_args)
+    ttl_batch.clear()
 
-    if own_pipe:
-      kwargs['pipeline'].execute()
+    if self._flush_func:
+      commands, start = len(pipe), time.time()
+      if commands:
+        self._execute(pipe)
+        self._flush_func(commands, time.time()-start)
+    else:
+      self._execute(pipe)
 
   def _insert(self, name, value, timestamp, intervals, **kwargs):
     '''
     Insert the value.
     '''
+    if self._insert_script:
+      return self._insert_scripted(name, value, timestamp, intervals,
+        kwargs.get('pipeline'))
+
     if 'pipeline' in kwargs:
       pipe = kwargs.get('pipeline')
     else:
@@ -138,158 +496,807 @@ class RedisBackend(Timeseries):
           ttl_batch=kwargs.get('ttl_batch'))
 
     if 'pipeline' not in kwargs:
-      pipe.execute()
+      self._execute(pipe)
+
+  def _insert_scripted(self, name, value, timestamp, intervals, pipe=None):
+    '''
+    Insert the value into every interval with a single call to the insert
+    script, or a single command in the pipeline if one is supplied.
+    '''
+    args = [ self._prefix, name, value ]
+    for interval,config in self._intervals.iteritems():
+      timestamps = self._normalize_timestamps(timestamp, intervals, config)
+      for tstamp in timestamps:
+        # Calculate the TTL and skip if inserting into the past
+        expire, ttl = config['expire'], config['ttl'](tstamp)
+        if expire and not ttl:
+          continue
+
+        i_bucket = config['i_calc'].to_bucket( tstamp )
+        r_bucket = config['r_calc'].to_bucket( tstamp )
+        if expire:
+          i_key, r_key = self._bucket_keys(config, name, i_bucket, r_bucket)
+          cached = self._expire_cached(i_key, ttl)
+          if not config['coarse']:
+            cached = self._expire_cached(r_key, ttl) and cached
+          if cached:
+            ttl = 0
+
+        args.extend( (interval, i_bucket, '' if config['coarse'] else r_bucket,
+          ttl or 0) )
+
+    if len(args)>3:
+      try:
+        self._insert_script(args=args, client=pipe or self._client)
+      except Exception:
+        self._clear_caches()
+        raise
 
   def _insert_data(self, name, value, timestamp, interval, config, pipe, ttl_batch=None):
     '''Helper to insert data into redis'''
+    i_bucket = config['i_calc'].to_bucket( timestamp )
+    r_bucket = config['r_calc'].to_bucket( timestamp )
+    self._insert_bucket(name, value, timestamp, config, i_bucket, r_bucket,
+      pipe, self._type_insert, ttl_batch)
+
+  def _insert_bucket(self, name, value, timestamp, config, i_bucket, r_bucket,
+      pipe, type_insert, ttl_batch=None):
+    '''
+    Helper to write data into an interval and resolution bucket using one
+    of the type insert functions.
+    '''
     # Calculate the TTL and abort if inserting into the past
     expire, ttl = config['expire'], config['ttl'](timestamp)
     if expire and not ttl:
       return
 
-    i_bucket, r_bucket, i_key, r_key = self._calc_keys(config, name, timestamp)
+    self._index_bucket(pipe, name, config, i_bucket, ttl if expire else None)
+    i_key, r_key = self._bucket_keys(config, name, i_bucket, r_bucket)
 
-    if config['coarse']:
-      self._type_insert(pipe, i_key, value)
+    if config.get('max_cardinality'):
+      if type_insert!=self._type_insert_aggregate:
+        value = self._aggregate( [value] )
+      type_insert = lambda handle, key, data: self._insert_capped(handle, key,
+        data, name, config)
+
+    if self._hashed(config):
+      i_key = self._hash_key(config, name, i_bucket)
+      self._type_hash_insert(pipe, i_key, name, value)
+    elif config['coarse']:
+      type_insert(pipe, i_key, value)
     else:
       # Add the resolution bucket to the interval. This allows us to easily
       # discover the resolution intervals within the larger interval, and
       # if there is a cap on the number of steps, it will go out of scope
       # along with the rest of the data
       pipe.sadd(i_key, r_bucket)
-      self._type_insert(pipe, r_key, value)
+      type_insert(pipe, r_key, value)
 
     if expire:
-      ttl_args = (i_key, ttl)
-      if ttl_batch is not None:
-        ttl_batch.add(ttl_args)
-      else:
-        pipe.expire(*ttl_args)
+      self._expire_bucket(pipe, i_key, ttl, ttl_batch)
       if not config['coarse']:
-        ttl_args = (r_key, ttl)
-        if ttl_batch is not None:
-          ttl_batch.add(ttl_args)
-        else:
-          pipe.expire(*ttl_args)
+        self._expire_bucket(pipe, r_key, ttl, ttl_batch)
+
+  def _expire_bucket(self, pipe, key, ttl, ttl_batch=None):
+    '''
+    Set the TTL of a bucket key, or add it to the batch of TTLs to be set
+    when the pipeline is executed.
+    '''
+    if ttl_batch is not None:
+      ttl_batch.add( (key, ttl) )
+    else:
+      self._expire(pipe, key, ttl)
+
+  # Type-specific write of a value to a field of a hash, if supported
+  _type_hash_insert = None
+
+  # Type-specific script to write to a bucket with a cap on its cardinality,
+  # if supported
+  _type_capped_script = None
+
+  def _insert_capped(self, handle, key, data, name, config):
+    '''
+    Write aggregated data to a bucket with a cap on its cardinality.
+    '''
+    raise NotImplementedError()
+
+  def _companion_keys(self, config, key):
+    '''
+    Return the keys which are stored alongside a bucket key, to be deleted
+    along with it.
+    '''
+    return []
+
+  def _resolution_keys(self, config):
+    '''
+    Return True if the resolution buckets of an interval are each stored in
+    their own key, and listed in a set at the interval key.
+    '''
+    return not config['coarse']
+
+  def _index_bucket(self, pipe, name, config, i_bucket, ttl=None):
+    '''
+    Add the name and interval bucket to the index, unless this process has
+    already done so and the bucket, which expires in "ttl" seconds if given,
+    has not yet expired.
+    '''
+    index_key = self._index_key(name, config['interval'])
+    if self._expire_cache_size:
+      now = time.time()
+      entry = (index_key, i_bucket)
+      expires = self._index_cache.pop(entry, False)
+      if expires is None or expires>now:
+        self._index_cache[entry] = expires
+        return
+
+      self._index_cache[entry] = now+ttl if ttl else None
+      if len(self._index_cache)>self._expire_cache_size:
+        self._index_cache.popitem(last=False)
+
+    pipe.sadd(self._names_key, name)
+    pipe.zadd(index_key, i_bucket, i_bucket)
+
+  def _expire(self, pipe, key, ttl):
+    '''
+    Set the TTL of a key, unless it's already been set.
+    '''
+    if not self._expire_cached(key, ttl):
+      pipe.expire(key, ttl)
+
+  def _expire_cached(self, key, ttl):
+    '''
+    Return True if this process has already set the TTL of a key to the same
+    value and it has not yet expired, else record that the TTL is being set
+    and return False. Relative TTLs only change when the current time moves
+    into a new bucket, at which point the TTL is applied again and so
+    continues to be extended.
+    '''
+    if not self._expire_cache_size:
+      return False
+
+    now = time.time()
+    cached = self._expire_cache.pop(key, None)
+    if cached and cached[0]==ttl and cached[1]>now:
+      self._expire_cache[key] = cached
+      return True
+
+    self._expire_cache[key] = (ttl, now+ttl)
+    if len(self._expire_cache)>self._expire_cache_size:
+      self._expire_cache.popitem(last=False)
+    return False
+
+  def _execute(self, pipe):
+    '''
+    Execute an insert pipeline. If it fails, forget the cached TTLs and index
+    entries because they may not have been applied.
+    '''
+    try:
+      res = pipe.execute()
+    except Exception:
+      self._clear_caches()
+      raise
+
+    if self._capped_script:
+      for reply in res:
+        if isinstance(reply, list):
+          name, interval, count = reply
+          self._overflow(name, interval, count)
+
+  def _clear_caches(self):
+    self._expire_cache.clear()
+    self._index_cache.clear()
 
   def delete(self, name):
     '''
-    Delete all the data in a named timeseries.
+    Delete all the data in a named timeseries, finding the keys through the
+    index rather than scanning the database.
     '''
-    keys = self._client.keys('%s%s:*'%(self._prefix,name))
+    intervals = self._intervals.values()
+    keys = [ self._index_key(name, config['interval']) for config in intervals ]
 
     pipe = self._client.pipeline(transaction=False)
-    for key in keys:
-      pipe.delete( key )
+    for index_key in keys:
+      pipe.zrange(index_key, 0, -1)
+    res = pipe.execute()
+
+    interval_keys = []
+    hash_keys = []
+    for config,buckets in zip(intervals, res):
+      for bucket in buckets:
+        if self._hashed(config):
+          hash_keys.append( self._hash_key(config, name, bucket) )
+          continue
+        i_key = self._bucket_keys(config, name, bucket, None)[0]
+        keys.append( i_key )
+        if self._resolution_keys(config):
+          interval_keys.append( (config, i_key) )
+        else:
+          keys.extend( self._companion_keys(config, i_key) )
+
+    # Resolution buckets are found through the interval buckets
+    if interval_keys:
+      pipe = self._client.pipeline(transaction=False)
+      for config,i_key in interval_keys:
+        pipe.smembers(i_key)
+      for (config,i_key),resolution_buckets in zip(interval_keys, pipe.execute()):
+        for bucket in resolution_buckets:
+          r_key = '%s:%s'%(i_key, bucket)
+          keys.append( r_key )
+          keys.extend( self._companion_keys(config, r_key) )
+
+    pipe = self._client.pipeline(transaction=False)
+    pipe.srem(self._names_key, name)
+    for hash_key in hash_keys:
+      pipe.hdel(hash_key, name)
+    for idx in xrange(0, len(keys), DELETE_BATCH):
+      pipe.execute_command('UNLINK', *keys[idx:idx+DELETE_BATCH])
     pipe.execute()
+    self._clear_caches()
 
     # Could be not technically the exact number of keys deleted, but is a close
     # enough approximation
-    return len(keys)
+    return len(keys) + len(hash_keys)
 
   def _get(self, name, interval, config, timestamp, **kws):
     '''
     Fetch a single interval from redis.
     '''
-    i_bucket, r_bucket, i_key, r_key = self._calc_keys(config, name, timestamp)
+    return self._get_multi([name], interval, config, timestamp, **kws)[0]
+
+  def _get_multi(self, names, interval, config, timestamp, **kws):
+    '''
+    Fetch a single interval for several names, using the same pipelines as
+    a series.
+    '''
+    i_bucket = config['i_calc'].to_bucket( timestamp )
+    results = self._series_multi(names, interval, config, [i_bucket], **kws)
+    if config['coarse']:
+      return results
+
+    i_t = config['i_calc'].from_bucket( i_bucket )
+    return [ res[i_t] for res in results ]
+
+  def _series(self, name, interval, config, buckets, **kws):
+    '''
+    Fetch a series of buckets.
+    '''
+    return self._series_multi([name], interval, config, buckets, **kws)[0]
+
+  def _series_multi(self, names, interval, config, buckets, **kws):
+    '''
+    Fetch a series of buckets for several names. Fine resolution intervals
+    are fetched in two round trips, one for all of the resolution buckets of
+    every interval and one for all of their data. In cluster mode, the
+    client sends the commands for each node in parallel.
+    '''
+    if self._hashed(config):
+      return self._series_hashed(names, config, buckets, **kws)
+
+    pipe = self._client.pipeline(transaction=False)
     fetch = kws.get('fetch') or self._type_get
     process_row = kws.get('process_row') or self._process_row
 
-    rval = OrderedDict()
+    # The totals of bounded buckets are fetched after the data of each bucket
+    totals = not kws.get('fetch') and self._bounded(config)
+    def fetch_bucket(key):
+      fetch(pipe, key)
+      if totals:
+        pipe.get( self._total_key(key) )
+    def process_bucket(data):
+      row = process_row( data )
+      if totals:
+        row = self._sample( row, next(res) )
+      return row
+
+    i_keys = []
+    for name in names:
+      for interval_bucket in buckets:
+        i_keys.append( self._bucket_keys(config, name, interval_bucket, None)[0] )
+
+        if config['coarse']:
+          fetch_bucket(i_keys[-1])
+        else:
+          pipe.smembers(i_keys[-1])
+    res = iter( pipe.execute() )
+
+    rval = [ OrderedDict() for name in names ]
     if config['coarse']:
-      data = process_row( fetch(self._client, i_key) )
-      rval[ config['i_calc'].from_bucket(i_bucket) ] = data
-    else:
-      # First fetch all of the resolution buckets for this set.
-      resolution_buckets = sorted(map(int,self._client.smembers(i_key)))
+      for result in rval:
+        for interval_bucket in buckets:
+          i_t = config['i_calc'].from_bucket(interval_bucket)
+          result[ i_t ] = process_bucket( next(res) )
+      return rval
 
-      # Create a pipe and go fetch all the data for each.
-      # TODO: turn off transactions here?
-      pipe = self._client.pipeline(transaction=False)
+    pipe = self._client.pipeline(transaction=False)
+    resolutions = []
+    for interval_key,data in zip(i_keys, res):
+      resolution_buckets = sorted(map(int,data))
+      resolutions.append( resolution_buckets )
       for bucket in resolution_buckets:
-        r_key = '%s:%s'%(i_key, bucket)   # TODO: make this the "resolution_bucket" closure?
-        fetch(pipe, r_key)
-      res = pipe.execute()
+        fetch_bucket('%s:%s'%(interval_key, bucket))
+    res = iter( pipe.execute() )
 
-      for idx,data in enumerate(res):
-        data = process_row(data)
-        rval[ config['r_calc'].from_bucket(resolution_buckets[idx]) ] = data
+    resolutions = iter( resolutions )
+    for result in rval:
+      for interval_bucket in buckets:
+        i_t = config['i_calc'].from_bucket(interval_bucket)
+        result[ i_t ] = OrderedDict()
+        for bucket in next(resolutions):
+          r_t = config['r_calc'].from_bucket(bucket)
+          result[ i_t ][ r_t ] = process_bucket( next(res) )
 
     return rval
 
-  def _series(self, name, interval, config, buckets, **kws):
+  def _series_hashed(self, names, config, buckets, **kws):
     '''
-    Fetch a series of buckets.
+    Fetch a series of hashed buckets for several names, with an HMGET for
+    the names in each hash. A custom fetch is called for the field of each
+    name as fetch(handle, key, field=name).
     '''
-    pipe = self._client.pipeline(transaction=False)
-    step = config['step']
-    resolution = config.get('resolution',step)
-    fetch = kws.get('fetch') or self._type_get
+    fetch = kws.get('fetch')
     process_row = kws.get('process_row') or self._process_row
-
-    rval = OrderedDict()
+    pipe = self._client.pipeline(transaction=False)
+    fetches = []
     for interval_bucket in buckets:
-      i_key = '%s%s:%s:%s'%(self._prefix, name, interval, interval_bucket)
-
-      if config['coarse']:
-        fetch(pipe, i_key)
-      else:
-        pipe.smembers(i_key)
+      hashes = OrderedDict()
+      for idx,name in enumerate(names):
+        hashes.setdefault( self._hash_key(config, name, interval_bucket), [] ).append( idx )
+      for hash_key,idxs in hashes.iteritems():
+        if fetch:
+          for idx in idxs:
+            fetch( pipe, hash_key, field=names[idx] )
+            fetches.append( (interval_bucket, [idx]) )
+        else:
+          pipe.hmget( hash_key, [ names[idx] for idx in idxs ] )
+          fetches.append( (interval_bucket, idxs) )
     res = pipe.execute()
+    if fetch:
+      res = [ [value] for value in res ]
 
-    # TODO: a memory efficient way to use a single pipeline for this.
-    for idx,data in enumerate(res):
-      # TODO: use closures on the config for generating this interval key
-      interval_bucket = buckets[idx] #start_bucket + idx
-      interval_key = '%s%s:%s:%s'%(self._prefix, name, interval, interval_bucket)
+    # Create the buckets in order, to be filled in from the hashes
+    timestamps = [ config['i_calc'].from_bucket(b) for b in buckets ]
+    rval = [ OrderedDict.fromkeys(timestamps) for name in names ]
+    for (interval_bucket, idxs),values in zip(fetches, res):
+      i_t = config['i_calc'].from_bucket(interval_bucket)
+      for idx,value in zip(idxs, values):
+        rval[idx][ i_t ] = process_row( value )
+    return rval
 
-      if config['coarse']:
-        data = process_row( data )
-        rval[ config['i_calc'].from_bucket(interval_bucket) ] = data
-      else:
-        rval[ config['i_calc'].from_bucket(interval_bucket) ] = OrderedDict()
-        pipe = self._client.pipeline(transaction=False)
-        resolution_buckets = sorted(map(int,data))
-        for bucket in resolution_buckets:
-          # TODO: use closures on the config for generating this resolution key
-          resolution_key = '%s:%s'%(interval_key, bucket)
-          fetch(pipe, resolution_key)
+  # Transforms which redis can calculate for any values, and those which it
+  # can calculate for numeric values. If stats are not mergeable, they can
+  # only be used for a single bucket of a single name, without condense or
+  # collapse.
+  _stats_transforms = frozenset()
+  _stats_value_transforms = frozenset()
+  _stats_mergeable = True
 
-        resolution_res = pipe.execute()
-        for x,data in enumerate(resolution_res):
-          i_t = config['i_calc'].from_bucket(interval_bucket)
-          r_t = config['r_calc'].from_bucket(resolution_buckets[x])
-          rval[ i_t ][ r_t ] = process_row(data)
+  def _get_kwargs(self, name, interval, kwargs):
+    return self._stats_kwargs(name, interval, kwargs,
+      kwargs.get('condensed', kwargs.get('condense')))
 
-    return rval
+  def _series_kwargs(self, name, interval, kwargs):
+    return self._stats_kwargs(name, interval, kwargs,
+      kwargs.get('condensed', kwargs.get('condense')) or kwargs.get('collapse'))
+
+  def _stats_kwargs(self, name, interval, kwargs, condense):
+    '''
+    If the transform can be calculated by redis, return the keyword arguments
+    to fetch the BucketStats for each bucket rather than its data.
+    '''
+    transform = kwargs.get('transform')
+    if not transform or kwargs.get('fetch') or kwargs.get('process_row'):
+      return kwargs
+    if kwargs.get('join_rows') or callable(condense) or callable(kwargs.get('collapse')):
+      return kwargs
+
+    if isinstance(transform, (list,tuple,set)):
+      transforms = set(transform)
+    elif isinstance(transform, basestring):
+      transforms = set([transform])
+    else:
+      return kwargs
+
+    supported = self._stats_transforms
+    if self._read_func in NUMERIC_READ_FUNCS:
+      supported = supported | self._stats_value_transforms
+    if not transforms <= supported:
+      return kwargs
+
+    # Stats which can't be merged are only used for a single bucket, so not
+    # if the buckets of an interval or a series are to be combined
+    if not self._stats_mergeable and (isinstance(name, (list,tuple,set)) or condense):
+      return kwargs
+
+    kwargs = dict(kwargs)
+    kwargs['fetch'] = self._stats_get
+    kwargs['process_row'] = self._stats_row
+    return kwargs
+
+  def _stats_get(self, handle, key):
+    '''
+    Fetch the stats for a bucket.
+    '''
+    raise NotImplementedError()
+
+  def _stats_row(self, data):
+    '''
+    Convert the fetched stats for a bucket to BucketStats.
+    '''
+    return BucketStats( int(data) )
+
+  def _transform(self, data, transform, step_size):
+    if isinstance(data, BucketStats):
+      return data.transform(transform, step_size)
+    return super(RedisBackend,self)._transform(data, transform, step_size)
+
+  def _condense(self, data):
+    if data and any( isinstance(row, BucketStats) for row in data.itervalues() ):
+      return BucketStats.merge( data.values() )
+    return super(RedisBackend,self)._condense(data)
+
+  def _join(self, rows):
+    if any( isinstance(row, BucketStats) for row in rows ):
+      return BucketStats.merge( rows )
+    return super(RedisBackend,self)._join(rows)
 
 class RedisSeries(RedisBackend, Series):
 
+  _type_insert_script = "redis.call('rpush', key, value)"
+  _stats_transforms = frozenset(['count', 'rate'])
+
+  def __init__(self, client, **kwargs):
+    packed = kwargs.get('packed')
+    if packed is True:
+      packed = 'd'
+    if packed:
+      if packed not in PACKED_SERIES_TYPES:
+        raise ValueError('packed must be one of "%s"'%(PACKED_SERIES_TYPES))
+      if kwargs.get('lua_insert'):
+        raise ValueError('lua_insert is not supported for packed series')
+    self._packed = packed or None
+
+    if any( c.get('max_values') for c in kwargs.get('intervals',{}).values() ):
+      if packed:
+        raise ValueError('max_values is not supported for packed series')
+      if kwargs.get('lua_insert'):
+        raise ValueError('lua_insert is not supported with max_values')
+
+    # Ordered series store each bucket in a sorted set scored by timestamp
+    self._ordered = kwargs.get('ordered', False)
+    if self._ordered:
+      if self._packed:
+        raise ValueError('ordered series can not be packed')
+      if kwargs.get('lua_insert'):
+        raise ValueError('lua_insert is not supported for ordered series')
+      self._sequence = itertools.count( int(time.time()*1000000) )
+      self._instance = os.urandom(ORDERED_PREFIX-8)
+
+    super(RedisSeries,self).__init__(client, **kwargs)
+
+  def _get_kwargs(self, name, interval, kwargs):
+    '''
+    If the series is ordered, "start" and "end" limit the values read from
+    the interval to those inserted with timestamps in that range.
+    '''
+    kwargs = self._range_kwargs(name, interval, kwargs,
+      kwargs.get('condensed', kwargs.get('condense')))
+    return super(RedisSeries,self)._get_kwargs(name, interval, kwargs)
+
+  def _series_kwargs(self, name, interval, kwargs):
+    '''
+    If the series is ordered and "exact" is True, the values read from the
+    first and last intervals are limited to those inserted with timestamps
+    from "start" to "end".
+    '''
+    if kwargs.get('exact'):
+      kwargs = self._range_kwargs(name, interval, kwargs,
+        kwargs.get('condensed', kwargs.get('condense')) or kwargs.get('collapse'))
+    return super(RedisSeries,self)._series_kwargs(name, interval, kwargs)
+
+  def _range_kwargs(self, name, interval, kwargs, condense):
+    '''
+    Return the keyword arguments to fetch only the values from "start" to
+    "end" of each bucket of an ordered series, or to count them if the
+    transform can be calculated by redis.
+    '''
+    start, end = kwargs.get('start'), kwargs.get('end')
+    if not self._ordered or (start is None and end is None) or kwargs.get('fetch'):
+      return kwargs
+
+    minimum = '-inf' if start is None else start
+    maximum = '+inf' if end is None else end
+    kwargs = self._stats_kwargs(name, interval, kwargs, condense)
+    if kwargs.get('fetch'):
+      fetch = lambda handle, key: handle.zcount(key, minimum, maximum)
+    else:
+      fetch = lambda handle, key: handle.zrangebyscore(key, minimum, maximum)
+    kwargs = dict(kwargs)
+    kwargs['fetch'] = fetch
+    return kwargs
+
+  def _bounded(self, config):
+    return config.get('max_values')
+
+  def _companion_keys(self, config, key):
+    if self._bounded(config):
+      return [ self._total_key(key) ]
+    return []
+
+  def _stats_kwargs(self, name, interval, kwargs, condense):
+    # The length of a bounded bucket is not the number of values inserted
+    config = self._intervals.get(interval)
+    if config and self._bounded(config):
+      return kwargs
+    return super(RedisSeries,self)._stats_kwargs(name, interval, kwargs, condense)
+
+  def _insert_bucket(self, name, value, timestamp, config, i_bucket, r_bucket,
+      pipe, type_insert, ttl_batch=None):
+    '''
+    If the interval is bounded, trim each bucket to the newest "max_values"
+    values after the insert and count the total number of values inserted.
+    '''
+    max_values = self._bounded(config)
+    if max_values:
+      count = len(value) if type_insert==self._type_insert_aggregate else 1
+      ttl = config['ttl'](timestamp)
+      def bounded_insert(handle, key, value, type_insert=type_insert):
+        type_insert(handle, key, value)
+        self._type_trim(handle, key, max_values)
+        handle.incrby(self._total_key(key), count)
+        if config['expire']:
+          self._expire_bucket(handle, self._total_key(key), ttl, ttl_batch)
+      type_insert = bounded_insert
+
+    super(RedisSeries,self)._insert_bucket(name, value, timestamp, config,
+      i_bucket, r_bucket, pipe, type_insert, ttl_batch)
+
+  def _type_trim(self, handle, key, max_values):
+    '''
+    Trim a bucket to the newest values.
+    '''
+    if self._ordered:
+      handle.zremrangebyrank(key, 0, -max_values-1)
+    else:
+      handle.ltrim(key, -max_values, -1)
+
+  def _insert_data(self, name, value, timestamp, interval, config, pipe, ttl_batch=None):
+    if self._ordered:
+      value = (timestamp, value)
+    super(RedisSeries,self)._insert_data(name, value, timestamp, interval,
+      config, pipe, ttl_batch)
+
+  def _group_inserts(self, inserts, intervals):
+    '''
+    Group the values of a bulk insert by bucket. If the series is ordered,
+    each value is grouped along with its timestamp.
+    '''
+    if not self._ordered:
+      return super(RedisSeries,self)._group_inserts(inserts, intervals)
+
+    groups = OrderedDict()
+    for timestamp,names in inserts.iteritems():
+      batch = super(RedisSeries,self)._group_inserts({timestamp:names}, intervals)
+      for key,(tstamp, values) in batch.iteritems():
+        group = groups.setdefault(key, (tstamp, []))
+        group[1].extend( (tstamp, value) for value in values )
+    return groups
+
+  def _group_aggregates(self, inserts, intervals):
+    # The data of a series is its list of values, which have to be grouped
+    # along with their timestamps if the series is ordered
+    if not self._ordered:
+      return super(RedisSeries,self)._group_aggregates(inserts, intervals)
+    return self._group_inserts(inserts, intervals)
+
+  def _group_arrays(self, names, timestamps, values, intervals):
+    if not self._ordered:
+      return super(RedisSeries,self)._group_arrays(names, timestamps, values, intervals)
+
+    inserts = OrderedDict()
+    for name,timestamp,value in itertools.izip(names, timestamps, values):
+      inserts.setdefault(timestamp, OrderedDict()).setdefault(name, []).append(value)
+    return self._group_inserts(inserts, intervals)
+
+  def _member(self, value):
+    '''
+    Calculate the unique sorted set member for a value in an ordered series.
+    '''
+    return struct.pack('>Q', next(self._sequence)) + self._instance + _encode(value)
+
   def _type_insert(self, handle, key, value):
     '''
     Insert the value into the series.
     '''
-    handle.rpush(key, value)
+    if self._ordered:
+      handle.execute_command('ZADD', key, value[0], self._member(value[1]))
+    elif self._packed:
+      handle.append(key, struct.pack('<'+self._packed, value))
+    else:
+      handle.rpush(key, value)
+
+  def _type_insert_aggregate(self, handle, key, data):
+    '''
+    Insert a list of values into the series.
+    '''
+    if data:
+      if self._ordered:
+        args = []
+        for timestamp,value in data:
+          args.extend( (timestamp, self._member(value)) )
+        handle.execute_command('ZADD', key, *args)
+      elif self._packed:
+        handle.append(key, struct.pack('<%d%s'%(len(data), self._packed), *data))
+      else:
+        handle.rpush(key, *data)
 
   def _type_get(self, handle, key):
     '''
     Get for a series.
     '''
+    if self._ordered:
+      return handle.zrange(key, 0, -1)
+    if self._packed:
+      return handle.get(key)
     return handle.lrange(key, 0, -1)
 
+  def _process_row(self, data):
+    if self._ordered:
+      data = [ member[ORDERED_PREFIX:] for member in data ]
+    elif self._packed:
+      data = _unpack_values(data, self._packed)
+    return super(RedisSeries,self)._process_row(data)
+
+  def _stats_get(self, handle, key):
+    if self._ordered:
+      handle.zcard(key)
+    elif self._packed:
+      handle.strlen(key)
+    else:
+      handle.llen(key)
+
+  def _stats_row(self, data):
+    if self._packed:
+      return BucketStats( int(data) // struct.calcsize(self._packed) )
+    return BucketStats( int(data) )
+
 class RedisHistogram(RedisBackend, Histogram):
 
+  _type_insert_script = "redis.call('hincrby', key, value, 1)"
+  _stats_transforms = frozenset(['count'])
+  _stats_value_transforms = frozenset(['sum', 'min', 'max', 'mean'])
+  _stats_script = None
+  _type_capped_script = HISTOGRAM_CAPPED_SCRIPT
+
   def _type_insert(self, handle, key, value):
     '''
     Insert the value into the series.
     '''
     handle.hincrby(key, value, 1)
 
+  def _type_insert_aggregate(self, handle, key, data):
+    '''
+    Insert a histogram of values into the series.
+    '''
+    for value,count in data.iteritems():
+      handle.hincrby(key, value, count)
+
   def _type_get(self, handle, key):
     return handle.hgetall(key)
 
+  def _insert_capped(self, handle, key, data, name, config):
+    args = [ config['max_cardinality'], name, config['interval'], OVERFLOW_VALUE ]
+    for value,count in data.iteritems():
+      args.extend( (value, count) )
+    self._capped_script(keys=[key], args=args, client=handle)
+
+  def _stats_kwargs(self, name, interval, kwargs, condense):
+    # Scripts can't be pipelined in cluster mode, and the stats of a bucket
+    # with a cap on its cardinality would include the overflowed values
+    config = self._intervals.get(interval)
+    if self._cluster or (config and config.get('max_cardinality')):
+      return kwargs
+    return super(RedisHistogram,self)._stats_kwargs(name, interval, kwargs, condense)
+
+  def _stats_get(self, handle, key):
+    if self._stats_script is None:
+      self._stats_script = self._client.register_script( HISTOGRAM_STATS_SCRIPT )
+    self._stats_script(keys=[key], client=handle)
+
+  def _stats_row(self, data):
+    return BucketStats( *map(_number, data) )
+
 class RedisCount(RedisBackend, Count):
 
+  _type_insert_script = '''
+  if tonumber(value) ~= 0 then
+    if string.find(value, '[.eE]') then
+      redis.call('incrbyfloat', key, value)
+    else
+      redis.call('incrby', key, value)
+    end
+  end'''
+
+  def __init__(self, client, **kwargs):
+    packed = kwargs.get('packed')
+    if packed is True:
+      packed = 'i64'
+    if packed:
+      match = PACKED_TYPE.match(packed)
+      if not match or not 0<int(match.group(2))<=(64 if match.group(1)=='i' else 63):
+        raise ValueError('packed must be a signed or unsigned integer type, e.g. "i64" or "u16"')
+      if kwargs.get('lua_insert'):
+        raise ValueError('lua_insert is not supported for packed counters')
+    self._packed = packed or None
+
+    super(RedisCount,self).__init__(client, **kwargs)
+
+    if self._packed:
+      for config in self._intervals.values():
+        if not config['coarse'] and isinstance(config['r_calc'], GregorianTime):
+          raise ValueError('packed counters require a resolution in seconds')
+
+  def _resolution_keys(self, config):
+    return not config['coarse'] and not self._packed
+
+  def _packed_slot(self, config, i_bucket, r_bucket):
+    '''
+    Calculate the index of a resolution bucket in the packed interval.
+    '''
+    start = config['i_calc'].from_bucket( i_bucket )
+    return r_bucket - config['r_calc'].to_bucket( start )
+
+  def _insert_bucket(self, name, value, timestamp, config, i_bucket, r_bucket,
+      pipe, type_insert, ttl_batch=None):
+    '''
+    If packed, increment the resolution bucket's slot in the interval key.
+    '''
+    if self._resolution_keys(config) or config['coarse']:
+      return super(RedisCount,self)._insert_bucket(name, value, timestamp,
+        config, i_bucket, r_bucket, pipe, type_insert, ttl_batch)
+
+    expire, ttl = config['expire'], config['ttl'](timestamp)
+    if expire and not ttl:
+      return
+    if not isinstance(value, (int,long)):
+      raise ValueError('packed counters only support integers, got %r'%(value,))
+
+    self._index_bucket(pipe, name, config, i_bucket, ttl if expire else None)
+    i_key = self._bucket_keys(config, name, i_bucket, None)[0]
+    if value!=0:
+      pipe.execute_command('BITFIELD', i_key, 'OVERFLOW', 'SAT', 'INCRBY',
+        self._packed, '#%d'%(self._packed_slot(config, i_bucket, r_bucket)), value)
+    if expire:
+      self._expire_bucket(pipe, i_key, ttl, ttl_batch)
+
+  def _series_multi(self, names, interval, config, buckets, **kws):
+    '''
+    If packed, fetch each interval with a single GET and return the slots
+    which are not zero. A custom fetch is called for the interval key and
+    its result is unpacked in the same way.
+    '''
+    if self._resolution_keys(config) or config['coarse']:
+      return super(RedisCount,self)._series_multi(names, interval, config,
+        buckets, **kws)
+
+    fetch = kws.get('fetch') or self._type_get
+    process_row = kws.get('process_row') or self._process_row
+    pipe = self._client.pipeline(transaction=False)
+    for name in names:
+      for interval_bucket in buckets:
+        fetch( pipe, self._bucket_keys(config, name, interval_bucket, None)[0] )
+    res = iter( pipe.execute() )
+
+    rval = [ OrderedDict() for name in names ]
+    for result in rval:
+      for interval_bucket in buckets:
+        i_t = config['i_calc'].from_bucket(interval_bucket)
+        start = config['r_calc'].to_bucket( i_t )
+        result[ i_t ] = row = OrderedDict()
+        for slot,count in enumerate(_unpack(next(res), self._packed)):
+          if count:
+            row[ config['r_calc'].from_bucket(start+slot) ] = process_row( int(count) )
+    return rval
+
   def _type_insert(self, handle, key, value):
     '''
     Insert the value into the series.
@@ -300,27 +1307,86 @@ class RedisCount(RedisBackend, Count):
       else:
         handle.incr(key,value)
 
+  def _type_insert_aggregate(self, handle, key, data):
+    '''
+    Insert the sum of values into the series.
+    '''
+    self._type_insert(handle, key, data)
+
+  def _type_hash_insert(self, handle, key, field, value):
+    '''
+    Insert the value into a field of a hash.
+    '''
+    if value!=0:
+      if isinstance(value,float):
+        handle.hincrbyfloat(key, field, value)
+      else:
+        handle.hincrby(key, field, value)
+
   def _type_get(self, handle, key):
     return handle.get(key)
 
 class RedisGauge(RedisBackend, Gauge):
 
+  _type_insert_script = "redis.call('set', key, value)"
+
+  def _expire_cached(self, key, ttl):
+    '''
+    SET clears the TTL of a key, so it must be applied after every write.
+    HSET does not, so the TTLs of hashes can be cached.
+    '''
+    if key.startswith(self._hash_prefix):
+      return super(RedisGauge,self)._expire_cached(key, ttl)
+    return False
+
   def _type_insert(self, handle, key, value):
     '''
     Insert the value into the series.
     '''
     handle.set(key, value)
 
+  def _type_insert_aggregate(self, handle, key, data):
+    '''
+    Insert the last value into the series.
+    '''
+    self._type_insert(handle, key, data)
+
+  def _type_hash_insert(self, handle, key, field, value):
+    '''
+    Insert the value into a field of a hash.
+    '''
+    handle.hset(key, field, value)
+
   def _type_get(self, handle, key):
     return handle.get(key)
 
 class RedisSet(RedisBackend, Set):
 
+  _type_insert_script = "redis.call('sadd', key, value)"
+  _stats_transforms = frozenset(['count', 'rate'])
+  _stats_mergeable = False
+  _type_capped_script = SET_CAPPED_SCRIPT
+
+  def _insert_capped(self, handle, key, data, name, config):
+    args = [ config['max_cardinality'], name, config['interval'] ]
+    args.extend( data )
+    self._capped_script(keys=[key], args=args, client=handle)
+
   def _type_insert(self, handle, key, value):
     '''
     Insert the value into the series.
     '''
     handle.sadd(key, value)
 
+  def _type_insert_aggregate(self, handle, key, data):
+    '''
+    Insert a set of values into the series.
+    '''
+    if data:
+      handle.sadd(key, *data)
+
   def _type_get(self, handle, key):
     return handle.smembers(key)
+
+  def _stats_get(self, handle, key):
+    handle.scard(key)
@@ -0,0 +1,251 @@
+'''
+Copyright (c) 2012-2017, Agora Games, LLC All rights reserved.
+
+https://github.com/agoragames/kairos/blob/master/LICENSE.txt
+'''
+from .exceptions import *
+from .timeseries import Timeseries
+
+import bisect
+import functools
+import hashlib
+import sys
+import threading
+import time
+
+if sys.version_info[:2] > (2, 6):
+    from collections import OrderedDict
+else:
+    from ordereddict import OrderedDict
+
+def _concurrently(calls):
+  '''
+  Run a list of ( function, args ) in parallel threads and return a list of
+  their results. If any of them raise, the first exception is raised after
+  all of them have finished.
+  '''
+  if len(calls)==1:
+    func, args = calls[0]
+    return [ func(*args) ]
+
+  results = [None]*len(calls)
+  errors = []
+  def run(idx, func, args):
+    try:
+      results[idx] = func(*args)
+    except Exception as e:
+      errors.append( e )
+
+  threads = [ threading.Thread(target=run, args=(idx,func,args))
+    for idx,(func,args) in enumerate(calls) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  if errors:
+    raise errors[0]
+  return results
+
+class HashRing(object):
+  '''
+  Consistent hash ring which maps keys to nodes, with a number of virtual
+  nodes for each node so that keys are evenly distributed and only a
+  fraction of them move when a node is added or removed.
+  '''
+
+  def __init__(self, nodes, replicas=100):
+    ring = sorted( (self._hash('%s:%d'%(node,replica)), node)
+      for node in nodes for replica in xrange(replicas) )
+    self._hashes = [ h for h,node in ring ]
+    self._nodes = [ node for h,node in ring ]
+
+  def get(self, key):
+    '''
+    Return the node for a key.
+    '''
+    idx = bisect.bisect( self._hashes, self._hash(key) )
+    return self._nodes[ idx % len(self._nodes) ]
+
+  def _hash(self, key):
+    if isinstance(key, unicode):
+      key = key.encode('utf-8')
+    return int( hashlib.md5(key).hexdigest()[:8], 16 )
+
+class ShardedTimeseries(object):
+  '''
+  Timeseries which is sharded by name across several backends using a
+  consistent hash ring. Reads and writes for multiple names fan out to the
+  shards in parallel and the results are joined as for a single backend.
+  '''
+
+  def __init__(self, clients, **kwargs):
+    '''
+    Create a timeseries for each of the clients, which can be a list, or a
+    dict of { shard_name : client } so that the placement of names does not
+    depend on the order of the clients. A client can also be a Timeseries.
+    The keyword arguments are the same as for Timeseries, with the addition
+    of:
+
+    replicas
+      Optional, the number of virtual nodes for each shard in the hash ring.
+      Defaults to 100.
+    '''
+    if not isinstance(clients, dict):
+      clients = OrderedDict( (str(idx),client) for idx,client in enumerate(clients) )
+    if not clients:
+      raise ValueError('at least one client is required')
+    replicas = kwargs.pop('replicas', 100)
+
+    self._shards = OrderedDict()
+    for shard,client in clients.items():
+      if not isinstance(client, Timeseries):
+        client = Timeseries(client, **kwargs)
+      self._shards[shard] = client
+    self._ring = HashRing(self._shards.keys(), replicas)
+
+  def __getattr__(self, attr):
+    # Configuration and the type-specific methods used by get and series are
+    # the same for every shard
+    return getattr(self._shards.values()[0], attr)
+
+  def shard(self, name):
+    '''
+    Return the timeseries which stores "name".
+    '''
+    return self._shards[ self._ring.get(name) ]
+
+  def _split(self, names):
+    '''
+    Group names by shard, returning { shard : [ names ] } in the order of
+    the shards.
+    '''
+    rval = OrderedDict()
+    for name in names:
+      rval.setdefault( self.shard(name), [] ).append( name )
+    return rval
+
+  def list(self):
+    '''
+    List all of the stat names stored in all of the shards.
+    '''
+    rval = set()
+    for names in _concurrently( [ (shard.list, ()) for shard in self._shards.values() ] ):
+      rval.update( names )
+    return list(rval)
+
+  def properties(self, name):
+    return self.shard(name).properties(name)
+
+  def expire(self, name):
+    return self.shard(name).expire(name)
+
+  def delete(self, name):
+    return self.shard(name).delete(name)
+
+  def delete_all(self):
+    _concurrently( [ (shard.delete_all, ()) for shard in self._shards.values() ] )
+
+  def insert(self, name, *args, **kwargs):
+    return self.shard(name).insert(name, *args, **kwargs)
+
+  def bulk_insert(self, inserts, intervals=0, **kwargs):
+    '''
+    Split a bulk insert by shard and insert into each shard in parallel.
+    '''
+    if None in inserts:
+      inserts[ time.time() ] = inserts.pop(None)
+
+    splits = OrderedDict()
+    for timestamp,names in inserts.iteritems():
+      for name,values in names.iteritems():
+        split = splits.setdefault( self.shard(name), OrderedDict() )
+        split.setdefault( timestamp, {} )[ name ] = values
+
+    _concurrently( [
+      (functools.partial(shard.bulk_insert, **kwargs), (split, intervals))
+      for shard,split in splits.items() ] )
+
+  def bulk_insert_arrays(self, names, timestamps, values, intervals=0, **kwargs):
+    '''
+    Split a columnar bulk insert by shard and insert into each shard in
+    parallel.
+    '''
+    names, timestamps, values = [ x.tolist() if hasattr(x,'tolist') else x
+      for x in (names, timestamps, values) ]
+    if isinstance(names, (str,unicode)):
+      return self.shard(names).bulk_insert_arrays(names, timestamps, values,
+        intervals, **kwargs)
+    if not len(names)==len(timestamps)==len(values):
+      raise ValueError('names, timestamps and values must be the same length')
+
+    splits = OrderedDict()
+    for idx,name in enumerate(names):
+      split = splits.setdefault( self.shard(name), ([],[],[]) )
+      split[0].append( name )
+      split[1].append( timestamps[idx] )
+      split[2].append( values[idx] )
+
+    _concurrently( [
+      (functools.partial(shard.bulk_insert_arrays, **kwargs), split+(intervals,))
+      for shard,split in splits.items() ] )
+
+  def iterate(self, name, interval, **kwargs):
+    return self.shard(name).iterate(name, interval, **kwargs)
+
+  def get(self, name, interval, **kwargs):
+    '''
+    Reads for a single name are made by its shard. Reads for several names
+    are split by shard and made in parallel, then the results are joined,
+    condensed and transformed as for a single backend.
+    '''
+    if not isinstance(name, (list,tuple,set)):
+      return self.shard(name).get(name, interval, **kwargs)
+
+    config = self._intervals.get(interval)
+    if not config:
+      raise UnknownInterval(interval)
+    # Every shard must read the same interval
+    kwargs = dict(kwargs, timestamp=kwargs.get('timestamp', time.time()))
+
+    results = self._read_multi('get', name, interval, kwargs)
+    join_rows = kwargs.get('join_rows') or self._join
+    condense = kwargs.get('condensed', kwargs.get('condense', False))
+    rval = self._join_results( results, True, join_rows )
+    return self._get_result(rval, config, kwargs['timestamp'], condense,
+      kwargs.get('transform'))
+
+  def series(self, name, interval, **kwargs):
+    if not isinstance(name, (list,tuple,set)):
+      return self.shard(name).series(name, interval, **kwargs)
+
+    config = self._intervals.get(interval)
+    if not config:
+      raise UnknownInterval(interval)
+    # Every shard must read the same range of intervals
+    if kwargs.get('start') is None and kwargs.get('end') is None:
+      kwargs = dict(kwargs, end=time.time())
+
+    results = self._read_multi('series', name, interval, kwargs)
+    join_rows = kwargs.get('join_rows') or self._join
+    condense = kwargs.get('condensed', kwargs.get('condense', False))
+    collapse = kwargs.get('collapse', False)
+    if collapse: condense = condense or True
+    rval = self._join_results( results, config['coarse'], join_rows )
+    return self._series_result(rval, config, condense, collapse,
+      kwargs.get('transform'))
+
+  def _read_multi(self, method, names, interval, kwargs):
+    '''
+    Call get or series on each shard for its names in parallel, with the
+    keyword arguments rewritten by the shard but without condensing or
+    transforming, so that the results can be joined.
+    '''
+    calls = []
+    for shard,shard_names in self._split(names).items():
+      kws = dict( getattr(shard, '_%s_kwargs'%(method))(shard_names, interval, kwargs) )
+      for key in ('condense', 'condensed', 'collapse', 'transform'):
+        kws.pop(key, None)
+      calls.append( (functools.partial(getattr(shard, method), **kws),
+        (shard_names, interval)) )
+    return _concurrently(calls)
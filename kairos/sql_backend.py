@@ -202,12 +202,15 @@ class SqlBackend(Timeseries):
 
     if config['coarse']:
       if data:
-        rval[ config['i_calc'].from_bucket(i_bucket) ] = process_row(data.values()[0][None])
+        row_data = data.values()[0][None]
+        rval[ config['i_calc'].from_bucket(i_bucket) ] = \
+          self._sample( process_row(row_data), getattr(row_data, 'total', None) )
       else:
         rval[ config['i_calc'].from_bucket(i_bucket) ] = self._type_no_value()
     else:
       for r_bucket,row_data in data.values()[0].items():
-        rval[ config['r_calc'].from_bucket(r_bucket) ] = process_row(row_data)
+        rval[ config['r_calc'].from_bucket(r_bucket) ] = \
+          self._sample( process_row(row_data), getattr(row_data, 'total', None) )
 
     return rval
 
@@ -230,7 +233,8 @@ class SqlBackend(Timeseries):
         i_key = config['i_calc'].from_bucket(i_bucket)
         i_data = data.get( i_bucket )
         if i_data:
-          rval[ i_key ] = process_row( i_data[None] )
+          rval[ i_key ] = self._sample( process_row(i_data[None]),
+            getattr(i_data[None], 'total', None) )
         else:
           rval[ i_key ] = self._type_no_value()
     else:
@@ -241,7 +245,8 @@ class SqlBackend(Timeseries):
           for r_bucket, r_data in i_data.items():
             r_key = config['r_calc'].from_bucket(r_bucket)
             if r_data:
-              rval[i_key][r_key] = process_row(r_data)
+              rval[i_key][r_key] = self._sample( process_row(r_data),
+                getattr(r_data, 'total', None) )
             else:
               rval[i_key][r_key] = self._type_no_value()
 
@@ -270,6 +275,22 @@ class SqlSeries(SqlBackend, Series):
       Column('r_time', Integer, nullable=True),         # resolution timestamp
       Column('value', self._value_type, nullable=False)            # datas
     )
+
+    # The total number of values inserted into each bucket of the intervals
+    # which store at most max_values
+    self._totals = None
+    if any( config.get('max_values') for config in self._intervals.values() ):
+      totals_name = '%s_totals'%(self._table_name)
+      self._totals = Table(totals_name, self._metadata,
+        Column('name', String(self._str_length), nullable=False),      # stat name
+        Column('interval', String(self._str_length), nullable=False),  # interval name
+        Column('i_time', Integer, nullable=False),        # interval timestamp
+        Column('r_time', Integer, nullable=True),         # resolution timestamp
+        Column('total', BigInteger, nullable=False),      # values inserted
+
+        # Use a constraint for transaction-less insert vs update
+        UniqueConstraint('name', 'interval', 'i_time', 'r_time', name='unique_%s'%(totals_name))
+      )
     self._metadata.create_all(self._client)
 
   def _insert_data(self, name, value, timestamp, interval, config, **kwargs):
@@ -287,6 +308,48 @@ class SqlSeries(SqlBackend, Series):
     conn = self._client.connect()
     result = conn.execute(stmt)
 
+    if config.get('max_values'):
+      self._trim_data(name, interval, config, kwargs['i_time'],
+        kwargs.get('r_time'), conn)
+
+  def _trim_data(self, name, interval, config, i_time, r_time, conn):
+    '''
+    Delete all but the newest max_values values in a bucket, and add the
+    insert to the total for the bucket.
+    '''
+    bucket = and_(
+      self._table.c.name==name,
+      self._table.c.interval==interval,
+      self._table.c.i_time==i_time,
+      self._table.c.r_time==r_time)
+    stmt = select([self._table.c.insert_time]).where(bucket).order_by(
+      desc(self._table.c.insert_time) ).offset(config['max_values']-1).limit(1)
+    oldest = conn.execute(stmt).scalar()
+    if oldest is not None:
+      conn.execute( self._table.delete().where(
+        and_(bucket, self._table.c.insert_time<oldest)) )
+
+    if not self._update_total(name, interval, i_time, r_time, conn):
+      try:
+        stmt = self._totals.insert().values(name=name, interval=interval,
+          i_time=i_time, r_time=r_time, total=1)
+        conn.execute(stmt)
+      except:
+        # TODO: only catch IntegrityError
+        if not self._update_total(name, interval, i_time, r_time, conn):
+          raise
+
+  def _update_total(self, name, interval, i_time, r_time, conn):
+    '''Support function for insert. Should be called within a transaction'''
+    stmt = self._totals.update().where(
+      and_(
+        self._totals.c.name==name,
+        self._totals.c.interval==interval,
+        self._totals.c.i_time==i_time,
+        self._totals.c.r_time==r_time)
+    ).values({self._totals.c.total: self._totals.c.total + 1})
+    return conn.execute( stmt ).rowcount
+
   def _type_get(self, name, interval, i_bucket, i_end=None):
     connection = self._client.connect()
     rval = OrderedDict()
@@ -313,8 +376,43 @@ class SqlSeries(SqlBackend, Series):
 
     for row in connection.execute(stmt):
       rval.setdefault(row['i_time'],OrderedDict()).setdefault(row['r_time'],[]).append( row['value'] )
+
+    # Values of bounded buckets are a Sample of the total
+    if self._intervals[interval].get('max_values'):
+      stmt = self._totals.select().where(
+        and_(
+          self._totals.c.name==name,
+          self._totals.c.interval==interval,
+          self._totals.c.i_time>=i_bucket,
+          self._totals.c.i_time<=(i_end or i_bucket),
+        )
+      )
+      for row in connection.execute(stmt):
+        i_data = rval.get(row['i_time'],{})
+        if row['r_time'] in i_data:
+          i_data[ row['r_time'] ] = Sample( i_data[row['r_time']], row['total'] )
     return rval
 
+  def expire(self, name):
+    super(SqlSeries,self).expire(name)
+    if self._totals is not None:
+      for interval,config in self._intervals.items():
+        if config['expire'] and config.get('max_values'):
+          expire_from = config['i_calc'].to_bucket(time.time() - config['expire'])
+          self._client.connect().execute( self._totals.delete().where(
+            and_(
+              self._totals.c.name==name,
+              self._totals.c.interval==interval,
+              self._totals.c.i_time<=expire_from
+            )
+          ))
+
+  def delete(self, name):
+    super(SqlSeries,self).delete(name)
+    if self._totals is not None:
+      conn = self._client.connect()
+      conn.execute( self._totals.delete().where(self._totals.c.name==name) )
+
 class SqlHistogram(SqlBackend, Histogram):
 
   def __init__(self, *a, **kwargs):
@@ -18,7 +18,10 @@ if sys.version_info[:2] > (2, 6):
 else:
     from ordereddict import OrderedDict
 
-from monthdelta import MonthDelta
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 BACKENDS = {}
 
@@ -35,6 +38,16 @@ SIMPLE_TIMES = {
 
 GREGORIAN_TIMES = set(['daily', 'weekly', 'monthly', 'yearly'])
 
+# The value under which histograms count the inserts of new values into a
+# bucket which has reached max_cardinality. Reads return it as None.
+OVERFLOW_VALUE = '__overflow__'
+
+# Read functions for which transforms of the values can be calculated by
+# the datastore with the same result
+NUMERIC_READ_FUNCS = (int, long, float)
+
+EPOCH = datetime(1970, 1, 1)
+
 # Test python3 compatibility
 try:
   x = long(1)
@@ -62,6 +75,34 @@ def _resolve_time(value):
 
   raise ValueError('Unsupported time format %s'%value)
 
+def _days_from_civil(year, month, day):
+  '''
+  Return the number of days since epoch of a date in the proleptic Gregorian
+  calendar. See http://howardhinnant.github.io/date_algorithms.html
+  '''
+  # Written without branches so that it works on numpy arrays too.
+  year = year - (month <= 2)
+  era = year // 400
+  yoe = year - era*400
+  doy = (153*(month - 3 + 12*(month <= 2)) + 2)//5 + day-1
+  doe = yoe*365 + yoe//4 - yoe//100 + doy
+  return era*146097 + doe - 719468
+
+def _civil_from_days(days):
+  '''
+  Return the (year, month, day) of a number of days since epoch. Inverse of
+  _days_from_civil.
+  '''
+  days = days + 719468
+  era = days // 146097
+  doe = days - era*146097
+  yoe = (doe - doe//1460 + doe//36524 - doe//146096) // 365
+  doy = doe - (365*yoe + yoe//4 - yoe//100)
+  mp = (5*doy + 2)//153
+  day = doy - (153*mp + 2)//5 + 1
+  month = mp + 3 - 12*(mp >= 10)
+  return (yoe + era*400 + (month <= 2), month, day)
+
 class RelativeTime(object):
   '''
   Functions associated with relative time intervals.
@@ -96,6 +137,21 @@ class RelativeTime(object):
     '''
     return bucket * self._step
 
+  def bucketize(self, timestamps, steps=0):
+    '''
+    Calculate the buckets for a sequence of timestamps, optionally including
+    a step offset. Returns a numpy array if numpy is installed, else a list.
+    '''
+    if numpy is None:
+      return [ self.to_bucket(t, steps) for t in timestamps ]
+
+    timestamps = numpy.asarray( timestamps )
+    if timestamps.dtype.kind in 'iu':
+      buckets = timestamps // self._step
+    else:
+      buckets = numpy.trunc( timestamps / float(self._step) )
+    return buckets.astype(numpy.int64) + steps
+
   def buckets(self, start, end):
     '''
     Calculate the buckets within a starting and ending timestamp.
@@ -136,21 +192,21 @@ class GregorianTime(object):
   '''
   Functions associated with gregorian time intervals.
   '''
-  # NOTE: strptime weekly has the following bug:
-  # In [10]: datetime.strptime('197001', '%Y%U')
-  # Out[10]: datetime.datetime(1970, 1, 1, 0, 0)
-  # In [11]: datetime.strptime('197002', '%Y%U')
-  # Out[11]: datetime.datetime(1970, 1, 1, 0, 0)
-
-  FORMATS = {
-    'daily'   : '%Y%m%d',
-    'weekly'  : '%Y%U',
-    'monthly' : '%Y%m',
-    'yearly'  : '%Y'
-  }
+  # NOTE: all bucket math is done on whole days since epoch (UTC) rather than
+  # through strftime/strptime. Buckets keep the same integer format as the
+  # strftime codes the keys were originally derived from.
+  #   daily   : %Y%m%d
+  #   weekly  : %Y%U (week of the year, Sunday as the first day of the week)
+  #   monthly : %Y%m
+  #   yearly  : %Y
+
+  # Bound on the number of memoized conversions in each direction.
+  CACHE_SIZE = 1024
 
   def __init__(self, step='daily'):
     self._step = step
+    self._to_cache = {}
+    self._from_cache = {}
 
   def step_size(self, t0, t1=None):
     '''
@@ -165,64 +221,64 @@ class GregorianTime(object):
       tb1 = self.to_bucket( t0, steps=1 )
 
     # Calculate the difference in days, then multiply by simple scalar
-    days = (self.from_bucket(tb1, native=True) - self.from_bucket(tb0, native=True)).days
+    days = self._bucket_days(tb1) - self._bucket_days(tb0)
     return days * SIMPLE_TIMES['d']
 
   def to_bucket(self, timestamp, steps=0):
     '''
     Calculate the bucket from a timestamp.
     '''
-    dt = datetime.utcfromtimestamp( timestamp )
-
-    if steps!=0:
-      if self._step == 'daily':
-        dt = dt + timedelta(days=steps)
-      elif self._step == 'weekly':
-        dt = dt + timedelta(weeks=steps)
-      elif self._step == 'monthly':
-        dt = dt + MonthDelta(steps)
-      elif self._step == 'yearly':
-        year = int(dt.strftime( self.FORMATS[self._step] ))
-        year += steps
-        dt = datetime(year=year, month=1, day=1)
-
-    return int(dt.strftime( self.FORMATS[self._step] ))
+    days = int( timestamp // SIMPLE_TIMES['d'] )
+    key = (days, steps)
+    bucket = self._to_cache.get( key )
+    if bucket is None:
+      bucket = self._days_bucket( days, steps )
+      if len(self._to_cache) >= self.CACHE_SIZE:
+        self._to_cache.clear()
+      self._to_cache[ key ] = bucket
+    return bucket
 
   def from_bucket(self, bucket, native=False):
     '''
     Calculate the timestamp given a bucket.
     '''
-    # NOTE: this is due to a bug somewhere in strptime that does not process
-    # the week number of '%Y%U' correctly. That bug could be very specific to
-    # the combination of python and ubuntu that I was testing.
-    bucket = str(bucket)
-    if self._step == 'weekly':
-      year, week = bucket[:4], bucket[4:]
-      normal = datetime(year=int(year), month=1, day=1) + timedelta(weeks=int(week))
-    else:
-      normal = datetime.strptime(bucket, self.FORMATS[self._step])
+    days = self._bucket_days( bucket )
     if native:
-      return normal
-    return long(time.mktime( normal.timetuple() ))
+      return EPOCH + timedelta(days=days)
+    return long( days * SIMPLE_TIMES['d'] )
+
+  def bucketize(self, timestamps, steps=0):
+    '''
+    Calculate the buckets for a sequence of timestamps, optionally including
+    a step offset. Returns a numpy array if numpy is installed, else a list.
+    '''
+    if numpy is None:
+      return [ self.to_bucket(t, steps) for t in timestamps ]
+
+    days = numpy.floor_divide( numpy.asarray(timestamps), SIMPLE_TIMES['d'] )
+    return self._days_bucket( days.astype(numpy.int64), steps )
 
   def buckets(self, start, end):
     '''
     Calculate the buckets within a starting and ending timestamp.
     '''
     rval = [ self.to_bucket(start) ]
-    step = 1
-
-    # In theory there's already been a check that end>start
-    # TODO: Not a fan of an unbound while loop here
-    while True:
-      bucket = self.to_bucket(start, step)
-      bucket_time = self.from_bucket( bucket )
+    if end <= start:
+      return rval
+
+    # Every step covers at least a day, so there can never be more steps than
+    # there are days in the range.
+    start_days = int( start // SIMPLE_TIMES['d'] )
+    end_days = int( end // SIMPLE_TIMES['d'] )
+    for step in range(1, end_days - start_days + 2):
+      bucket = self._days_bucket(start_days, step)
+      bucket_days = self._bucket_days( bucket )
+      bucket_time = bucket_days * SIMPLE_TIMES['d']
       if bucket_time >= end:
         if bucket_time==end:
           rval.append( bucket )
         break
       rval.append( bucket )
-      step += 1
 
     return rval
 
@@ -249,9 +305,9 @@ class GregorianTime(object):
         ntime = self.to_bucket(time.time())
 
         # Convert to number of days
-        day_diff = (self.from_bucket(ntime, native=True) - self.from_bucket(rtime, native=True)).days
+        day_diff = self._bucket_days(ntime) - self._bucket_days(rtime)
         # Convert steps to number of days as well
-        step_diff = (steps*SIMPLE_TIMES[self._step[0]]) / SIMPLE_TIMES['d']
+        step_diff = (steps*SIMPLE_TIMES[self._step[0]]) // SIMPLE_TIMES['d']
 
         # The relative time is beyond our TTL cutoff
         if day_diff > step_diff:
@@ -263,6 +319,51 @@ class GregorianTime(object):
 
     return None
 
+  def _days_bucket(self, days, steps=0):
+    '''
+    Calculate the bucket for a number of days since epoch, optionally
+    including a step offset. Also works on numpy arrays of days.
+    '''
+    if self._step == 'daily':
+      year, month, day = _civil_from_days( days + steps )
+      return year*10000 + month*100 + day
+
+    elif self._step == 'weekly':
+      days = days + 7*steps
+      year, month, day = _civil_from_days( days )
+      yday = days - _days_from_civil( year, 1, 1 )
+      wday = (days + 4) % 7   # 1970-01-01 was a Thursday, Sunday is 0
+      return year*100 + (yday + 7 - wday) // 7
+
+    elif self._step == 'monthly':
+      year, month, day = _civil_from_days( days )
+      months = year*12 + month-1 + steps
+      return (months // 12)*100 + (months % 12) + 1
+
+    elif self._step == 'yearly':
+      return _civil_from_days( days )[0] + steps
+
+  def _bucket_days(self, bucket):
+    '''
+    Calculate the number of days since epoch at which a bucket starts.
+    '''
+    days = self._from_cache.get( bucket )
+    if days is None:
+      bucket = int( bucket )
+      if self._step == 'daily':
+        days = _days_from_civil( bucket//10000, (bucket//100)%100, bucket%100 )
+      elif self._step == 'weekly':
+        days = _days_from_civil( bucket//100, 1, 1 ) + 7*(bucket%100)
+      elif self._step == 'monthly':
+        days = _days_from_civil( bucket//100, bucket%100, 1 )
+      elif self._step == 'yearly':
+        days = _days_from_civil( bucket, 1, 1 )
+
+      if len(self._from_cache) >= self.CACHE_SIZE:
+        self._from_cache.clear()
+      self._from_cache[ bucket ] = days
+    return days
+
 class TimeseriesMeta(type):
   '''
   Meta class for URL parsing
@@ -355,8 +456,24 @@ class Timeseries(object):
           # resolution down to the day, or resolution=86400. Defaults to same
           # value as "step".
           resolution: 60,
+
+          # Optional, series only. The maximum number of values to store in
+          # each bucket. The newest values are kept along with the total
+          # number inserted, and are read back as a Sample.
+          max_values: 1000,
+
+          # Optional, histograms and sets only. The maximum number of distinct
+          # values to store in each bucket. Inserts of new values into a full
+          # bucket are counted as an overflow.
+          max_cardinality: 10000,
         }
       }
+
+    overflow_func
+      Optional, a function which is called with the name, interval and
+      number of values whenever inserts overflow a bucket which has reached
+      max_cardinality. The total is also counted in the "overflowed"
+      attribute.
     '''
     # Process the configuration first so that the backends can use that to
     # complete their setup.
@@ -365,6 +482,8 @@ class Timeseries(object):
     self._read_func = kwargs.get('read_func',None)
     self._write_func = kwargs.get('write_func',None)
     self._intervals = kwargs.get('intervals', {})
+    self._overflow_func = kwargs.get('overflow_func')
+    self.overflowed = 0
 
     # Preprocess the intervals
     for interval,config in self._intervals.items():
@@ -436,6 +555,28 @@ class Timeseries(object):
           names[name] = [ self._write_func(v) for v in values ]
     self._batch_insert(inserts, intervals, **kwargs)
 
+  def bulk_insert_arrays(self, names, timestamps, values, intervals=0, **kwargs):
+    '''
+    Perform a bulk insert from parallel sequences of names, timestamps and
+    values, which may be lists or numpy arrays. If names is a single string,
+    all of the values are inserted into that timeseries.
+
+    All of the timestamps are bucketized at once and the values grouped by
+    name, interval and bucket, so that backends can write each group as a
+    single aggregated update rather than one update per value.
+    '''
+    names, timestamps, values = [ x.tolist() if hasattr(x,'tolist') else x
+      for x in (names, timestamps, values) ]
+    if isinstance(names, (str,unicode)):
+      names = [names]*len(timestamps)
+    if not len(names)==len(timestamps)==len(values):
+      raise ValueError('names, timestamps and values must be the same length')
+
+    if self._write_func:
+      values = [ self._write_func(v) for v in values ]
+    groups = self._group_arrays(names, timestamps, values, intervals)
+    self._insert_groups(groups, **kwargs)
+
   def insert(self, name, value, timestamp=None, intervals=0, **kwargs):
     '''
     Insert a value for the timeseries "name". For each interval in the
@@ -474,13 +615,122 @@ class Timeseries(object):
   def _batch_insert(self, inserts, intervals, **kwargs):
     '''
     Support for batch insert. Default implementation is non-optimized and
-    is a simple loop over values.
+    is a simple loop over values. If "aggregated" is True, the inserts hold
+    the aggregated data of each name rather than a list of values.
     '''
+    aggregated = kwargs.pop('aggregated', False)
     for timestamp,names in inserts.iteritems():
       for name,values in names.iteritems():
+        if aggregated:
+          values = self._expand(values)
         for value in values:
           self._insert( name, value, timestamp, intervals, **kwargs )
 
+  def bucketize(self, interval, timestamps):
+    '''
+    Calculate the interval and resolution buckets for a sequence of timestamps
+    in a single pass. Returns a tuple of ( interval_buckets, resolution_buckets )
+    which are numpy arrays if numpy is installed, else lists. If the interval
+    has no resolution, both are the interval buckets.
+
+    Raises UnknownInterval if `interval` is not one of the configured
+    intervals.
+    '''
+    config = self._intervals.get(interval)
+    if not config:
+      raise UnknownInterval(interval)
+
+    i_buckets = config['i_calc'].bucketize( timestamps )
+    if config['coarse']:
+      return i_buckets, i_buckets
+    return i_buckets, config['r_calc'].bucketize( timestamps )
+
+  def _group_arrays(self, names, timestamps, values, intervals):
+    '''
+    Group parallel lists of names, timestamps and values by bucket. Returns an
+    ordered dict of the form
+
+      { (interval, name, i_bucket, r_bucket) : (timestamp, [ values ]) }
+
+    where timestamp is the first timestamp seen for the bucket, and values
+    are in the order in which they were supplied.
+    '''
+    groups = OrderedDict()
+    for interval,config in self._intervals.iteritems():
+      for tstamps in self._normalize_arrays(timestamps, intervals, config):
+        i_buckets, r_buckets = self.bucketize(interval, tstamps)
+        if hasattr(i_buckets, 'tolist'):
+          i_buckets, r_buckets = i_buckets.tolist(), r_buckets.tolist()
+
+        for idx,value in enumerate(values):
+          key = (interval, names[idx], i_buckets[idx], r_buckets[idx])
+          group = groups.get(key)
+          if group is None:
+            groups[key] = (tstamps[idx], [value])
+          else:
+            group[1].append( value )
+    return groups
+
+  def _group_inserts(self, inserts, intervals):
+    '''
+    Group the values of a bulk insert by bucket, in the same form as
+    _group_arrays.
+    '''
+    groups = OrderedDict()
+    for interval,config in self._intervals.iteritems():
+      for timestamp,names in inserts.iteritems():
+        for tstamp in self._normalize_timestamps(timestamp, intervals, config):
+          i_bucket = config['i_calc'].to_bucket( tstamp )
+          r_bucket = config['r_calc'].to_bucket( tstamp )
+          for name,values in names.iteritems():
+            key = (interval, name, i_bucket, r_bucket)
+            group = groups.get(key)
+            if group is None:
+              groups[key] = (tstamp, list(values))
+            else:
+              group[1].extend( values )
+    return groups
+
+  def _group_aggregates(self, inserts, intervals):
+    '''
+    Group the aggregated data of a bulk insert by bucket. Returns groups in
+    the same form as _group_inserts, but with the merged data of each bucket
+    in place of its list of values.
+    '''
+    groups = OrderedDict()
+    for interval,config in self._intervals.iteritems():
+      for timestamp,names in inserts.iteritems():
+        for tstamp in self._normalize_timestamps(timestamp, intervals, config):
+          i_bucket = config['i_calc'].to_bucket( tstamp )
+          r_bucket = config['r_calc'].to_bucket( tstamp )
+          for name,data in names.iteritems():
+            key = (interval, name, i_bucket, r_bucket)
+            group = groups.get(key)
+            if group is None:
+              groups[key] = (tstamp, data)
+            else:
+              groups[key] = (group[0], self._merge(group[1], data))
+    return groups
+
+  def _normalize_arrays(self, timestamps, intervals, config):
+    '''
+    Helper to generate a list of timestamp lists, the array equivalent of
+    _normalize_timestamps.
+    '''
+    rval = [timestamps]
+    if intervals<0:
+      steps = range(intervals, 0)
+    else:
+      steps = range(intervals, 0, -1)
+
+    for step in steps:
+      buckets = config['i_calc'].bucketize(timestamps, step)
+      if hasattr(buckets, 'tolist'):
+        buckets = buckets.tolist()
+      normal = { b : config['i_calc'].from_bucket(b) for b in set(buckets) }
+      rval.append( [ normal[b] for b in buckets ] )
+    return rval
+
   def _normalize_timestamps(self, timestamp, intervals, config):
     '''
     Helper for the subclasses to generate a list of timestamps.
@@ -502,6 +752,16 @@ class Timeseries(object):
     '''
     raise NotImplementedError()
 
+  def _insert_groups(self, groups, **kwargs):
+    '''
+    Support for inserting values which have been grouped by bucket. Default
+    implementation is non-optimized and inserts each value separately.
+    '''
+    for (interval, name, i_bucket, r_bucket),(timestamp, values) in groups.iteritems():
+      config = self._intervals[interval]
+      for value in values:
+        self._insert_data(name, value, timestamp, interval, config)
+
   def delete(self, name):
     '''
     Delete all data in a timeseries. Subclasses are responsible for
@@ -571,6 +831,7 @@ class Timeseries(object):
     config = self._intervals.get(interval)
     if not config:
       raise UnknownInterval(interval)
+    kwargs = self._get_kwargs(name, interval, kwargs)
 
     timestamp = kwargs.get('timestamp', time.time())
     fetch = kwargs.get('fetch')
@@ -588,12 +849,18 @@ class Timeseries(object):
     # minimum we'd have to rebuild the results anyway because of the potential
     # for sparse data points would result in an out-of-order result.
     if isinstance(name, (list,tuple,set)):
-      results = [ self._get(x, interval, config, timestamp, fetch=fetch, process_row=process_row) for x in name ]
+      results = self._get_multi( name, interval, config, timestamp, fetch=fetch, process_row=process_row )
       # Even resolution data is "coarse" in that it's not nested
       rval = self._join_results( results, True, join_rows )
     else:
       rval = self._get( name, interval, config, timestamp, fetch=fetch, process_row=process_row )
 
+    return self._get_result(rval, config, timestamp, condense, transform)
+
+  def _get_result(self, rval, config, timestamp, condense, transform):
+    '''
+    Condense and transform the data fetched by get().
+    '''
     # If condensed, collapse the result into a single row. Adjust the step_size
     # calculation to match.
     if config['coarse']:
@@ -610,12 +877,27 @@ class Timeseries(object):
         rval[k] = self._process_transform(v, transform, step_size)
     return rval
 
+  def _get_kwargs(self, name, interval, kwargs):
+    '''
+    Return the keyword arguments for get(), which a backend can rewrite to
+    fetch the data more efficiently. Default implementation returns them
+    unaltered.
+    '''
+    return kwargs
+
   def _get(self, name, interval, config, timestamp, fetch):
     '''
     Support for the insert per type of series.
     '''
     raise NotImplementedError()
 
+  def _get_multi(self, names, interval, config, timestamp, **kws):
+    '''
+    Fetch a single interval for several names, returning a list of results
+    in the same order. Default implementation fetches each name separately.
+    '''
+    return [ self._get(name, interval, config, timestamp, **kws) for name in names ]
+
   def series(self, name, interval, **kwargs):
     '''
     Return all the data in a named time series for a given interval. If steps
@@ -634,6 +916,7 @@ class Timeseries(object):
     config = self._intervals.get(interval)
     if not config:
       raise UnknownInterval(interval)
+    kwargs = self._series_kwargs(name, interval, kwargs)
 
     start = kwargs.get('start')
     end = kwargs.get('end')
@@ -682,11 +965,17 @@ class Timeseries(object):
     # minimum we'd have to rebuild the results anyway because of the potential
     # for sparse data points would result in an out-of-order result.
     if isinstance(name, (list,tuple,set)):
-      results = [ self._series(x, interval, config, interval_buckets, fetch=fetch, process_row=process_row) for x in name ]
+      results = self._series_multi( name, interval, config, interval_buckets, fetch=fetch, process_row=process_row )
       rval = self._join_results( results, config['coarse'], join_rows )
     else:
       rval = self._series(name, interval, config, interval_buckets, fetch=fetch, process_row=process_row)
 
+    return self._series_result(rval, config, condense, collapse, transform)
+
+  def _series_result(self, rval, config, condense, collapse, transform):
+    '''
+    Condense, collapse and transform the data fetched by series().
+    '''
     # If fine-grained, first do the condensed pass so that it's easier to do
     # the collapse afterwards. Be careful not to run the transform if there's
     # going to be another pass at condensing the data.
@@ -718,12 +1007,27 @@ class Timeseries(object):
 
     return rval
 
+  def _series_kwargs(self, name, interval, kwargs):
+    '''
+    Return the keyword arguments for series(), which a backend can rewrite to
+    fetch the data more efficiently. Default implementation returns them
+    unaltered.
+    '''
+    return kwargs
+
   def _series(self, name, interval, config, buckets, **kws):
     '''
     Subclasses must implement fetching a series.
     '''
     raise NotImplementedError()
 
+  def _series_multi(self, names, interval, config, buckets, **kws):
+    '''
+    Fetch a series for several names, returning a list of results in the same
+    order. Default implementation fetches each name separately.
+    '''
+    return [ self._series(name, interval, config, buckets, **kws) for name in names ]
+
   def _join_results(self, results, coarse, join):
     '''
     Join a list of results. Supports both get and series.
@@ -774,6 +1078,23 @@ class Timeseries(object):
     '''
     raise NotImplementedError()
 
+  def _overflow(self, name, interval, count):
+    '''
+    Report that inserts of "count" values overflowed a bucket.
+    '''
+    self.overflowed += count
+    if self._overflow_func:
+      self._overflow_func(name, interval, count)
+
+  def _sample(self, row, total):
+    '''
+    Return a processed row of a bounded bucket as a Sample of the total
+    number of values inserted, if the total is known.
+    '''
+    if total is not None and isinstance(row, list):
+      return Sample( row, int(total) )
+    return row
+
   def _condense(self, data):
     '''
     Condense a mapping of timestamps and associated data into a single
@@ -788,6 +1109,70 @@ class Timeseries(object):
     '''
     raise NotImplementedError()
 
+  def _merge(self, data, other):
+    '''
+    Merge two aggregated data into new aggregated data, without modifying
+    either of them.
+    '''
+    return self._aggregate( self._expand(other), self._aggregate(self._expand(data)) )
+
+
+class BucketStats(object):
+  '''
+  Summary of the data in one or more buckets, which is fetched in place of the
+  data when a transform can be calculated by the datastore.
+  '''
+
+  __slots__ = ('count', 'total', 'minimum', 'maximum')
+
+  def __init__(self, count=0, total=0, minimum=None, maximum=None):
+    self.count = count
+    self.total = total
+    self.minimum = minimum
+    self.maximum = maximum
+
+  @classmethod
+  def merge(cls, rows):
+    '''
+    Merge the stats of several buckets, ignoring missing or empty rows.
+    '''
+    rval = cls()
+    for row in rows:
+      if not isinstance(row, BucketStats):
+        continue
+      rval.count += row.count
+      rval.total += row.total
+      if row.minimum is not None and (rval.minimum is None or row.minimum<rval.minimum):
+        rval.minimum = row.minimum
+      if row.maximum is not None and (rval.maximum is None or row.maximum>rval.maximum):
+        rval.maximum = row.maximum
+    return rval
+
+  def transform(self, transform, step_size):
+    if transform=='count':
+      return self.count
+    elif transform=='rate':
+      return self.count / float(step_size)
+    elif transform=='sum':
+      return self.total
+    elif transform=='min':
+      return self.minimum if self.minimum is not None else 0
+    elif transform=='max':
+      return self.maximum if self.maximum is not None else 0
+    elif transform=='mean':
+      return float(self.total)/float(self.count) if self.count>0 else 0
+    raise ValueError(transform)
+
+class Sample(list):
+  '''
+  The values read from a bucket of a series which stores at most
+  "max_values", with the total number of values inserted into the bucket. If
+  the total is greater than the length of the list, the list is a sample.
+  '''
+
+  def __init__(self, values=(), total=None):
+    super(Sample,self).__init__(values)
+    self.total = len(self) if total is None else total
 
 class Series(Timeseries):
   '''
@@ -807,7 +1192,7 @@ class Series(Timeseries):
       count = len( data )
       data = float(total)/float(count) if count>0 else 0
     elif transform=='count':
-      data = len( data )
+      data = getattr( data, 'total', len(data) )
     elif transform=='min':
       data = min( data or [0])
     elif transform=='max':
@@ -815,11 +1200,27 @@ class Series(Timeseries):
     elif transform=='sum':
       data = sum( data )
     elif transform=='rate':
-      data = len( data ) / float(step_size)
+      data = getattr( data, 'total', len(data) ) / float(step_size)
     elif callable(transform):
       data = transform(data, step_size)
     return data
 
+  def _aggregate(self, values, data=None):
+    '''
+    Aggregate a list of inserted values into the data stored in a bucket,
+    merging into previously aggregated data if supplied.
+    '''
+    if data is None:
+      return list(values)
+    data.extend( values )
+    return data
+
+  def _expand(self, data):
+    '''
+    Expand aggregated data into a list of values which aggregate to it.
+    '''
+    return data
+
   def _process_row(self, data):
     if self._read_func:
       return map(self._read_func, data)
@@ -830,16 +1231,19 @@ class Series(Timeseries):
     Condense by adding together all of the lists.
     '''
     if data:
-      return reduce(operator.add, data.values())
+      return self._join( data.values() )
     return []
 
   def _join(self, rows):
     '''
-    Join multiple rows worth of data into a single result.
+    Join multiple rows worth of data into a single result. If any of the rows
+    is a Sample, so is the result.
     '''
     rval = []
     for row in rows:
       if row: rval.extend( row )
+    if any( isinstance(row, Sample) for row in rows ):
+      rval = Sample( rval, sum(getattr(row,'total',len(row)) for row in rows if row) )
     return rval
 
 class Histogram(Timeseries):
@@ -855,8 +1259,11 @@ class Histogram(Timeseries):
   def _transform(self, data, transform, step_size):
     '''
     Transform the data. If the transform is not supported by this series,
-    returns the data unaltered.
+    returns the data unaltered. Overflowed values are only counted.
     '''
+    if None in data and transform in ('mean','min','max','sum'):
+      data = { k:v for k,v in data.items() if k is not None }
+
     if transform=='mean':
       total = sum( k*v for k,v in data.items() )
       count = sum( data.values() )
@@ -875,10 +1282,41 @@ class Histogram(Timeseries):
       data = transform(data, step_size)
     return data
 
+  def _aggregate(self, values, data=None):
+    '''
+    Aggregate a list of inserted values into the data stored in a bucket,
+    merging into previously aggregated data if supplied.
+    '''
+    rval = {} if data is None else data
+    for value in values:
+      rval[ value ] = rval.get(value,0) + 1
+    return rval
+
+  def _expand(self, data):
+    '''
+    Expand aggregated data into a list of values which aggregate to it.
+    '''
+    rval = []
+    for value,count in data.items():
+      rval.extend( [value]*count )
+    return rval
+
+  def _merge(self, data, other):
+    '''
+    Merge two aggregated data by adding their counts.
+    '''
+    rval = dict(data)
+    for value,count in other.iteritems():
+      rval[ value ] = rval.get(value,0) + count
+    return rval
+
   def _process_row(self, data):
     rval = {}
     for value,count in data.items():
-      if self._read_func: value = self._read_func(value)
+      if value==OVERFLOW_VALUE:
+        value = None
+      elif self._read_func:
+        value = self._read_func(value)
       rval[ value ] = int(count)
     return rval
 
@@ -925,6 +1363,19 @@ class Count(Timeseries):
   def insert(self, name, value=1, timestamp=None, **kwargs):
     super(Count,self).insert(name, value, timestamp, **kwargs)
 
+  def _aggregate(self, values, data=None):
+    '''
+    Aggregate a list of inserted values into the data stored in a bucket,
+    merging into previously aggregated data if supplied.
+    '''
+    return sum(values, data or 0)
+
+  def _expand(self, data):
+    '''
+    Expand aggregated data into a list of values which aggregate to it.
+    '''
+    return [ data ]
+
   def _process_row(self, data):
     return int(data) if data else 0
 
@@ -963,6 +1414,19 @@ class Gauge(Timeseries):
       data = transform(data, step_size)
     return data
 
+  def _aggregate(self, values, data=None):
+    '''
+    Aggregate a list of inserted values into the data stored in a bucket,
+    merging into previously aggregated data if supplied.
+    '''
+    return values[-1] if values else data
+
+  def _expand(self, data):
+    '''
+    Expand aggregated data into a list of values which aggregate to it.
+    '''
+    return [ data ]
+
   def _process_row(self, data):
     if self._read_func:
       return self._read_func(data or '')
@@ -1018,6 +1482,22 @@ class Set(Timeseries):
       data = transform(data)
     return data
 
+  def _aggregate(self, values, data=None):
+    '''
+    Aggregate a list of inserted values into the data stored in a bucket,
+    merging into previously aggregated data if supplied.
+    '''
+    if data is None:
+      return set(values)
+    data.update( values )
+    return data
+
+  def _expand(self, data):
+    '''
+    Expand aggregated data into a list of values which aggregate to it.
+    '''
+    return list(data)
+
   def _process_row(self, data):
     if self._read_func:
       return set( (self._read_func(d) for d in data) )
@@ -1044,6 +1524,7 @@ class Set(Timeseries):
 try:
   from .redis_backend import RedisBackend
   BACKENDS['redis'] = RedisBackend
+  BACKENDS['rediscluster'] = RedisBackend
 except ImportError as e:
   warnings.warn('Redis backend not loaded, {}'.format(e))
 
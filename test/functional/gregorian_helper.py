@@ -1,5 +1,6 @@
 from helper_helper import *
 from helper_helper import _time
+import calendar
 
 @unittest.skipUnless( os.environ.get('TEST_GREGORIAN','true').lower()=='true', 'skipping gregorian' )
 class GregorianHelper(Chai):
@@ -79,9 +80,9 @@ class GregorianHelper(Chai):
   def test_get(self):
     for day in range(0,365):
       d = datetime(year=2038, month=1, day=1) + timedelta(days=day)
-      t = time.mktime( d.timetuple() )
+      t = calendar.timegm( d.timetuple() )
       self.series.insert( 'test', 1, t )
-    feb1 = long( time.mktime( datetime(year=2038,month=2,day=1).timetuple() ) )
+    feb1 = long( calendar.timegm( datetime(year=2038,month=2,day=1).timetuple() ) )
 
     data = self.series.get('test', 'daily', timestamp=feb1)
     assert_equals( [1], data[feb1] )
@@ -103,11 +104,11 @@ class GregorianHelper(Chai):
   def test_series(self):
     for day in range(0,2*365):
       d = datetime(year=2038, month=1, day=1) + timedelta(days=day)
-      t = time.mktime( d.timetuple() )
+      t = calendar.timegm( d.timetuple() )
       self.series.insert( 'test', 1, t )
 
-    start = long( time.mktime( datetime(year=2038,month=1,day=1).timetuple() ) )
-    end = long( time.mktime( datetime(year=2038,month=12,day=31).timetuple() ) )
+    start = long( calendar.timegm( datetime(year=2038,month=1,day=1).timetuple() ) )
+    end = long( calendar.timegm( datetime(year=2038,month=12,day=31).timetuple() ) )
 
     data = self.series.series('test', 'daily', start=start, end=end)
     assert_equals( 365, len(data) )
@@ -4,8 +4,8 @@ Implementation of functional tests independent of backend
 
 from .api_helper import ApiHelper
 from .gregorian_helper import GregorianHelper
-from .series_helper import SeriesHelper
-from .histogram_helper import HistogramHelper
+from .series_helper import SeriesHelper, BoundedSeriesHelper
+from .histogram_helper import HistogramHelper, CappedHistogramHelper
 from .count_helper import CountHelper
 from .set_helper import SetHelper
 from .gauge_helper import GaugeHelper
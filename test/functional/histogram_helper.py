@@ -47,6 +47,38 @@ class HistogramHelper(Chai):
     t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
     assert_equals( {1:1, 2:1, 3:1}, t1_i2[_time(60)] )
 
+  def test_bulk_insert_arrays(self):
+    names = ['test1']*3 + ['test2']*3 + ['test3']*3 + \
+      ['test1']*3 + ['test2']*3 + ['test1']*3 + ['test3']*3
+    timestamps = [_time(0)]*9 + [_time(30)]*6 + [_time(60)]*6
+    values = [1,2,3,4,5,6,7,8,9, 1,2,3,4,5,6, 1,2,3,7,8,9]
+    self.series.bulk_insert_arrays( names, timestamps, values )
+
+    t1_i1 = self.series.get('test1', 'minute', timestamp=_time(0))
+    assert_equals( {1:2, 2:2, 3:2}, t1_i1[_time(0)] )
+
+    t2_i1 = self.series.get('test2', 'minute', timestamp=_time(0))
+    assert_equals( {4:2, 5:2, 6:2}, t2_i1[_time(0)] )
+
+    t3_i1 = self.series.get('test3', 'minute', timestamp=_time(0))
+    assert_equals( {7:1, 8:1, 9:1}, t3_i1[_time(0)] )
+
+    t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
+    assert_equals( {1:1, 2:1, 3:1}, t1_i2[_time(60)] )
+
+    t1_h1 = self.series.get('test1', 'hour', timestamp=_time(0))
+    assert_equals( { _time(0):{1:2, 2:2, 3:2}, _time(60):{1:1, 2:1, 3:1} }, t1_h1 )
+
+  def test_bulk_insert_arrays_intervals_after(self):
+    timestamps = [_time(0)]*3 + [_time(30)]*3 + [_time(60)]*3
+    self.series.bulk_insert_arrays( 'test1', timestamps, [1,2,3]*3, intervals=2 )
+
+    t1_i3 = self.series.get('test1', 'minute', timestamp=_time(120))
+    assert_equals( {1:3, 2:3, 3:3}, t1_i3[_time(120)] )
+
+    t1_i4 = self.series.get('test1', 'minute', timestamp=_time(180))
+    assert_equals( {1:1, 2:1, 3:1}, t1_i4[_time(180)] )
+
   def test_bulk_insert_intervals_after(self):
     a,b,c,d,e,f = 10,11,12,13,14,15
     inserts = OrderedDict( (
@@ -329,3 +361,56 @@ class HistogramHelper(Chai):
     interval = self.series.series( ['test1','test2'], 'hour', condensed=True, end=_time(4200), steps=2, collapse=True, transform=['min','max','count'] )
     assert_equals( map(_time, [0]), interval.keys() )
     assert_equals( {'min':1,'max':3839,'count':718}, interval[_time(0)] )
+
+@unittest.skipUnless( os.environ.get('TEST_HISTOGRAM','true').lower()=='true', 'skipping histogram' )
+class CappedHistogramHelper(Chai):
+
+  def setUp(self):
+    super(CappedHistogramHelper,self).setUp()
+
+    self.overflows = []
+    self.series = Timeseries(self.client, type='histogram', prefix='kairos',
+      read_func=int, overflow_func=lambda *args: self.overflows.append(args),
+      intervals={
+        'minute' : {
+          'step' : 60,
+          'steps' : 5,
+          'max_cardinality' : 3,
+        },
+        'hour' : {
+          'step' : 3600,
+          'resolution' : 60,
+          'max_cardinality' : 2,
+        }
+      } )
+    self.series.delete_all()
+
+  def tearDown(self):
+    self.series.delete_all()
+
+  def test_new_values_overflow(self):
+    for value in [1, 2, 3, 4, 1]:
+      self.series.insert( 'test', value, timestamp=_time(0) )
+    self.series.bulk_insert( {_time(1):{'test':[2, 5, 5]}} )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0) )
+    assert_equals( {1:2, 2:2, 3:1, None:3}, interval[_time(0)] )
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0) )
+    assert_equals( {1:2, 2:2, None:4}, interval[_time(0)] )
+
+    assert_equals( 7, self.series.overflowed )
+    assert_equals( 7, sum(count for name,interval,count in self.overflows) )
+    assert_equals( set(['minute','hour']),
+      set(interval for name,interval,count in self.overflows) )
+
+  def test_transforms_skip_overflow(self):
+    for value in [1, 2, 3, 4, 5]:
+      self.series.insert( 'test', value, timestamp=_time(0) )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0),
+      transform=['count','mean','max'] )
+    assert_equals( {'count':5, 'mean':2.0, 'max':3}, interval[_time(0)] )
+
+    interval = self.series.series( 'test', 'hour', end=_time(0), condensed=True,
+      transform='count' )
+    assert_equals( 5, interval[_time(0)] )
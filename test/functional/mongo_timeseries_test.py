@@ -5,10 +5,12 @@ import time
 import datetime
 
 from pymongo import *
+from pymongo.errors import BulkWriteError
 from chai import Chai
 
 from . import helpers
 from .helpers import unittest, os, Timeseries
+from .helper_helper import _time
 
 @unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
 class MongoApiTest(helpers.ApiHelper):
@@ -21,6 +23,105 @@ class MongoApiTest(helpers.ApiHelper):
     assert_equals( 'MongoSeries', 
       Timeseries('mongodb://localhost/kairos', type='series').__class__.__name__ )
 
+  def test_reindex(self):
+    self.series.insert( 'test', 32, timestamp=_time(0) )
+    self.series.insert( 'test', 32, timestamp=_time(600) )
+    self.series.insert( 'test1', 32, timestamp=_time(0) )
+    self.client['kairos']['_kairos_names'].remove( {} )
+    assert_equals( [], self.series.list() )
+
+    self.series.reindex()
+    assert_equals( ['test', 'test1'], sorted(self.series.list()) )
+    res = self.series.properties('test')
+    assert_equals( _time(0), res['minute']['first'] )
+    assert_equals( _time(600), res['minute']['last'] )
+    assert_equals( _time(0), res['hour']['last'] )
+
+    self.series.delete('test')
+    assert_equals( ['test1'], self.series.list() )
+
+  def test_list_skips_other_and_expired_names(self):
+    other = Timeseries(self.client, type='series', read_func=int, prefix='kairos',
+      intervals={'day' : {'step' : 86400}} )
+    other.delete_all()
+    other.insert( 'other', 32, timestamp=_time(0) )
+    self.series.insert( 'test', 32, timestamp=_time(0) )
+    assert_equals( ['test'], self.series.list() )
+
+    minutes = Timeseries(self.client, type='series', read_func=int,
+      prefix='kairos', intervals={'minute' : {'step' : 60, 'steps' : 5}} )
+    minutes.insert( 'old', 32, timestamp=time.time()-3600 )
+    assert_equals( ['test'], minutes.list() )
+    other.delete_all()
+
+  def test_properties_skips_expired_buckets(self):
+    now = time.time()
+    self.series.insert( 'test', 32, timestamp=now-600 )
+    self.series.insert( 'test', 32, timestamp=now-60 )
+    self.series.insert( 'test', 32, timestamp=now )
+
+    res = self.series.properties('test')
+    assert_equals( int(now/60)*60-60, res['minute']['first'] )
+    assert_equals( int(now/60)*60, res['minute']['last'] )
+
+  def test_bulk_insert_batches(self):
+    flushes = []
+    series = Timeseries(self.client, type='series', read_func=int,
+      batch_size=2, parallel=True, intervals=self.series._intervals,
+      flush_func=lambda *args: flushes.append(args) )
+    series.bulk_insert( {_time(0):{'test':[1,2], 'test1':[3], 'test2':[4]}} )
+
+    assert_equals( [1,2], series.get('test', 'minute', timestamp=_time(0))[_time(0)] )
+    assert_equals( [4], series.get('test2', 'hour', timestamp=_time(0))[_time(0)] )
+    # 3 documents in each of 3 intervals
+    assert_equals( [1,1,1,2,2,2], sorted(updates for updates,t,e in flushes) )
+    assert_equals( 0, sum(errors for updates,t,errors in flushes) )
+
+  def test_bulk_insert_errors_are_cataloged(self):
+    expect( self.series._bulk_update_interval ).raises( BulkWriteError({}) ).at_least_once()
+    with assert_raises( BulkWriteError ):
+      self.series.bulk_insert( {_time(0):{'test':[1]}} )
+    assert_equals( ['test'], self.series.list() )
+    assert_equals( _time(0), self.series.properties('test')['minute']['last'] )
+
+  def test_transforms_aggregate(self):
+    self.series.bulk_insert( {_time(0):{'test':[1,2,3]}, _time(60):{'test':[4,4]},
+      _time(3600):{'test':[9]}} )
+    transform = ['count','mean','min','max','sum','rate']
+    assert_true( self.series._stats_kwargs('hour', {'transform':transform}, True)['fetch'] )
+    assert_false( self.series._stats_kwargs('hour', {'transform':len}, True).get('fetch') )
+
+    interval = self.series.series( 'test', 'hour', start=_time(0), end=_time(3600),
+      condense=True, transform=transform )
+    assert_equals( {'count':5, 'mean':2.8, 'min':1, 'max':4, 'sum':14, 'rate':5/3600.},
+      interval[_time(0)] )
+    assert_equals( 1, interval[_time(3600)]['count'] )
+
+    interval = self.series.series( 'test', 'minute', start=_time(0), end=_time(60),
+      collapse=True, transform=transform, steps=2 )
+    assert_equals( {'count':5, 'mean':2.8, 'min':1, 'max':4, 'sum':14, 'rate':5/120.},
+      interval[_time(0)] )
+
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0), transform='count' )
+    assert_equals( [(_time(0),3), (_time(60),2)], interval.items() )
+
+  def test_transforms_aggregate_strings(self):
+    self.series.bulk_insert( {_time(0):{'test':['1','2']}, _time(60):{'test':['6']}} )
+    transform = ['mean','max','sum']
+    assert_true( self.series._stats_kwargs('hour', {'transform':transform}, True)['fetch'] )
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0), condense=True,
+      transform=transform )
+    assert_equals( {'mean':3, 'max':6, 'sum':9}, interval[_time(0)] )
+
+    # Floats are stored escaped, so they are transformed by kairos
+    series = Timeseries(self.client, type='series', prefix='kairos',
+      read_func=float, intervals=self.series._intervals )
+    series.bulk_insert( {_time(0):{'test1':['1.5','2.5']}, _time(60):{'test1':['4']}} )
+    assert_false( series._stats_kwargs('hour', {'transform':transform}, True).get('fetch') )
+    interval = series.get( 'test1', 'hour', timestamp=_time(0), condense=True,
+      transform=transform )
+    assert_equals( {'mean':8/3., 'max':4.0, 'sum':8.0}, interval[_time(0)] )
+
 @unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
 class MongoGregorianTest(helpers.GregorianHelper):
 
@@ -35,6 +136,13 @@ class MongoSeriesTest(helpers.SeriesHelper):
     self.client = MongoClient('localhost')
     super(MongoSeriesTest,self).setUp()
 
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoBoundedSeriesTest(helpers.BoundedSeriesHelper):
+
+  def setUp(self):
+    self.client = MongoClient('localhost')
+    super(MongoBoundedSeriesTest,self).setUp()
+
 @unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
 class MongoHistogramTest(helpers.HistogramHelper):
 
@@ -42,6 +150,24 @@ class MongoHistogramTest(helpers.HistogramHelper):
     self.client = MongoClient('localhost')
     super(MongoHistogramTest,self).setUp()
 
+  def test_count_aggregate(self):
+    self.series.bulk_insert( {_time(0):{'test':[1,2,2]}, _time(60):{'test':[3]}} )
+    assert_true( self.series._stats_kwargs('hour', {'transform':'count'}, True)['fetch'] )
+    # Only hashed keys are stored as numbers which can be summed
+    assert_equals( self.series._hashed_keys,
+      'fetch' in self.series._stats_kwargs('hour', {'transform':'mean'}, True) )
+
+    interval = self.series.series( 'test', 'hour', end=_time(0), condense=True,
+      transform='count' )
+    assert_equals( 4, interval[_time(0)] )
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoCappedHistogramTest(helpers.CappedHistogramHelper):
+
+  def setUp(self):
+    self.client = MongoClient('localhost')
+    super(MongoCappedHistogramTest,self).setUp()
+
 @unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
 class MongoCountTest(helpers.CountHelper):
 
@@ -55,3 +181,95 @@ class MongoGaugeTest(helpers.GaugeHelper):
   def setUp(self):
     self.client = MongoClient('localhost')
     super(MongoGaugeTest,self).setUp()
+
+class EmbeddedMixin(object):
+  '''
+  Run a helper with the same configuration but with embedded resolutions.
+  '''
+
+  def setUp(self):
+    super(EmbeddedMixin,self).setUp()
+    self.series = type(self.series)(self.client, embedded=True,
+      read_func=self.series._read_func, write_func=self.series._write_func,
+      intervals=self.series._intervals)
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedGregorianTest(EmbeddedMixin, MongoGregorianTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedSeriesTest(EmbeddedMixin, MongoSeriesTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedBoundedSeriesTest(EmbeddedMixin, MongoBoundedSeriesTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedHistogramTest(EmbeddedMixin, MongoHistogramTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedCountTest(EmbeddedMixin, MongoCountTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedGaugeTest(EmbeddedMixin, MongoGaugeTest):
+
+  def test_one_document_per_interval(self):
+    self.series.bulk_insert( {_time(0):{'test':[1]}, _time(60):{'test':[2]}} )
+    self.series.insert( 'test', 3, timestamp=_time(120) )
+    assert_equals( 1, self.client['kairos']['hour'].find({'name':'test'}).count() )
+
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0) )
+    assert_equals( [(_time(0),1), (_time(60),2), (_time(120),3)], interval.items() )
+
+class HashedKeysMixin(object):
+  '''
+  Run a helper with the same configuration but with hashed histogram keys.
+  '''
+
+  def setUp(self):
+    super(HashedKeysMixin,self).setUp()
+    self.series = type(self.series)(self.client, hashed_keys=True,
+      read_func=self.series._read_func, write_func=self.series._write_func,
+      overflow_func=self.series._overflow_func, intervals=self.series._intervals)
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoHashedKeysHistogramTest(HashedKeysMixin, MongoHistogramTest):
+
+  def test_native_keys(self):
+    self.series._read_func = None
+    self.series.insert( 'test', 'a.b', timestamp=_time(0) )
+    self.series.insert( 'test', '$c', timestamp=_time(0) )
+    self.series.bulk_insert( {_time(0):{'test':[1.5, 2, 2.0]}} )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0) )
+    assert_equals( {'a.b':1, '$c':1, 1.5:1, 2:2}, interval[_time(0)] )
+    assert_true( self.series._stats_kwargs('minute', {'transform':'mean'}, False).get('fetch') is None )
+
+  def test_value_transforms_aggregate(self):
+    self.series.bulk_insert( {_time(0):{'test':[1, 2, 2]}, _time(60):{'test':[5]}} )
+    assert_true( self.series._stats_kwargs('hour', {'transform':'mean'}, True)['fetch'] )
+
+    interval = self.series.series( 'test', 'hour', end=_time(0), condense=True,
+      transform=['count','mean','min','max','sum'] )
+    assert_equals( {'count':4, 'mean':2.5, 'min':1, 'max':5, 'sum':10}, interval[_time(0)] )
+
+  def test_value_transforms_aggregate_strings(self):
+    self.series._read_func = float
+    self.series.bulk_insert( {_time(0):{'test':['1.5', '2.5', '2.5']}, _time(60):{'test':['4']}} )
+    assert_true( self.series._stats_kwargs('hour', {'transform':'mean'}, True)['fetch'] )
+
+    interval = self.series.series( 'test', 'hour', end=_time(0), condense=True,
+      transform=['count','mean','min','max','sum'] )
+    assert_equals( {'count':4, 'mean':2.625, 'min':1.5, 'max':4.0, 'sum':10.5},
+      interval[_time(0)] )
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoHashedKeysCappedHistogramTest(HashedKeysMixin, MongoCappedHistogramTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_MONGO','true').lower()=='true', 'skipping mongo' )
+class MongoEmbeddedHashedKeysHistogramTest(HashedKeysMixin, MongoEmbeddedHistogramTest):
+  pass
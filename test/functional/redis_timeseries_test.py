@@ -6,9 +6,11 @@ import datetime
 
 import redis
 from chai import Chai
+from collections import OrderedDict
 
 from . import helpers
 from .helpers import unittest, os, Timeseries
+from .helper_helper import _time
 
 @unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
 class RedisApiTest(helpers.ApiHelper):
@@ -21,6 +23,46 @@ class RedisApiTest(helpers.ApiHelper):
     assert_equals( 'RedisSeries', 
       Timeseries('redis://', type='series').__class__.__name__ )
 
+  def test_reindex(self):
+    self.series.insert( 'test', 32, timestamp=_time(0) )
+    self.series.insert( 'test', 32, timestamp=_time(600) )
+    self.series.insert( 'test1', 32, timestamp=_time(0) )
+    self.client.delete( 'kairos:_names', *self.client.keys('kairos:*:buckets') )
+    assert_equals( [], self.series.list() )
+
+    self.series.reindex()
+    assert_equals( ['test', 'test1'], sorted(self.series.list()) )
+    res = self.series.properties('test')
+    assert_equals( _time(0), res['minute']['first'] )
+    assert_equals( _time(600), res['minute']['last'] )
+    assert_equals( _time(0), res['hour']['last'] )
+
+    self.series.delete('test')
+    self.series.delete('test1')
+    assert_equals( [], self.client.keys('kairos:*') )
+
+  def test_properties_skips_expired_buckets(self):
+    now = time.time()
+    self.series.insert( 'test', 32, timestamp=now )
+    self.client.zadd( 'kairos:test:minute:buckets', int(now/60)-6, int(now/60)-6 )
+
+    res = self.series.properties('test')
+    assert_equals( int(now/60)*60, res['minute']['first'] )
+
+  def test_list_skips_expired_names(self):
+    series = Timeseries(self.client, type='series', prefix='kairos',
+      read_func=int, intervals={'minute' : {'step' : 60, 'steps' : 5}} )
+    now = time.time()
+    series.insert( 'old', 32, timestamp=now )
+    series.insert( 'new', 32, timestamp=now )
+    self.client.delete( *self.client.keys('kairos:old:*') )
+    self.client.zadd( 'kairos:old:minute:buckets', int(now/60)-6, int(now/60)-6 )
+
+    assert_equals( ['new'], series.list() )
+    assert_equals( set(['old','new']), self.client.smembers('kairos:_names') )
+    assert_equals( [], self.client.keys('kairos:old:*') )
+    self.client.srem( 'kairos:_names', 'old' )
+
 @unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
 class RedisGregorianTest(helpers.GregorianHelper):
 
@@ -35,6 +77,13 @@ class RedisSeriesTest(helpers.SeriesHelper):
     self.client = redis.Redis('localhost')
     super(RedisSeriesTest,self).setUp()
 
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisBoundedSeriesTest(helpers.BoundedSeriesHelper):
+
+  def setUp(self):
+    self.client = redis.Redis('localhost')
+    super(RedisBoundedSeriesTest,self).setUp()
+
 @unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
 class RedisHistogramTest(helpers.HistogramHelper):
 
@@ -42,6 +91,13 @@ class RedisHistogramTest(helpers.HistogramHelper):
     self.client = redis.Redis('localhost')
     super(RedisHistogramTest,self).setUp()
 
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisCappedHistogramTest(helpers.CappedHistogramHelper):
+
+  def setUp(self):
+    self.client = redis.Redis('localhost')
+    super(RedisCappedHistogramTest,self).setUp()
+
 @unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
 class RedisCountTest(helpers.CountHelper):
 
@@ -62,3 +118,212 @@ class RedisSetTest(helpers.SetHelper):
   def setUp(self):
     self.client = redis.Redis('localhost')
     super(RedisSetTest,self).setUp()
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisCappedSetTest(Chai):
+
+  def setUp(self):
+    super(RedisCappedSetTest,self).setUp()
+    self.client = redis.Redis('localhost')
+    self.series = Timeseries(self.client, type='set', prefix='kairos',
+      read_func=int, intervals={
+        'minute' : {
+          'step' : 60,
+          'steps' : 5,
+          'max_cardinality' : 3,
+        }
+      } )
+    self.series.delete_all()
+
+  def tearDown(self):
+    self.series.delete_all()
+
+  def test_new_values_overflow(self):
+    self.series.bulk_insert( {_time(0):{'test':[1, 2, 3, 4, 5, 4]}} )
+    self.series.insert( 'test', 1, timestamp=_time(1) )
+    self.series.insert( 'test', 6, timestamp=_time(1) )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0) )
+    assert_equals( set([1, 2, 3]), interval[_time(0)] )
+    assert_equals( 3, self.series.overflowed )
+    assert_equals( [], self.client.keys('kairos:test:minute:*:overflow') )
+
+    self.series.delete( 'test' )
+    assert_equals( [], self.client.keys('kairos:*') )
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisSetStatsTest(Chai):
+
+  def setUp(self):
+    super(RedisSetStatsTest,self).setUp()
+    self.client = redis.Redis('localhost')
+    self.series = Timeseries(self.client, type='set', prefix='kairos',
+      read_func=str, intervals={
+        'minute' : {
+          'step' : 60,
+          'steps' : 5,
+        },
+        'hour' : {
+          'step' : 3600,
+          'resolution' : 60,
+        }
+      } )
+    self.series.delete_all()
+    self.series.insert( 'test', 'a', timestamp=_time(0) )
+    self.series.insert( 'test', 'a', timestamp=_time(60) )
+    self.series.insert( 'test', 'b', timestamp=_time(60) )
+
+  def tearDown(self):
+    self.series.delete_all()
+
+  def test_collapsed_coarse_count(self):
+    count = self.series.series( 'test', 'minute', start=_time(0), steps=2,
+      collapse=True, transform='count' )
+    assert_equals( {_time(0):2}, count )
+
+    rate = self.series.series( 'test', 'minute', start=_time(0), steps=2,
+      collapse=True, transform='rate' )
+    values = self.series.series( 'test', 'minute', start=_time(0), steps=2,
+      collapse=True, transform=len )
+    assert_equals( {_time(0):2}, values )
+    assert_equals( 2, rate[_time(0)]*120 )
+
+  def test_condensed_count(self):
+    count = self.series.get( 'test', 'hour', timestamp=_time(0),
+      condensed=True, transform='count' )
+    assert_equals( {_time(0):2}, count )
+
+    count = self.series.series( 'test', 'hour', start=_time(0), steps=1,
+      condensed=True, transform='count' )
+    assert_equals( {_time(0):2}, count )
+
+class ScriptedInsertMixin(object):
+  '''
+  Run a helper with the same configuration but inserting with lua scripts.
+  '''
+
+  def setUp(self):
+    super(ScriptedInsertMixin,self).setUp()
+    self.series = type(self.series)(self.client, prefix='kairos',
+      lua_insert=True, read_func=self.series._read_func,
+      write_func=self.series._write_func, intervals=self.series._intervals)
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisScriptedSeriesTest(ScriptedInsertMixin, RedisSeriesTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisScriptedHistogramTest(ScriptedInsertMixin, RedisHistogramTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisScriptedCountTest(ScriptedInsertMixin, RedisCountTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisScriptedGaugeTest(ScriptedInsertMixin, RedisGaugeTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisScriptedSetTest(ScriptedInsertMixin, RedisSetTest):
+  pass
+
+class PackedMixin(object):
+  '''
+  Run a helper with the same configuration but with packed storage.
+  '''
+
+  packed = True
+
+  def setUp(self):
+    super(PackedMixin,self).setUp()
+    self.series = type(self.series)(self.client, prefix='kairos',
+      packed=self.packed, read_func=self.series._read_func,
+      intervals=self.series._intervals)
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisPackedCountTest(PackedMixin, RedisCountTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisPackedSeriesTest(PackedMixin, RedisSeriesTest):
+  packed = 'q'
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisOrderedSeriesTest(Chai):
+
+  def setUp(self):
+    super(RedisOrderedSeriesTest,self).setUp()
+    self.client = redis.Redis('localhost')
+    self.series = Timeseries(self.client, type='series', prefix='kairos',
+      ordered=True, read_func=int,
+      intervals={
+        'minute' : {
+          'step' : 60,
+          'steps' : 5,
+        },
+        'hour' : {
+          'step' : 3600,
+          'resolution' : 60,
+        }
+      } )
+    self.series.delete_all()
+
+  def tearDown(self):
+    self.series.delete_all()
+
+  def test_bulk_insert_in_timestamp_order(self):
+    inserts = OrderedDict( (
+      (_time(0) , { 'test1':[1,2,3] } ),
+      (_time(30), { 'test1':[4,5,6] } ),
+      (_time(60), { 'test1':[7,8,9] } )
+    ) )
+    self.series.bulk_insert( inserts, intervals=-3 )
+
+    t1_i1 = self.series.get('test1', 'minute', timestamp=_time(0))
+    assert_equals( [1,2,3,7,8,9,4,5,6], t1_i1[_time(0)] )
+
+  def test_get_range(self):
+    for t in xrange(0, 60, 5):
+      self.series.insert( 'test', t, timestamp=_time(t) )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0),
+      start=_time(20), end=_time(35) )
+    assert_equals( [20, 25, 30, 35], interval[_time(0)] )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0),
+      start=_time(50), transform='count' )
+    assert_equals( 2, interval[_time(0)] )
+
+  def test_series_exact_range(self):
+    for t in xrange(0, 180, 5):
+      self.series.insert( 'test', t, timestamp=_time(t) )
+
+    interval = self.series.series( 'test', 'minute', start=_time(50),
+      end=_time(125), exact=True )
+    assert_equals( [50, 55], interval[_time(0)] )
+    assert_equals( range(60, 120, 5), interval[_time(60)] )
+    assert_equals( [120, 125], interval[_time(120)] )
+
+    interval = self.series.series( 'test', 'hour', start=_time(50),
+      end=_time(125), exact=True, collapse=True, transform=['count','max'] )
+    assert_equals( {'count':16, 'max':125}, interval[_time(0)] )
+
+class HashBucketsMixin(object):
+  '''
+  Run a helper with the same configuration but with coarse buckets in hashes.
+  '''
+
+  def setUp(self):
+    super(HashBucketsMixin,self).setUp()
+    self.series = type(self.series)(self.client, prefix='kairos',
+      hash_buckets=4, read_func=self.series._read_func,
+      write_func=self.series._write_func, intervals=self.series._intervals)
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisHashBucketsCountTest(HashBucketsMixin, RedisCountTest):
+  pass
+
+@unittest.skipUnless( os.environ.get('TEST_REDIS','true').lower()=='true', 'skipping redis' )
+class RedisHashBucketsGaugeTest(HashBucketsMixin, RedisGaugeTest):
+  pass
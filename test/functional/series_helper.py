@@ -47,6 +47,38 @@ class SeriesHelper(Chai):
     t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
     assert_equals( [1,2,3], t1_i2[_time(60)] )
 
+  def test_bulk_insert_arrays(self):
+    names = ['test1']*3 + ['test2']*3 + ['test3']*3 + \
+      ['test1']*3 + ['test2']*3 + ['test1']*3 + ['test3']*3
+    timestamps = [_time(0)]*9 + [_time(30)]*6 + [_time(60)]*6
+    values = [1,2,3,4,5,6,7,8,9, 1,2,3,4,5,6, 1,2,3,7,8,9]
+    self.series.bulk_insert_arrays( names, timestamps, values )
+
+    t1_i1 = self.series.get('test1', 'minute', timestamp=_time(0))
+    assert_equals( [1,2,3,1,2,3], t1_i1[_time(0)] )
+
+    t2_i1 = self.series.get('test2', 'minute', timestamp=_time(0))
+    assert_equals( [4,5,6,4,5,6], t2_i1[_time(0)] )
+
+    t3_i1 = self.series.get('test3', 'minute', timestamp=_time(0))
+    assert_equals( [7,8,9], t3_i1[_time(0)] )
+
+    t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
+    assert_equals( [1,2,3], t1_i2[_time(60)] )
+
+    t1_h1 = self.series.get('test1', 'hour', timestamp=_time(0))
+    assert_equals( { _time(0):[1,2,3,1,2,3], _time(60):[1,2,3] }, t1_h1 )
+
+  def test_bulk_insert_arrays_intervals_after(self):
+    timestamps = [_time(0)]*3 + [_time(30)]*3 + [_time(60)]*3
+    self.series.bulk_insert_arrays( 'test1', timestamps, [1,2,3]*3, intervals=2 )
+
+    t1_i3 = self.series.get('test1', 'minute', timestamp=_time(120))
+    assert_equals( [1,2,3,1,2,3,1,2,3], t1_i3[_time(120)] )
+
+    t1_i4 = self.series.get('test1', 'minute', timestamp=_time(180))
+    assert_equals( [1,2,3], t1_i4[_time(180)] )
+
   def test_bulk_insert_intervals_after(self):
     a,b,c,d,e,f = 10,11,12,13,14,15
     inserts = OrderedDict( (
@@ -417,3 +449,58 @@ class SeriesHelper(Chai):
     interval = self.series.series( ['test1','test2'], 'hour', condensed=True, end=_time(4200), steps=2, collapse=True, transform=['min','max','count'] )
     assert_equals( map(_time, [0]), interval.keys() )
     assert_equals( {'min':1,'max':3839,'count':718}, interval[_time(0)] )
+
+@unittest.skipUnless( os.environ.get('TEST_SERIES','true').lower()=='true', 'skipping series' )
+class BoundedSeriesHelper(Chai):
+
+  def setUp(self):
+    super(BoundedSeriesHelper,self).setUp()
+
+    self.series = Timeseries(self.client, type='series', prefix='kairos',
+      read_func=int,
+      intervals={
+        'minute' : {
+          'step' : 60,
+          'steps' : 5,
+          'max_values' : 3,
+        },
+        'hour' : {
+          'step' : 3600,
+          'resolution' : 60,
+          'max_values' : 2,
+        }
+      } )
+    self.series.delete_all()
+
+  def tearDown(self):
+    self.series.delete_all()
+
+  def test_newest_values_are_kept(self):
+    for t in xrange(1, 6):
+      self.series.insert( 'test', t, timestamp=_time(t) )
+    self.series.bulk_insert( {_time(10):{'test':[10,11]}} )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0) )
+    assert_equals( [5, 10, 11], interval[_time(0)] )
+    assert_equals( 7, interval[_time(0)].total )
+
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0) )
+    assert_equals( [10, 11], interval[_time(0)] )
+    assert_equals( 7, interval[_time(0)].total )
+
+  def test_transforms_use_total(self):
+    for t in xrange(1, 6):
+      self.series.insert( 'test', t, timestamp=_time(t) )
+    self.series.insert( 'test', 100, timestamp=_time(60) )
+
+    interval = self.series.get( 'test', 'minute', timestamp=_time(0),
+      transform=['count','max'] )
+    assert_equals( {'count':5, 'max':5}, interval[_time(0)] )
+
+    interval = self.series.get( 'test', 'hour', timestamp=_time(0),
+      condense=True, transform='count' )
+    assert_equals( 6, interval[_time(0)] )
+
+    interval = self.series.series( 'test', 'minute', end=_time(60),
+      collapse=True, transform=['count','min'] )
+    assert_equals( {'count':6, 'min':3}, interval.values()[0] )
@@ -45,6 +45,38 @@ class SetHelper(Chai):
     t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
     assert_equals( {1,2,3}, t1_i2[_time(60)] )
 
+  def test_bulk_insert_arrays(self):
+    names = ['test1']*3 + ['test2']*3 + ['test3']*3 + \
+      ['test1']*3 + ['test2']*3 + ['test1']*3 + ['test3']*3
+    timestamps = [_time(0)]*9 + [_time(30)]*6 + [_time(60)]*6
+    values = [1,2,3,4,5,6,7,8,9, 1,2,3,4,5,6, 1,2,3,7,8,9]
+    self.series.bulk_insert_arrays( names, timestamps, values )
+
+    t1_i1 = self.series.get('test1', 'minute', timestamp=_time(0))
+    assert_equals( {1,2,3}, t1_i1[_time(0)] )
+
+    t2_i1 = self.series.get('test2', 'minute', timestamp=_time(0))
+    assert_equals( {4,5,6}, t2_i1[_time(0)] )
+
+    t3_i1 = self.series.get('test3', 'minute', timestamp=_time(0))
+    assert_equals( {7,8,9}, t3_i1[_time(0)] )
+
+    t1_i2 = self.series.get('test1', 'minute', timestamp=_time(60))
+    assert_equals( {1,2,3}, t1_i2[_time(60)] )
+
+    t1_h1 = self.series.get('test1', 'hour', timestamp=_time(0))
+    assert_equals( { _time(0):{1,2,3}, _time(60):{1,2,3} }, t1_h1 )
+
+  def test_bulk_insert_arrays_intervals_after(self):
+    timestamps = [_time(0)]*3 + [_time(30)]*3 + [_time(60)]*3
+    self.series.bulk_insert_arrays( 'test1', timestamps, [1,2,3]*3, intervals=2 )
+
+    t1_i3 = self.series.get('test1', 'minute', timestamp=_time(120))
+    assert_equals( {1,2,3}, t1_i3[_time(120)] )
+
+    t1_i4 = self.series.get('test1', 'minute', timestamp=_time(180))
+    assert_equals( {1,2,3}, t1_i4[_time(180)] )
+
   def test_bulk_insert_intervals_after(self):
     a,b,c,d,e,f = 10,11,12,13,14,15
     inserts = OrderedDict( (
@@ -57,6 +57,13 @@ class SqlSeriesTest(helpers.SeriesHelper):
     self.client = create_engine(SQL_HOST, echo=False)
     super(SqlSeriesTest,self).setUp()
 
+@unittest.skipUnless( os.environ.get('TEST_SQL','true').lower()=='true', 'skipping sql' )
+class SqlBoundedSeriesTest(helpers.BoundedSeriesHelper):
+
+  def setUp(self):
+    self.client = create_engine(SQL_HOST, echo=False)
+    super(SqlBoundedSeriesTest,self).setUp()
+
 @unittest.skipUnless( os.environ.get('TEST_SQL','true').lower()=='true', 'skipping sql' )
 class SqlHistogramTest(helpers.HistogramHelper):
 
@@ -0,0 +1,256 @@
+'''
+Unit tests for buffered timeseries
+'''
+from chai import Chai
+import threading
+
+from kairos.buffered import *
+from kairos.timeseries import *
+
+INTERVALS = {
+  'minute' : { 'step' : 60 },
+  'hour' : { 'step' : 3600, 'resolution' : 600 },
+}
+
+class BufferedTimeseriesTest(Chai):
+
+  def test_count_sums(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_interval=None)
+    buffered.insert('test', timestamp=60)
+    buffered.insert('test', 3, timestamp=61)
+    buffered.insert('test', 5, timestamp=120)
+    buffered.bulk_insert( {119:{'test':[2], 'other':[1]}} )
+    assert_equals( 3, len(buffered) )
+
+    expect( series._batch_insert ).args(
+      {60:{'test':6}, 120:{'test':5}, 119:{'other':1}}, 0, aggregated=True )
+    buffered.flush()
+    assert_equals( 0, len(buffered) )
+
+  def test_merge_by_type(self):
+    histogram = Histogram(mock(), intervals=INTERVALS)
+    assert_equals( {'a':2, 'b':1}, histogram._aggregate(['a','b'], {'a':1}) )
+    assert_equals( ['a','a'], histogram._expand({'a':2}) )
+
+    gauge = Gauge(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(gauge, flush_interval=None)
+    buffered.insert('test', 'a', timestamp=60)
+    buffered.insert('test', 'b', timestamp=62)
+    expect( gauge._batch_insert ).args( {60:{'test':'b'}}, 0, aggregated=True )
+    buffered.flush()
+
+    sets = Set(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(sets, flush_interval=None)
+    buffered.insert('test', ['a','b'], timestamp=60)
+    buffered.insert('test', 'a', timestamp=62)
+    expect( sets._batch_insert ).args( {60:{'test':set(['a','b'])}}, 0,
+      aggregated=True )
+    buffered.flush()
+
+  def test_series_concatenates(self):
+    series = Series(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_interval=None)
+    buffered.insert('test', 1, timestamp=60)
+    buffered.insert('test', 2, timestamp=119)
+    buffered.insert('test', 3, timestamp=600)
+    buffered.insert('test', 4, timestamp=60, intervals=1)
+    assert_equals( 3, len(buffered) )
+
+    expect( series._batch_insert ).args( {60:{'test':[1,2]}, 600:{'test':[3]}}, 0,
+      aggregated=True )
+    expect( series._batch_insert ).args( {60:{'test':[4]}}, 1, aggregated=True )
+    buffered.flush()
+
+  def test_flush_size(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_size=2, flush_interval=None)
+    buffered.insert('test', timestamp=60)
+    buffered.insert('test', timestamp=61)
+    expect( series._batch_insert ).args( {60:{'test':2}, 120:{'test':1}}, 0,
+      aggregated=True )
+    buffered.insert('test', timestamp=120)
+    assert_equals( 0, len(buffered) )
+
+  def test_flush_interval(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_interval=10)
+    buffered._last_flush = time.time() - 10
+    expect( series._batch_insert ).args( {60:{'test':1}}, 0, aggregated=True )
+    buffered.insert('test', timestamp=60)
+
+  def test_failed_flush_keeps_data(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_size=1, flush_interval=10)
+    expect( series._batch_insert ).raises( IOError )
+    with assert_raises( IOError ):
+      buffered.insert('test', timestamp=60)
+    assert_equals( 1, len(buffered) )
+
+    # automatic flushes wait for the flush interval
+    buffered.insert('test', timestamp=120)
+    assert_equals( 2, len(buffered) )
+
+    expect( series._batch_insert ).args( {60:{'test':1}, 120:{'test':1}}, 0,
+      aggregated=True )
+    buffered.flush()
+
+  def test_max_size_evicts(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, max_size=2, flush_interval=None)
+    buffered.insert('test', timestamp=60)
+    buffered.insert('test', timestamp=120)
+    buffered.insert('test', timestamp=180)
+    assert_equals( 2, len(buffered) )
+    assert_equals( 1, buffered.evicted )
+
+    expect( series._batch_insert ).args( {120:{'test':1}, 180:{'test':1}}, 0,
+      aggregated=True )
+    buffered.flush()
+
+  def test_histogram_is_not_expanded(self):
+    histogram = Histogram(mock(), intervals=INTERVALS)
+    assert_equals( {'a':3, 'b':1}, histogram._merge({'a':1}, {'a':2, 'b':1}) )
+    buffered = BufferedTimeseries(histogram, flush_interval=None)
+    buffered.insert('test', ['a']*1000+['b'], timestamp=60)
+    expect( histogram._batch_insert ).args( {60:{'test':{'a':1000, 'b':1}}}, 0,
+      aggregated=True )
+    buffered.flush()
+
+  def test_aggregated_data_is_expanded(self):
+    series = Count(mock(), intervals=INTERVALS)
+    expect( series._insert ).args( 'test', 6, 60, 0 )
+    series._batch_insert( {60:{'test':6}}, 0, aggregated=True )
+
+    # Stacked wrappers buffer the expanded values
+    histogram = Histogram(mock(), intervals=INTERVALS)
+    inner = BufferedTimeseries(histogram, flush_interval=None)
+    outer = BufferedTimeseries(inner, flush_interval=None)
+    outer.insert('test', ['a','a'], timestamp=60)
+    outer.flush()
+    assert_equals( 1, len(inner) )
+    expect( histogram._batch_insert ).args( {60:{'test':{'a':2}}}, 0, aggregated=True )
+    inner.flush()
+
+  def test_kwargs_are_written_through(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, flush_interval=None)
+    pipe = mock()
+    expect( series._batch_insert ).args( {60:{'test':[1]}}, 0, pipeline=pipe )
+    buffered.insert('test', timestamp=60, pipeline=pipe)
+    assert_equals( 0, len(buffered) )
+
+  def test_max_size_raises(self):
+    series = Count(mock(), intervals=INTERVALS)
+    buffered = BufferedTimeseries(series, max_size=1, overflow='raise',
+      flush_interval=None)
+    buffered.insert('test', timestamp=60)
+    buffered.insert('test', timestamp=61)
+    with assert_raises( BufferFull ):
+      buffered.insert('test', timestamp=120)
+
+class AsyncTimeseriesTest(Chai):
+
+  def setUp(self):
+    super(AsyncTimeseriesTest,self).setUp()
+    self.series = Count(mock(), intervals=INTERVALS)
+    self.writes = []
+    self.gate = threading.Event()
+    self.gate.set()
+    def batch_insert(inserts, intervals):
+      self.gate.wait()
+      self.writes.append( (inserts, intervals) )
+    self.series._batch_insert = batch_insert
+
+  def test_insert_is_written_by_writer(self):
+    queued = AsyncTimeseries(self.series)
+    queued.insert('test', timestamp=60)
+    queued.bulk_insert( {60:{'test':[2]}, 120:{'other':[1]}}, intervals=1 )
+    queued.close()
+
+    assert_equals( 0, queued.queue_depth )
+    inserts = {}
+    for write in self.writes:
+      for timestamp,names in write[0].items():
+        for name,values in names.items():
+          inserts.setdefault( (write[1],timestamp,name), [] ).extend( values )
+    assert_equals( {(0,60,'test'):[1], (1,60,'test'):[2], (1,120,'other'):[1]},
+      inserts )
+    assert_true( queued.flushes>=2 )
+    with assert_raises( ValueError ):
+      queued.insert('test')
+
+  def test_write_errors_are_counted(self):
+    def batch_insert(inserts, intervals):
+      raise IOError('down')
+    self.series._batch_insert = batch_insert
+    queued = AsyncTimeseries(self.series)
+    queued.insert('test', timestamp=60)
+    queued.flush()
+    assert_equals( 1, queued.errors )
+    assert_true( isinstance(queued.last_error, IOError) )
+    queued.close()
+
+  def test_drop_newest(self):
+    self.gate.clear()
+    queued = AsyncTimeseries(self.series, max_size=1, batch_size=1,
+      full='drop_newest')
+    queued.insert('test', 1, timestamp=60)
+    while queued.queue_depth: time.sleep(0.001)
+    queued.insert('test', 2, timestamp=60)
+    queued.insert('test', [3,4], timestamp=60)
+    assert_equals( 2, queued.dropped )
+    self.gate.set()
+    queued.close()
+    assert_equals( [1,2], [ w[0][60]['test'][0] for w in self.writes ] )
+
+  def test_drop_oldest(self):
+    self.gate.clear()
+    queued = AsyncTimeseries(self.series, max_size=1, batch_size=1,
+      full='drop_oldest')
+    queued.insert('test', 1, timestamp=60)
+    while queued.queue_depth: time.sleep(0.001)
+    queued.insert('test', 2, timestamp=60)
+    queued.insert('test', 3, timestamp=60)
+    assert_equals( 1, queued.dropped )
+    self.gate.set()
+    queued.close()
+    assert_equals( [1,3], [ w[0][60]['test'][0] for w in self.writes ] )
+
+  def test_blocked_insert_raises_after_close(self):
+    self.gate.clear()
+    queued = AsyncTimeseries(self.series, max_size=1, batch_size=1)
+    queued.insert('test', 1, timestamp=60)
+    while queued.queue_depth: time.sleep(0.001)
+    queued.insert('test', 2, timestamp=60)
+
+    errors = []
+    def produce():
+      try:
+        queued.insert('test', 3, timestamp=60)
+      except ValueError as e:
+        errors.append( e )
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.01)
+    closer = threading.Thread(target=queued.close)
+    closer.start()
+    while not queued._closed: time.sleep(0.001)
+    self.gate.set()
+    closer.join()
+    producer.join()
+
+    assert_equals( 1, len(errors) )
+    assert_equals( [1,2], [ w[0][60]['test'][0] for w in self.writes ] )
+
+  def test_writer_survives_errors(self):
+    queued = AsyncTimeseries(self.series)
+    def write(batch):
+      raise TypeError('bad batch')
+    queued._write = write
+    queued.insert('test', timestamp=60)
+    queued.flush()
+    assert_equals( 1, queued.errors )
+    assert_true( isinstance(queued.last_error, TypeError) )
+    assert_true( queued._writer.is_alive() )
+    queued.close()
@@ -0,0 +1,578 @@
+'''
+Unit tests for redis timeseries
+'''
+from chai import Chai
+
+from kairos.redis_backend import *
+from kairos.redis_backend import _unpack
+import redis
+
+class RedisBatchInsertTest(Chai):
+
+  def setUp(self):
+    super(RedisBatchInsertTest,self).setUp()
+    self.client = mock()
+    self.pipe = mock()
+    expect( self.client.pipeline ).args( transaction=False ).returns( self.pipe )
+    self.intervals = {
+      'minute' : { 'step' : 60 },
+      'hour' : { 'step' : 3600, 'resolution' : 60 },
+    }
+
+  def expect_index(self, *buckets):
+    for interval,bucket in buckets:
+      expect( self.pipe.sadd ).args( 'kairos:_names', 'test' ).any_order()
+      expect( self.pipe.zadd ).args( 'kairos:test:%s:buckets'%(interval),
+        bucket, bucket ).any_order()
+
+  def test_count_sums_increments(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals)
+    self.expect_index( ('minute',1), ('hour',0) )
+    expect( self.pipe.incr ).args( 'kairos:test:minute:1', 6 ).any_order()
+    expect( self.pipe.sadd ).args( 'kairos:test:hour:0', 1 ).any_order()
+    expect( self.pipe.incr ).args( 'kairos:test:hour:0:1', 6 ).any_order()
+    expect( self.pipe.execute )
+
+    series.bulk_insert( {60:{'test':[1,2]}, 90:{'test':[3]}} )
+
+  def test_histogram_folds_values(self):
+    series = RedisHistogram(self.client, prefix='kairos', intervals=self.intervals)
+    self.expect_index( ('minute',1), ('hour',0) )
+    expect( self.pipe.hincrby ).args( 'kairos:test:minute:1', 'a', 3 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:minute:1', 'b', 1 ).any_order()
+    expect( self.pipe.sadd ).args( 'kairos:test:hour:0', 1 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:hour:0:1', 'a', 3 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:hour:0:1', 'b', 1 ).any_order()
+    expect( self.pipe.execute )
+
+    series.bulk_insert( {60:{'test':['a','b','a']}, 90:{'test':['a']}} )
+
+  def test_histogram_aggregates_are_merged(self):
+    series = RedisHistogram(self.client, prefix='kairos', intervals=self.intervals)
+    self.expect_index( ('minute',1), ('hour',0) )
+    expect( self.pipe.hincrby ).args( 'kairos:test:minute:1', 'a', 4 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:minute:1', 'b', 1 ).any_order()
+    expect( self.pipe.sadd ).args( 'kairos:test:hour:0', 1 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:hour:0:1', 'a', 4 ).any_order()
+    expect( self.pipe.hincrby ).args( 'kairos:test:hour:0:1', 'b', 1 ).any_order()
+    expect( self.pipe.execute )
+
+    aggregates = {'a':3, 'b':1}
+    series._batch_insert( OrderedDict([(60,{'test':aggregates}), (90,{'test':{'a':1}})]),
+      0, aggregated=True )
+    assert_equals( {'a':3, 'b':1}, aggregates )
+
+  def test_gauge_sets_last_value(self):
+    series = RedisGauge(self.client, prefix='kairos', intervals=self.intervals)
+    self.expect_index( ('minute',1), ('hour',0) )
+    expect( self.pipe.set ).args( 'kairos:test:minute:1', 'c' ).any_order()
+    expect( self.pipe.sadd ).args( 'kairos:test:hour:0', 1 ).any_order()
+    expect( self.pipe.set ).args( 'kairos:test:hour:0:1', 'c' ).any_order()
+    expect( self.pipe.execute )
+
+    series.bulk_insert( OrderedDict([(60,{'test':['a','b']}), (90,{'test':['c']})]) )
+
+  def test_ttls_are_batched(self):
+    series = RedisCount(self.client, prefix='kairos',
+      intervals={ 'minute' : { 'step' : 60, 'steps' : 5 } })
+    now = time.time()
+    key = 'kairos:test:minute:%d'%(now/60)
+    self.expect_index( ('minute',int(now/60)) )
+    expect( self.pipe.incr ).args( key, 6 )
+    expect( self.pipe.expire ).args( key, 300 ).times(1)
+    expect( self.pipe.execute )
+
+    series.bulk_insert( {now:{'test':[1,2]}, now-0.001:{'test':[3]}} )
+
+class RecordingPipeline(object):
+  '''
+  Pipeline which records the commands that are called on it.
+  '''
+
+  def __init__(self):
+    self.commands = []
+
+  def __getattr__(self, command):
+    return lambda *args: self.commands.append( (command,)+args )
+
+  def expires(self):
+    return [ c[1:] for c in self.commands if c[0]=='expire' ]
+
+class RedisExpireCacheTest(Chai):
+
+  def setUp(self):
+    super(RedisExpireCacheTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60, 'steps' : 5, 'resolution' : 10 } }
+    self.now = time.time()
+    self.i_key = 'kairos:test:minute:%d'%(self.now/60)
+    self.r_key = '%s:%d'%(self.i_key, self.now/10)
+
+  def test_expire_is_skipped_once_applied(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals)
+    series.insert( 'test', timestamp=self.now )
+    series.insert( 'test', timestamp=self.now )
+    assert_equals( [(self.i_key,300), (self.r_key,300)], self.pipe.expires() )
+
+  def test_gauge_expire_is_not_cached(self):
+    series = RedisGauge(self.client, prefix='kairos', intervals=self.intervals)
+    series.insert( 'test', 'a', timestamp=self.now )
+    series.insert( 'test', 'b', timestamp=self.now )
+    assert_equals( 4, len(self.pipe.expires()) )
+
+  def test_expire_is_reapplied_when_ttl_changes(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals)
+    series._expire_cache[self.i_key] = (360, self.now+360)
+    series._expire_cache[self.r_key] = (300, self.now-1)
+    series.insert( 'test', timestamp=self.now )
+    assert_equals( [(self.i_key,300), (self.r_key,300)], self.pipe.expires() )
+
+  def test_index_is_reapplied_when_bucket_expires(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals)
+    entry = ('kairos:test:minute:buckets', int(self.now/60))
+    series.insert( 'test', timestamp=self.now )
+    series.insert( 'test', timestamp=self.now )
+    assert_equals( 1, len([ c for c in self.pipe.commands if c[0]=='zadd' ]) )
+    assert_true( self.now+299 < series._index_cache[entry] <= time.time()+300 )
+
+    series._index_cache[entry] = self.now-1
+    series.insert( 'test', timestamp=self.now )
+    assert_equals( 2, len([ c for c in self.pipe.commands if c[0]=='zadd' ]) )
+
+  def test_cache_is_bounded(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals,
+      expire_cache_size=1)
+    series.insert( 'test', timestamp=self.now )
+    series.insert( 'test', timestamp=self.now )
+    assert_equals( 4, len(self.pipe.expires()) )
+    assert_equals( [self.r_key], series._expire_cache.keys() )
+
+  def test_cache_is_cleared_on_failure(self):
+    series = RedisCount(self.client, prefix='kairos', intervals=self.intervals)
+    def execute():
+      raise IOError('down')
+    self.pipe.execute = execute
+
+    with assert_raises( IOError ):
+      series.insert( 'test', timestamp=self.now )
+    assert_equals( {}, series._expire_cache )
+
+class RedisSeriesReadTest(Chai):
+
+  def test_resolutions_fetched_in_one_pipeline(self):
+    client = mock()
+    pipe = mock()
+    series = RedisCount(client, prefix='kairos', intervals={
+      'hour' : { 'step' : 3600, 'resolution' : 60 } })
+
+    expect( client.pipeline ).args( transaction=False ).returns( pipe ).times(2)
+    expect( pipe.smembers ).args( 'kairos:test:hour:0' ).any_order()
+    expect( pipe.smembers ).args( 'kairos:test:hour:1' ).any_order()
+    expect( pipe.execute ).returns( [set(['1','0']), set(['61'])] )
+    expect( pipe.get ).args( 'kairos:test:hour:0:0' ).any_order()
+    expect( pipe.get ).args( 'kairos:test:hour:0:1' ).any_order()
+    expect( pipe.get ).args( 'kairos:test:hour:1:61' ).any_order()
+    expect( pipe.execute ).returns( ['3', '4', '5'] )
+
+    res = series._series('test', 'hour', series._intervals['hour'], [0,1])
+    assert_equals( OrderedDict([
+      (0, OrderedDict([(0,3), (60,4)])),
+      (3600, OrderedDict([(3660,5)])) ]), res )
+
+class RedisPipelineSizeTest(Chai):
+
+  def test_pipeline_is_flushed(self):
+    client = mock()
+    pipe = redis.Redis().pipeline(transaction=False)
+    executed = []
+    def execute():
+      executed.append( [ c[0] for c in pipe.command_stack ] )
+      pipe.reset()
+    pipe.execute = execute
+    flushes = []
+    expect( client.pipeline ).args( transaction=False ).returns( pipe )
+    series = RedisGauge(client, prefix='kairos', pipeline_size=3,
+      flush_func=lambda commands,latency: flushes.append(commands),
+      intervals={ 'minute' : { 'step' : 60, 'steps' : 5 } })
+
+    now = time.time()
+    series.bulk_insert( OrderedDict([(now,{'a':[1], 'b':[1]}), (now-60,{'a':[2]})]) )
+    assert_true( len(executed)>1 )
+    assert_equals( map(len,executed), flushes )
+
+    # Every key that is written has its TTL set in the same execution
+    for commands in executed:
+      written = set( c[1] for c in commands if c[0]=='SET' )
+      expired = set( c[1] for c in commands if c[0]=='EXPIRE' )
+      assert_equals( written, expired )
+
+class RedisClusterTest(Chai):
+
+  def test_keys_are_hash_tagged(self):
+    series = RedisCount(mock(), prefix='kairos', cluster=True, intervals={
+      'hour' : { 'step' : 3600, 'resolution' : 60 } })
+    config = series._intervals['hour']
+    assert_equals( ('kairos:{test}:hour:1', 'kairos:{test}:hour:1:61'),
+      series._bucket_keys(config, 'test', 1, 61) )
+    assert_equals( 'kairos:{test}:hour:buckets', series._index_key('test', 'hour') )
+
+  def test_lua_insert_not_supported(self):
+    with assert_raises( ValueError ):
+      RedisCount(mock(), cluster=True, lua_insert=True,
+        intervals={ 'hour' : { 'step' : 3600 } })
+
+  def test_names_fetched_in_one_pipeline(self):
+    client = mock()
+    pipe = mock()
+    series = RedisCount(client, prefix='kairos', cluster=True, intervals={
+      'hour' : { 'step' : 3600 } })
+
+    expect( client.pipeline ).args( transaction=False ).returns( pipe )
+    expect( pipe.get ).args( 'kairos:{a}:hour:0' ).any_order()
+    expect( pipe.get ).args( 'kairos:{b}:hour:0' ).any_order()
+    expect( pipe.execute ).returns( ['3', '4'] )
+
+    assert_equals( {0:7}, series.get(['a','b'], 'hour', timestamp=0) )
+
+class RedisTransformPushdownTest(Chai):
+
+  def setUp(self):
+    super(RedisTransformPushdownTest,self).setUp()
+    self.client = mock()
+    self.pipe = mock()
+    self.intervals = { 'minute' : { 'step' : 60 } }
+
+  def test_set_count_uses_scard(self):
+    series = RedisSet(self.client, prefix='kairos', intervals=self.intervals)
+    expect( self.client.pipeline ).args( transaction=False ).returns( self.pipe )
+    expect( self.pipe.scard ).args( 'kairos:test:minute:1' )
+    expect( self.pipe.execute ).returns( [3] )
+    assert_equals( {60:3}, series.get('test', 'minute', timestamp=60, transform='count') )
+
+  def test_series_count_is_joined(self):
+    series = RedisSeries(self.client, prefix='kairos', intervals=self.intervals)
+    expect( self.client.pipeline ).args( transaction=False ).returns( self.pipe )
+    expect( self.pipe.llen ).args( 'kairos:a:minute:1' )
+    expect( self.pipe.llen ).args( 'kairos:b:minute:1' )
+    expect( self.pipe.execute ).returns( [3, 4] )
+    assert_equals( {60:{'count':7, 'rate':7/60.}},
+      series.get(['a','b'], 'minute', timestamp=60, transform=['count','rate']) )
+
+  def test_set_union_is_not_pushed_down(self):
+    series = RedisSet(self.client, prefix='kairos', intervals=self.intervals)
+    expect( self.client.pipeline ).args( transaction=False ).returns( self.pipe )
+    expect( self.pipe.smembers ).args( 'kairos:a:minute:1' )
+    expect( self.pipe.smembers ).args( 'kairos:b:minute:1' )
+    expect( self.pipe.execute ).returns( [set(['x']), set(['x','y'])] )
+    assert_equals( {60:2},
+      series.get(['a','b'], 'minute', timestamp=60, transform='count') )
+
+  def test_histogram_values_need_numeric_read_func(self):
+    series = RedisHistogram(self.client, intervals=self.intervals)
+    kwargs = { 'transform' : 'mean' }
+    assert_true( series._stats_kwargs('test', 'minute', kwargs, False) is kwargs )
+    series._read_func = float
+    assert_equals( series._stats_get,
+      series._stats_kwargs('test', 'minute', kwargs, False)['fetch'] )
+
+  def test_empty_intervals_are_merged(self):
+    series = RedisSeries(self.client, intervals=self.intervals)
+    stats = series._condense( OrderedDict([ (0, []), (60, BucketStats(3)) ]) )
+    assert_equals( 3, series._transform(stats, 'count', 60) )
+
+  def test_histogram_stats(self):
+    series = RedisHistogram(self.client, read_func=int, intervals=self.intervals)
+    stats = series._condense( OrderedDict([
+      (0, series._stats_row(['3', '6', '1', '3'])),
+      (10, series._stats_row(['1', '2.5', '2.5', '2.5'])),
+      (20, series._stats_row(['0', '0', None, None])) ]) )
+    assert_equals( 4, series._transform(stats, 'count', 60) )
+    assert_equals( 8.5, series._transform(stats, 'sum', 60) )
+    assert_equals( 1, series._transform(stats, 'min', 60) )
+    assert_equals( 3, series._transform(stats, 'max', 60) )
+    assert_equals( 2.125, series._transform(stats, 'mean', 60) )
+    assert_equals( 0, series._transform(BucketStats(), 'max', 60) )
+
+class RedisPackedCountTest(Chai):
+
+  def setUp(self):
+    super(RedisPackedCountTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60, 'resolution' : 10 } }
+
+  def test_insert_increments_slot(self):
+    series = RedisCount(self.client, prefix='kairos', packed='u16',
+      intervals=self.intervals)
+    series.bulk_insert( {70:{'test':[1,2]}, 115:{'test':[3]}} )
+    assert_equals( [
+      ('execute_command', 'BITFIELD', 'kairos:test:minute:1', 'OVERFLOW', 'SAT',
+        'INCRBY', 'u16', '#1', 3),
+      ('execute_command', 'BITFIELD', 'kairos:test:minute:1', 'OVERFLOW', 'SAT',
+        'INCRBY', 'u16', '#5', 3) ],
+      sorted( c for c in self.pipe.commands if c[0]=='execute_command' ) )
+    assert_false( [ c for c in self.pipe.commands if c[0] in ('sadd','incr')
+      and c[1]!='kairos:_names' ] )
+
+  def test_floats_are_not_supported(self):
+    series = RedisCount(self.client, packed=True, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      series.insert( 'test', 1.5, timestamp=60 )
+
+  def test_invalid_configuration(self):
+    with assert_raises( ValueError ):
+      RedisCount(self.client, packed='u64', intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisCount(self.client, packed=True, lua_insert=True, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisCount(self.client, packed=True, intervals={
+        'month' : { 'step' : 'monthly', 'resolution' : 'daily' } })
+
+  def test_unpack(self):
+    data = struct.pack( '>hhh', 3, -1, 0 )
+    assert_equals( [3, -1, 0], list(_unpack(data, 'i16')) )
+    assert_equals( [3, 65535, 0], list(_unpack(data, 'u16')) )
+    # 12 bit fields of 1, -2 and 2047
+    data = '\x00\x1f\xfe\x7f\xf0'
+    assert_equals( [1, -2, 2047], _unpack(data, 'i12') )
+    assert_equals( [1, 4094, 2047], _unpack(data, 'u12') )
+    assert_equals( [], _unpack(None, 'i64') )
+
+  def test_read_decodes_interval(self):
+    series = RedisCount(self.client, prefix='kairos', packed='i32',
+      intervals=self.intervals)
+    self.pipe.execute = lambda: [ struct.pack('>iii', 0, 0, 7) ]
+    assert_equals( {60:OrderedDict([(80,7)])},
+      series.series('test', 'minute', start=60, steps=1) )
+
+  def test_custom_fetch_is_called_for_interval(self):
+    series = RedisCount(self.client, prefix='kairos', packed='i32',
+      intervals=self.intervals)
+    self.pipe.execute = lambda: [ struct.pack('>ii', 0, 7) ]
+    fetch = lambda handle, key: handle.getrange(key, 0, 7)
+    assert_equals( {60:OrderedDict([(70,7)])},
+      series.series('test', 'minute', start=60, steps=1, fetch=fetch) )
+    assert_equals( [('getrange', 'kairos:test:minute:1', 0, 7)], self.pipe.commands )
+
+class RedisHashBucketsTest(Chai):
+
+  def setUp(self):
+    super(RedisHashBucketsTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60, 'steps' : 5 } }
+
+  def test_values_are_written_to_hashes(self):
+    series = RedisCount(self.client, prefix='kairos', hash_buckets=10,
+      intervals=self.intervals)
+    now = time.time()
+    hash_key = series._hash_key( series._intervals['minute'], 'test', int(now/60) )
+    assert_true( hash_key.startswith('kairos:_hash:minute:%d:'%(now/60)) )
+
+    series.bulk_insert( {now:{'test':[1,2]}} )
+    assert_true( ('hincrby', hash_key, 'test', 3) in self.pipe.commands )
+    assert_equals( [(hash_key, 300)], self.pipe.expires() )
+
+  def test_names_are_read_with_hmget(self):
+    series = RedisGauge(self.client, prefix='kairos', hash_buckets=1,
+      intervals=self.intervals)
+    self.pipe.execute = lambda: [ ['a', None], ['b', 'c'] ]
+    res = series.series( ['x','y'], 'minute', start=0, steps=2 )
+    assert_equals( [
+      ('hmget', 'kairos:_hash:minute:0:0', ['x','y']),
+      ('hmget', 'kairos:_hash:minute:1:0', ['x','y']) ], self.pipe.commands )
+    assert_equals( OrderedDict([(0,'a'), (60,'c')]), res )
+
+  def test_custom_fetch_is_called_for_each_name(self):
+    series = RedisCount(self.client, prefix='kairos', hash_buckets=1,
+      intervals=self.intervals)
+    self.pipe.execute = lambda: [ 1, 2 ]
+    fetch = lambda handle, key, field: handle.hstrlen(key, field)
+    res = series.get( ['x','y'], 'minute', timestamp=0, fetch=fetch )
+    assert_equals( [
+      ('hstrlen', 'kairos:_hash:minute:0:0', 'x'),
+      ('hstrlen', 'kairos:_hash:minute:0:0', 'y') ], self.pipe.commands )
+    assert_equals( {0:3}, res )
+
+  def test_gauge_hash_expire_is_cached(self):
+    series = RedisGauge(self.client, prefix='kairos', hash_buckets=4,
+      intervals=self.intervals)
+    now = time.time()
+    series.insert( 'test', 'a', timestamp=now )
+    series.insert( 'test', 'b', timestamp=now )
+    assert_equals( 1, len(self.pipe.expires()) )
+
+  def test_only_counts_and_gauges(self):
+    with assert_raises( ValueError ):
+      RedisSet(self.client, hash_buckets=4, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisCount(self.client, hash_buckets=4, lua_insert=True, intervals=self.intervals)
+
+class RedisPackedSeriesTest(Chai):
+
+  def setUp(self):
+    super(RedisPackedSeriesTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60 } }
+
+  def test_values_are_appended(self):
+    series = RedisSeries(self.client, prefix='kairos', packed=True,
+      intervals=self.intervals)
+    series.bulk_insert( {60:{'test':[1.5, 2]}} )
+    assert_true( ('append', 'kairos:test:minute:1', struct.pack('<2d', 1.5, 2))
+      in self.pipe.commands )
+
+  def test_values_are_decoded(self):
+    series = RedisSeries(self.client, packed='i', read_func=str,
+      intervals=self.intervals)
+    assert_equals( ['3', '-4'], series._process_row(struct.pack('<2i', 3, -4)) )
+    assert_equals( [], series._process_row(None) )
+
+  def test_count_uses_strlen(self):
+    series = RedisSeries(self.client, packed='h', intervals=self.intervals)
+    self.pipe.execute = lambda: [ 6 ]
+    assert_equals( {60:3}, series.get('test', 'minute', timestamp=60, transform='count') )
+    assert_equals( [('strlen', 'test:minute:1')], self.pipe.commands )
+
+  def test_invalid_configuration(self):
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, packed='s', intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, packed=True, lua_insert=True, intervals=self.intervals)
+
+class RedisOrderedSeriesTest(Chai):
+
+  def setUp(self):
+    super(RedisOrderedSeriesTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60 } }
+
+  def test_values_are_scored_by_timestamp(self):
+    series = RedisSeries(self.client, ordered=True, intervals=self.intervals)
+    series.bulk_insert_arrays( ['test']*3, [61, 75, 61], [1, 2.5, u'x'] )
+
+    zadds = [ c for c in self.pipe.commands if c[:2]==('execute_command','ZADD') ]
+    assert_equals( 1, len(zadds) )
+    assert_equals( 'test:minute:1', zadds[0][2] )
+    assert_equals( [61, 61, 75], list(zadds[0][3::2]) )
+    members = zadds[0][4::2]
+    assert_equals( ['1', 'x', '2.5'], [ m[12:] for m in members ] )
+    assert_equals( sorted(members[:2]), list(members[:2]) )
+
+  def test_values_are_read_without_prefix(self):
+    series = RedisSeries(self.client, ordered=True, read_func=int,
+      intervals=self.intervals)
+    series.insert( 'test', 3, timestamp=61 )
+    series.insert( 'test', 3, timestamp=61 )
+    members = [ c[4] for c in self.pipe.commands if c[0]=='execute_command' ]
+    assert_not_equals( members[0], members[1] )
+    assert_equals( [3, 3], series._process_row(members) )
+
+  def test_get_range(self):
+    series = RedisSeries(self.client, ordered=True, intervals=self.intervals)
+    self.pipe.execute = lambda: [ [] ]
+    series.get('test', 'minute', timestamp=61, start=70, end=80)
+    series.get('test', 'minute', timestamp=61, start=70)
+    series.get('test', 'minute', timestamp=61)
+    assert_equals( [('zrangebyscore', 'test:minute:1', 70, 80),
+      ('zrangebyscore', 'test:minute:1', 70, '+inf'),
+      ('zrange', 'test:minute:1', 0, -1)], self.pipe.commands )
+
+  def test_series_exact_range(self):
+    series = RedisSeries(self.client, ordered=True, intervals=self.intervals)
+    self.pipe.execute = lambda: [ 4, 2 ]
+    assert_equals( {60:4, 120:2}, series.series('test', 'minute', start=70,
+      end=130, exact=True, transform='count') )
+    assert_equals( [('zcount', 'test:minute:1', 70, 130),
+      ('zcount', 'test:minute:2', 70, 130)], self.pipe.commands )
+
+  def test_invalid_configuration(self):
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, ordered=True, packed=True, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, ordered=True, lua_insert=True, intervals=self.intervals)
+
+class RedisBoundedSeriesTest(Chai):
+
+  def setUp(self):
+    super(RedisBoundedSeriesTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.intervals = { 'minute' : { 'step' : 60, 'steps' : 2, 'max_values' : 3 } }
+
+  def test_insert_trims_and_counts(self):
+    series = RedisSeries(self.client, intervals=self.intervals)
+    now = time.time()
+    series.bulk_insert( {now:{'test':[1, 2]}} )
+    key = 'test:minute:%d'%(now//60)
+    assert_true( ('ltrim', key, -3, -1) in self.pipe.commands )
+    assert_true( ('incrby', key+':total', 2) in self.pipe.commands )
+    assert_equals( set([key, key+':total']), set(k for k,ttl in self.pipe.expires()) )
+
+  def test_read_sample(self):
+    series = RedisSeries(self.client, read_func=int, intervals=self.intervals)
+    self.pipe.execute = lambda: [ ['3', '4'], '9' ]
+    row = series.get( 'test', 'minute', timestamp=60, transform='count' )
+    assert_equals( {60:9}, row )
+    assert_equals( [('lrange', 'test:minute:1', 0, -1), ('get', 'test:minute:1:total')],
+      self.pipe.commands )
+
+  def test_invalid_configuration(self):
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, packed=True, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, lua_insert=True, intervals=self.intervals)
+
+class RedisCappedTest(Chai):
+
+  def setUp(self):
+    super(RedisCappedTest,self).setUp()
+    self.client = mock()
+    self.pipe = RecordingPipeline()
+    self.client.pipeline = lambda transaction: self.pipe
+    self.calls = []
+    self.client.register_script = lambda script: \
+      lambda keys, args, client: self.calls.append( (keys, args) )
+    self.intervals = { 'minute' : { 'step' : 60, 'max_cardinality' : 3 } }
+    self.now = time.time()
+    self.key = 'test:minute:%d'%(self.now//60)
+
+  def test_histogram_insert_uses_script(self):
+    series = RedisHistogram(self.client, intervals=self.intervals)
+    self.pipe.execute = lambda: [ 1, ['test', 'minute', 2] ]
+    overflows = []
+    series._overflow_func = lambda *args: overflows.append( args )
+    series.insert( 'test', 5, timestamp=self.now )
+
+    assert_equals( [ ([self.key], [3, 'test', 'minute', OVERFLOW_VALUE, 5, 1]) ],
+      self.calls )
+    assert_equals( [('test', 'minute', 2)], overflows )
+    assert_equals( 2, series.overflowed )
+
+  def test_set_insert_uses_script(self):
+    series = RedisSet(self.client, intervals=self.intervals)
+    self.pipe.execute = lambda: [ 1, None ]
+    series.insert( 'test', 'a', timestamp=self.now )
+
+    assert_equals( [ ([self.key], [3, 'test', 'minute', 'a']) ],
+      self.calls )
+    assert_equals( 0, series.overflowed )
+
+  def test_invalid_configuration(self):
+    with assert_raises( ValueError ):
+      RedisCount(self.client, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisSeries(self.client, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisHistogram(self.client, lua_insert=True, intervals=self.intervals)
+    with assert_raises( ValueError ):
+      RedisHistogram(mock(), cluster=True, intervals=self.intervals)
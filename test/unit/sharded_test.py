@@ -0,0 +1,134 @@
+'''
+Unit tests for sharded timeseries
+'''
+from chai import Chai
+
+from kairos.sharded import *
+from kairos.redis_backend import RedisCount, RedisSeries
+from kairos.timeseries import BucketStats
+import redis
+
+INTERVALS = {
+  'minute' : { 'step' : 60 },
+  'hour' : { 'step' : 3600, 'resolution' : 600 },
+}
+
+class HashRingTest(Chai):
+
+  def test_keys_are_distributed(self):
+    ring = HashRing(['a','b','c'])
+    counts = {}
+    for i in xrange(3000):
+      node = ring.get('name%d'%(i))
+      counts[node] = counts.get(node,0) + 1
+    assert_equals( set(['a','b','c']), set(counts) )
+    for count in counts.values():
+      assert_true( 700 < count < 1300 )
+
+  def test_adding_a_node_moves_few_keys(self):
+    before = HashRing(['a','b','c'])
+    after = HashRing(['a','b','c','d'])
+    moved = [ i for i in xrange(3000)
+      if before.get('name%d'%(i))!=after.get('name%d'%(i)) ]
+    assert_true( len(moved) < 1200 )
+    for i in moved:
+      assert_equals( 'd', after.get('name%d'%(i)) )
+
+  def test_unicode_keys(self):
+    ring = HashRing(['a','b'])
+    assert_equals( ring.get('caf\xc3\xa9'), ring.get(u'caf\xe9') )
+
+class ShardedTimeseriesTest(Chai):
+
+  def setUp(self):
+    super(ShardedTimeseriesTest,self).setUp()
+    self.shards = [ RedisCount(mock(), intervals=INTERVALS) for _ in range(2) ]
+    self.series = ShardedTimeseries(self.shards)
+    # Find a name that lives on each shard
+    names = [ 'name%d'%(i) for i in xrange(100) ]
+    self.a = [ n for n in names if self.series.shard(n) is self.shards[0] ][0]
+    self.b = [ n for n in names if self.series.shard(n) is self.shards[1] ][0]
+
+  def test_clients_are_wrapped(self):
+    series = ShardedTimeseries({'x':redis.Redis(), 'y':redis.Redis()}, type='count',
+      intervals=INTERVALS)
+    assert_equals( set(['x','y']), set(series._shards.keys()) )
+    for shard in series._shards.values():
+      assert_true( isinstance(shard, RedisCount) )
+    assert_true( series._intervals is INTERVALS )
+
+  def test_bulk_insert_is_split(self):
+    expect( self.shards[0].bulk_insert ).args( {60:{self.a:[1]}}, 0 )
+    expect( self.shards[1].bulk_insert ).args( {60:{self.b:[2]}, 120:{self.b:[3]}}, 0 )
+    self.series.bulk_insert( {60:{self.a:[1], self.b:[2]}, 120:{self.b:[3]}} )
+
+  def test_bulk_insert_arrays_is_split(self):
+    expect( self.shards[0].bulk_insert_arrays ).args( [self.a], [60], [1], 0 )
+    expect( self.shards[1].bulk_insert_arrays ).args( [self.b,self.b], [60,120], [2,3], 0 )
+    self.series.bulk_insert_arrays( [self.a,self.b,self.b], [60,60,120], [1,2,3] )
+
+  def test_insert_raises_from_shard(self):
+    expect( self.shards[1].bulk_insert ).raises( IOError )
+    expect( self.shards[0].bulk_insert ).any_order()
+    with assert_raises( IOError ):
+      self.series.bulk_insert( {60:{self.a:[1], self.b:[2]}} )
+
+  def test_list_is_union(self):
+    expect( self.shards[0].list ).returns( [self.a, 'both'] )
+    expect( self.shards[1].list ).returns( [self.b, 'both'] )
+    assert_equals( set([self.a,self.b,'both']), set(self.series.list()) )
+
+  def test_get_is_joined(self):
+    config = self.shards[0]._intervals['minute']
+    expect( self.shards[0]._get_multi ).args( [self.a], 'minute', config, 60,
+      fetch=None, process_row=self.shards[0]._process_row ).returns( [{60:3}] )
+    expect( self.shards[1]._get_multi ).args( [self.b], 'minute', config, 60,
+      fetch=None, process_row=self.shards[1]._process_row ).returns( [{60:4}] )
+    assert_equals( {60:7}, self.series.get([self.b,self.a], 'minute', timestamp=60) )
+
+  def test_series_is_joined(self):
+    expect( self.shards[0]._series_multi ).returns(
+      [OrderedDict([(0, OrderedDict([(0,1)])), (3600, OrderedDict([(3600,2)]))])] )
+    expect( self.shards[1]._series_multi ).returns(
+      [OrderedDict([(0, OrderedDict([(600,3)])), (3600, OrderedDict([(3600,4)]))])] )
+    assert_equals(
+      OrderedDict([(0, OrderedDict([(0,1),(600,3)])), (3600, OrderedDict([(3600,6)]))]),
+      self.series.series([self.a,self.b], 'hour', start=0, steps=2) )
+
+  def test_single_name_is_routed(self):
+    expect( self.shards[1]._get ).returns( {60:4} )
+    assert_equals( {60:4}, self.series.get(self.b, 'minute', timestamp=60) )
+    expect( self.shards[1].delete ).args( self.b )
+    self.series.delete( self.b )
+
+  def test_single_name_uses_shard_methods(self):
+    expect( self.shards[1].get ).args( self.b, 'minute', timestamp=60 ).returns( {60:4} )
+    assert_equals( {60:4}, self.series.get(self.b, 'minute', timestamp=60) )
+    expect( self.shards[1].series ).args( self.b, 'minute', steps=2 ).returns( {60:4} )
+    assert_equals( {60:4}, self.series.series(self.b, 'minute', steps=2) )
+
+  def test_multi_name_kwargs_are_rewritten(self):
+    shards = [ RedisSeries(mock(), intervals=INTERVALS) for _ in range(2) ]
+    series = ShardedTimeseries(shards)
+    b = [ 'name%d'%(i) for i in xrange(100) if series.shard('name%d'%(i)) is shards[1] ][0]
+    expect( shards[1]._get_multi ).args( [b], 'minute', shards[0]._intervals['minute'],
+      60, fetch=shards[1]._stats_get, process_row=shards[1]._stats_row ).returns( [{60:BucketStats(3)}] )
+    assert_equals( {60:3}, series.get([b], 'minute', timestamp=60, transform='count') )
+
+  def test_multi_name_transform_is_after_join(self):
+    shards = [ RedisSeries(mock(), intervals=INTERVALS) for _ in range(2) ]
+    series = ShardedTimeseries(shards)
+    names = [ 'name%d'%(i) for i in xrange(100) ]
+    a = [ n for n in names if series.shard(n) is shards[0] ][0]
+    b = [ n for n in names if series.shard(n) is shards[1] ][0]
+    expect( shards[0]._get_multi ).returns( [{60:[1,2]}] )
+    expect( shards[1]._get_multi ).returns( [{60:[6]}] )
+    assert_equals( {60:3}, series.get([a,b], 'minute', timestamp=60,
+      transform=lambda data,step_size: sum(data)/len(data)) )
+
+  def test_bulk_insert_kwargs_are_passed(self):
+    pipe = mock()
+    expect( self.shards[0].bulk_insert ).args( {60:{self.a:[1]}}, 0, pipeline=pipe )
+    self.series.bulk_insert( {60:{self.a:[1]}}, pipeline=pipe )
+    expect( self.shards[0].bulk_insert_arrays ).args( [self.a], [60], [1], 0, pipeline=pipe )
+    self.series.bulk_insert_arrays( [self.a], [60], [1], pipeline=pipe )
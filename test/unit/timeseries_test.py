@@ -2,6 +2,7 @@
 Functional tests for timeseries core
 '''
 import time
+import calendar
 from datetime import datetime
 
 from kairos.timeseries import *
@@ -12,6 +13,73 @@ class UrlTest(Chai):
     with assert_raises(ImportError):
       Timeseries("noop://foo/bar")
 
+class BucketizeTest(Chai):
+
+  def test_bucketize(self):
+    series = Count(mock(), intervals={
+      'minute' : { 'step' : 60 },
+      'hour' : { 'step' : '1h', 'resolution' : 60 },
+    })
+    timestamps = [0, 59.9, 60, 3599, 3600, 7261.5]
+
+    i_buckets, r_buckets = series.bucketize('minute', timestamps)
+    assert_equals( [0, 0, 1, 59, 60, 121], list(i_buckets) )
+    assert_equals( [0, 0, 1, 59, 60, 121], list(r_buckets) )
+
+    i_buckets, r_buckets = series.bucketize('hour', timestamps)
+    assert_equals( [0, 0, 0, 0, 1, 2], list(i_buckets) )
+    assert_equals( [0, 0, 1, 59, 60, 121], list(r_buckets) )
+
+    with assert_raises( UnknownInterval ):
+      series.bucketize('day', timestamps)
+
+class SampleTest(Chai):
+
+  def setUp(self):
+    super(SampleTest,self).setUp()
+    self.series = Series(mock(), intervals={ 'minute' : { 'step' : 60 } })
+
+  def test_transforms_use_total(self):
+    data = Sample([2, 4], 10)
+    assert_equals( 10, self.series._transform(data, 'count', 60) )
+    assert_equals( 0.5, self.series._transform(data, 'rate', 20) )
+    assert_equals( 3.0, self.series._transform(data, 'mean', 60) )
+    assert_equals( 2, self.series._transform([2, 4], 'count', 60) )
+
+  def test_join(self):
+    rval = self.series._join( [Sample([1], 5), None, [2, 3]] )
+    assert_equals( [1, 2, 3], rval )
+    assert_equals( 7, rval.total )
+    assert_false( isinstance(self.series._join([[1], [2]]), Sample) )
+
+    rval = self.series._condense( {0:Sample([1], 5), 60:Sample([2], 2)} )
+    assert_equals( 7, rval.total )
+
+class OverflowTest(Chai):
+
+  def setUp(self):
+    super(OverflowTest,self).setUp()
+    self.series = Histogram(mock(), read_func=int, intervals={ 'minute' : { 'step' : 60 } })
+
+  def test_process_row(self):
+    rval = self.series._process_row( {'1':2, OVERFLOW_VALUE:3} )
+    assert_equals( {1:2, None:3}, rval )
+
+  def test_transforms_only_count_overflow(self):
+    data = {1:2, 4:1, None:3}
+    assert_equals( 6, self.series._transform(data, 'count', 60) )
+    assert_equals( 2.0, self.series._transform(data, 'mean', 60) )
+    assert_equals( 4, self.series._transform(data, 'max', 60) )
+    assert_equals( 6, self.series._transform(data, 'sum', 60) )
+
+  def test_overflow(self):
+    calls = []
+    self.series._overflow_func = lambda *args: calls.append( args )
+    self.series._overflow( 'test', 'minute', 2 )
+    self.series._overflow( 'test', 'minute', 1 )
+    assert_equals( 3, self.series.overflowed )
+    assert_equals( [('test','minute',2), ('test','minute',1)], calls )
+
 class RelativeTimeTest(Chai):
 
   def test_step_size(self):
@@ -28,6 +96,15 @@ class RelativeTimeTest(Chai):
     assert_equals( 3*DAY, rt.step_size(0, 2*DAY+1) )
     assert_equals( 2*DAY, rt.step_size(DAY+1, 2*DAY) )
 
+  def test_bucketize(self):
+    DAY = 60*60*24
+    rt = RelativeTime( DAY )
+    timestamps = [0, DAY-1, DAY, 2.5*DAY, 40*DAY+1]
+    assert_equals( [rt.to_bucket(t) for t in timestamps],
+      list(rt.bucketize(timestamps)) )
+    assert_equals( [rt.to_bucket(t, -2) for t in timestamps],
+      list(rt.bucketize(timestamps, -2)) )
+
   def test_ttl(self):
     DAY = 60*60*24
     rt = RelativeTime( DAY )
@@ -45,7 +122,7 @@ class GregorianTimeTest(Chai):
     gt = GregorianTime( 'daily' )
     buckets = gt.buckets( 0, 60*60*24*42 )
     assert_equals( buckets[:3], [19700101, 19700102, 19700103] )
-    assert_equals( buckets[-3:], [19700209, 19700210, 19700211] )
+    assert_equals( buckets[-3:], [19700210, 19700211, 19700212] )
 
     gt = GregorianTime( 'weekly' )
     buckets = gt.buckets( 0, 60*60*24*25 )
@@ -59,6 +136,57 @@ class GregorianTimeTest(Chai):
     buckets = gt.buckets( 0, 60*60*24*800 )
     assert_equals( buckets, [1970, 1971, 1972] )
 
+  def test_to_bucket(self):
+    t = calendar.timegm( datetime(year=2012, month=2, day=29, hour=13).timetuple() )
+
+    gt = GregorianTime( 'daily' )
+    assert_equals( 20120229, gt.to_bucket(t) )
+    assert_equals( 20120301, gt.to_bucket(t, 1) )
+    assert_equals( 20111231, gt.to_bucket(t, -60) )
+
+    gt = GregorianTime( 'weekly' )
+    assert_equals( 201209, gt.to_bucket(t) )
+    assert_equals( 201152, gt.to_bucket(t, -9) )
+    assert_equals( 201300, gt.to_bucket(t, 44) )
+
+    gt = GregorianTime( 'monthly' )
+    assert_equals( 201202, gt.to_bucket(t) )
+    assert_equals( 201301, gt.to_bucket(t, 11) )
+    assert_equals( 201112, gt.to_bucket(t, -2) )
+
+    gt = GregorianTime( 'yearly' )
+    assert_equals( 2012, gt.to_bucket(t) )
+    assert_equals( 2010, gt.to_bucket(t, -2) )
+
+  def test_from_bucket(self):
+    gt = GregorianTime( 'daily' )
+    t = calendar.timegm( datetime(year=2012, month=2, day=29).timetuple() )
+    assert_equals( t, gt.from_bucket(20120229) )
+    assert_equals( datetime(year=2012, month=2, day=29),
+      gt.from_bucket(20120229, native=True) )
+
+    gt = GregorianTime( 'weekly' )
+    t = calendar.timegm( datetime(year=2012, month=1, day=15).timetuple() )
+    assert_equals( t, gt.from_bucket(201202) )
+
+    gt = GregorianTime( 'monthly' )
+    t = calendar.timegm( datetime(year=2012, month=2, day=1).timetuple() )
+    assert_equals( t, gt.from_bucket(201202) )
+
+    gt = GregorianTime( 'yearly' )
+    t = calendar.timegm( datetime(year=2012, month=1, day=1).timetuple() )
+    assert_equals( t, gt.from_bucket(2012) )
+
+  def test_bucketize(self):
+    DAY = 60*60*24
+    timestamps = [0, DAY-1, 59*DAY+1, 366*DAY, 15000*DAY+3600.5]
+    for step in ('daily', 'weekly', 'monthly', 'yearly'):
+      gt = GregorianTime( step )
+      assert_equals( [gt.to_bucket(t) for t in timestamps],
+        list(gt.bucketize(timestamps)) )
+      assert_equals( [gt.to_bucket(t, 3) for t in timestamps],
+        list(gt.bucketize(timestamps, 3)) )
+
   def test_step_size(self):
     DAY = 60*60*24
     gtd = GregorianTime( 'daily' )
@@ -66,11 +194,11 @@ class GregorianTimeTest(Chai):
     gty = GregorianTime( 'yearly' )
 
     # leap year
-    t0 = time.mktime( datetime(year=2012, month=1, day=1).timetuple() )
-    t1 = time.mktime( datetime(year=2012, month=1, day=5).timetuple() )
-    t2 = time.mktime( datetime(year=2012, month=2, day=13).timetuple() )
-    t3 = time.mktime( datetime(year=2012, month=2, day=29).timetuple() )
-    t4 = time.mktime( datetime(year=2012, month=3, day=5).timetuple() )
+    t0 = calendar.timegm( datetime(year=2012, month=1, day=1).timetuple() )
+    t1 = calendar.timegm( datetime(year=2012, month=1, day=5).timetuple() )
+    t2 = calendar.timegm( datetime(year=2012, month=2, day=13).timetuple() )
+    t3 = calendar.timegm( datetime(year=2012, month=2, day=29).timetuple() )
+    t4 = calendar.timegm( datetime(year=2012, month=3, day=5).timetuple() )
 
     assert_equals( DAY, gtd.step_size(t0) )
     assert_equals( 31*DAY, gtm.step_size(t0) )
@@ -84,11 +212,11 @@ class GregorianTimeTest(Chai):
     assert_equals( 60*DAY, gtm.step_size(t2, t4) )
 
     # not-leap year
-    t0 = time.mktime( datetime(year=2013, month=1, day=1).timetuple() )
-    t1 = time.mktime( datetime(year=2013, month=1, day=5).timetuple() )
-    t2 = time.mktime( datetime(year=2013, month=2, day=13).timetuple() )
-    t3 = time.mktime( datetime(year=2013, month=2, day=28).timetuple() )
-    t4 = time.mktime( datetime(year=2013, month=3, day=5).timetuple() )
+    t0 = calendar.timegm( datetime(year=2013, month=1, day=1).timetuple() )
+    t1 = calendar.timegm( datetime(year=2013, month=1, day=5).timetuple() )
+    t2 = calendar.timegm( datetime(year=2013, month=2, day=13).timetuple() )
+    t3 = calendar.timegm( datetime(year=2013, month=2, day=28).timetuple() )
+    t4 = calendar.timegm( datetime(year=2013, month=3, day=5).timetuple() )
 
     assert_equals( DAY, gtd.step_size(t0) )
     assert_equals( 31*DAY, gtm.step_size(t0) )